@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+
+# Compare the most common tree navigation, undo and alarm queries on a
+# synthetic database before and after creating the indexes added with core 5,
+# links 2 and organism_alarms 2
+# Usage: benchmark_db_indexes.py [number_of_items]
+
+import sys
+import random
+import sqlite3
+import time
+
+ITEMS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+CHILDREN = 50
+GROUP = 10
+REPEAT = 200
+
+CREATE = (
+    "CREATE TABLE Items (I_id INTEGER PRIMARY KEY, I_parent INTEGER, "
+                                        "I_previous INTEGER, I_text TEXT)",
+    "CREATE TABLE History (H_id INTEGER PRIMARY KEY, H_group INTEGER, "
+                        "H_status INTEGER, H_item INTEGER, H_type TEXT, "
+                        "H_tstamp INTEGER, H_description TEXT, H_redo TEXT, "
+                        "H_undo TEXT)",
+    "CREATE TABLE Alarms (A_id INTEGER PRIMARY KEY, A_item INTEGER, "
+                        "A_start INTEGER, A_end INTEGER, A_alarm INTEGER, "
+                        "A_snooze INTEGER)",
+    "CREATE TABLE Links (L_id INTEGER, L_target INTEGER)",
+)
+
+INDEXES = (
+    'CREATE INDEX Items_parent_previous ON Items (I_parent, I_previous)',
+    'CREATE INDEX Items_previous ON Items (I_previous)',
+    'CREATE INDEX History_group ON History (H_group)',
+    'CREATE INDEX History_status ON History (H_status, H_group)',
+    'CREATE INDEX Alarms_item ON Alarms (A_item)',
+    'CREATE INDEX Links_id ON Links (L_id)',
+    'CREATE INDEX Links_target ON Links (L_target)',
+)
+
+
+def populate(cursor):
+    for query in CREATE:
+        cursor.execute(query)
+
+    previous = {}
+
+    for id_ in range(1, ITEMS + 1):
+        parent = (id_ - 1) // CHILDREN
+        cursor.execute('INSERT INTO Items VALUES (?, ?, ?, ?)', (id_, parent,
+                                            previous.get(parent, 0), 'Item'))
+        previous[parent] = id_
+        cursor.execute('INSERT INTO History VALUES (NULL, ?, 5, ?, "insert", '
+                                        '0, "Insert item", "[]", "[]")',
+                                        (id_ // GROUP + 1, id_))
+
+        if id_ % 4 == 0:
+            cursor.execute('INSERT INTO Alarms VALUES (NULL, ?, 0, NULL, 0, '
+                                                            'NULL)', (id_, ))
+
+        if id_ % 8 == 0:
+            cursor.execute('INSERT INTO Links VALUES (?, ?)', (id_,
+                                                random.randint(1, ITEMS)))
+
+
+def walk_children(cursor, parent):
+    cursor.execute('SELECT I_id FROM Items WHERE I_parent=? AND I_previous=? '
+                                                        'LIMIT 1', (parent, 0))
+    row = cursor.fetchone()
+
+    while row:
+        cursor.execute('SELECT I_id FROM Items WHERE I_previous=? LIMIT 1',
+                                                                    (row[0], ))
+        row = cursor.fetchone()
+
+
+def bench(cursor):
+    parents = [random.randint(0, ITEMS // CHILDREN - 1)
+                                                    for n in range(REPEAT)]
+    groups = [random.randint(1, ITEMS // GROUP) for n in range(REPEAT)]
+    ids = [random.randint(1, ITEMS) for n in range(REPEAT)]
+    results = []
+
+    start = time.time()
+    for parent in parents:
+        walk_children(cursor, parent)
+    results.append(('Sibling walk', time.time() - start))
+
+    start = time.time()
+    for group in groups:
+        cursor.execute('SELECT H_id, H_item, H_type, H_undo FROM History '
+                        'WHERE H_group=? ORDER BY H_id DESC', (group, ))
+        cursor.fetchall()
+    results.append(('Undo group', time.time() - start))
+
+    start = time.time()
+    for id_ in ids:
+        cursor.execute('SELECT A_id FROM Alarms WHERE A_item=?', (id_, ))
+        cursor.fetchall()
+    results.append(('Item alarms', time.time() - start))
+
+    start = time.time()
+    for id_ in ids:
+        cursor.execute('SELECT L_id FROM Links WHERE L_target=?', (id_, ))
+        cursor.fetchall()
+    results.append(('Link backreferences', time.time() - start))
+
+    return results
+
+
+def main():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    random.seed(0)
+    populate(cursor)
+    conn.commit()
+
+    random.seed(1)
+    before = bench(cursor)
+
+    for query in INDEXES:
+        cursor.execute(query)
+
+    random.seed(1)
+    after = bench(cursor)
+
+    print('{} items, {} repetitions per query'.format(ITEMS, REPEAT))
+
+    for (name, tbefore), (name, tafter) in zip(before, after):
+        print('{:<20} {:>10.4f} s {:>10.4f} s {:>8.1f}x'.format(name, tbefore,
+                                    tafter, tbefore / max(tafter, 1e-9)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+
+# Compare the per-row cost of inserting history rows when the History table is
+# trimmed after every row (core < 5) and when trimming is deferred until the
+# history group is committed, for growing History table sizes
+# Usage: benchmark_history_trim.py [rows_per_group]
+
+import sys
+import sqlite3
+import time
+
+GROUP_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+SIZES = (1000, 10000, 50000, 100000)
+# Same values as the default History configuration
+LIMITS = (60, 15, 120)
+
+CREATE = (
+    "CREATE TABLE History (H_id INTEGER PRIMARY KEY, H_group INTEGER, "
+                        "H_status INTEGER, H_item INTEGER, H_type TEXT, "
+                        "H_tstamp INTEGER, H_description TEXT, H_redo TEXT, "
+                        "H_undo TEXT)",
+    'CREATE INDEX History_group ON History (H_group)',
+    'CREATE INDEX History_status ON History (H_status, H_group)',
+)
+
+INSERT = ('INSERT INTO History (H_id, H_group, H_status, H_item, H_type, '
+          'H_tstamp, H_description, H_redo, H_undo) '
+          'VALUES (NULL, ?, 1, ?, "insert", strftime("%s", "now"), '
+          '"Insert item", "[]", "[]")')
+
+TRIM = ('''
+DELETE FROM History WHERE H_group < (
+    SELECT MIN(H_group) FROM (
+        SELECT H_group FROM (
+            SELECT DISTINCT H_group FROM History ORDER BY H_group DESC LIMIT ?
+        )
+        UNION
+        SELECT H_group FROM (
+            SELECT DISTINCT H_group FROM History
+            WHERE H_tstamp >= strftime("%s", "now") - ? * 60
+            ORDER BY H_group DESC LIMIT ?
+        )
+    )
+)''')
+
+
+def make_history(size):
+    # All the rows belong to few big groups, so that the trim query does not
+    # shrink the table while measuring
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+
+    for query in CREATE:
+        cursor.execute(query)
+
+    groups = LIMITS[0] - 1
+    cursor.executemany(INSERT, ((n % groups + 1, n) for n in xrange(size)))
+    conn.commit()
+
+    return conn
+
+
+def insert_group(conn, deferred):
+    cursor = conn.cursor()
+    cursor.execute('SELECT MAX(H_group) FROM History')
+    group = cursor.fetchone()[0] + 1
+
+    start = time.time()
+
+    for n in xrange(GROUP_ROWS):
+        cursor.execute(INSERT, (group, n))
+
+        if not deferred:
+            cursor.execute(TRIM, LIMITS)
+
+    if deferred:
+        cursor.execute(TRIM, LIMITS)
+
+    return (time.time() - start) / GROUP_ROWS
+
+
+def main():
+    print('{} rows per group'.format(GROUP_ROWS))
+    print('{:>10} {:>16} {:>16}'.format('History', 'per-row trim',
+                                                            'deferred trim'))
+
+    for size in SIZES:
+        results = []
+
+        for deferred in (False, True):
+            conn = make_history(size)
+            results.append(insert_group(conn, deferred))
+            conn.close()
+
+        print('{:>10} {:>13.1f} us {:>13.1f} us'.format(size,
+                                    results[0] * 1e6, results[1] * 1e6))
+
+if __name__ == '__main__':
+    main()
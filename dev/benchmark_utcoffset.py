@@ -0,0 +1,52 @@
+#!/usr/bin/env python2
+
+# Compare the time needed to compute the local UTC offsets of a year of
+# minute-spaced timestamps with time.localtime (UTCOffset._compute_variable)
+# and with the DST transition tables, checking that the results match
+# Usage: benchmark_utcoffset.py [time_zone]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'src'))
+
+from outspline.static.pyaux.timeaux import UTCOffset
+
+os.environ['TZ'] = sys.argv[1] if len(sys.argv) > 1 else 'Europe/Paris'
+time.tzset()
+
+START = 1420070400
+STEP = 60
+TIMESTAMPS = range(START, START + 366 * 86400, STEP)
+
+
+def main():
+    print('{}, {} timestamps'.format(os.environ['TZ'], len(TIMESTAMPS)))
+
+    start = time.time()
+    expected = [UTCOffset._compute_variable(t) for t in TIMESTAMPS]
+    tlocaltime = time.time() - start
+
+    utcoffset = UTCOffset()
+
+    start = time.time()
+    results = [utcoffset.compute(t) for t in TIMESTAMPS]
+    tcompute = time.time() - start
+
+    # The tables are now cached: measure compute_many with a new instance
+    start = time.time()
+    results_many = UTCOffset().compute_many(TIMESTAMPS)
+    tmany = time.time() - start
+
+    assert results == expected
+    assert results_many == expected
+
+    for name, elapsed in (('localtime', tlocaltime), ('compute', tcompute),
+                                                ('compute_many', tmany)):
+        print('{:<14} {:>8.3f} s {:>8.1f}x'.format(name, elapsed,
+                                            tlocaltime / max(elapsed, 1e-9)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python2
+
+# Check that the bounded expansion of except_regularly rules, which only
+# generates the except periods that can affect the item's occurrences, excepts
+# the same occurrences as the original loop, which stepped through all the
+# periods between the item's first and last occurrences (bug #329), on random
+# items and ranges, especially around DST changes; also check that a stopped
+# search aborts the expansion of an except rule
+# The application APIs cannot be initialized outside Outspline, so only the
+# few names that organism's items and the basic rules need are provided here
+# Usage: check_except_regularly.py [time_zone] [tests] [seed]
+
+import os
+import sys
+import time
+import types
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'src'))
+
+os.environ['TZ'] = sys.argv[1] if len(sys.argv) > 1 else 'Europe/Paris'
+time.tzset()
+
+TESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+SEED = int(sys.argv[3]) if len(sys.argv) > 3 else int(time.time())
+
+
+class Event(object):
+    def bind(self, handler, bind=True):
+        pass
+
+    def signal(self, **kwargs):
+        pass
+
+
+class Configuration(object):
+    def get_int(self, key):
+        return {'parallel_search_processes': 0,
+                'parallel_search_min_rules': 0}[key]
+
+
+def _install_apis():
+    import outspline
+    import outspline.extensions
+
+    coreaux_api = types.ModuleType('outspline.coreaux_api')
+    coreaux_api.OutsplineError = Exception
+    coreaux_api.Event = Event
+    coreaux_api.log = logging.getLogger('check')
+    coreaux_api.get_extension_configuration = lambda name: Configuration()
+    sys.modules['outspline.coreaux_api'] = coreaux_api
+    outspline.coreaux_api = coreaux_api
+
+    core_api = types.ModuleType('outspline.core_api')
+    sys.modules['outspline.core_api'] = core_api
+    outspline.core_api = core_api
+
+    # Do not run organism's __init__, which needs the running application
+    package = types.ModuleType('outspline.extensions.organism')
+    package.__path__ = [os.path.join(outspline.extensions.__path__[0],
+                                                                'organism')]
+    sys.modules['outspline.extensions.organism'] = package
+
+    from outspline.extensions.organism import items
+
+    rules = items.Rules()
+
+    # The basic rules install their handlers in this Rules object like they
+    # do in organism's
+    organism_api = types.ModuleType('outspline.extensions.organism_api')
+    organism_api.Occurrence = items.Occurrence
+    organism_api.install_rule_handler = rules.install_rule_handler
+    organism_api.install_rule_span_handler = rules.install_rule_span_handler
+    organism_api.install_rule_compiler = rules.install_rule_compiler
+    sys.modules['outspline.extensions.organism_api'] = organism_api
+    outspline.extensions.organism_api = organism_api
+
+    organism_timer_api = types.ModuleType(
+                                    'outspline.extensions.organism_timer_api')
+    organism_timer_api.install_rule_handler = rules.install_next_rule_handler
+    sys.modules['outspline.extensions.organism_timer_api'] = \
+                                                            organism_timer_api
+    outspline.extensions.organism_timer_api = organism_timer_api
+
+    return rules
+
+
+RULES = _install_apis()
+
+from outspline.static.pyaux.timeaux import UTCOffset
+from outspline.extensions.organism import items
+from outspline.extensions import organism_basicrules
+from outspline.extensions.organism_basicrules import (occur_once,
+                    occur_regularly, occur_regularly_group, except_regularly)
+
+organism_basicrules.main()
+
+H = 3600
+D = 86400
+T0 = 1400000000
+
+
+def search_loop_local(mint, utcmint, maxt, utcoffset, filename, id_, rule,
+                                                                        occs):
+    # The original implementation of get_occurrences_range_local
+    limits = occs.get_item_time_span(filename, id_)
+
+    if limits:
+        minstart, maxend = limits
+        interval = rule['#'][1]
+        rend = rule['#'][4]
+        inclusive = rule['#'][5]
+        start = occur_regularly.compute_min_time(minstart -
+                            utcoffset.compute(minstart), rule['#'][0],
+                            interval, rule['#'][2], rule['#'][3]) - interval
+
+        while True:
+            sstart = start + utcoffset.compute(start)
+            send = sstart + rend
+
+            if sstart > maxend:
+                break
+            elif send >= minstart:
+                occs.except_safe(filename, id_, sstart, send, inclusive)
+
+            start += interval
+
+
+def search_loop_UTC(mint, utcmint, maxt, utcoffset, filename, id_, rule,
+                                                                        occs):
+    # The original implementation of get_occurrences_range_UTC
+    limits = occs.get_item_time_span(filename, id_)
+
+    if limits:
+        minstart, maxend = limits
+        interval = rule['#'][1]
+        rend = rule['#'][4]
+        inclusive = rule['#'][5]
+        start = occur_regularly.compute_min_time(minstart, rule['#'][0],
+                            interval, rule['#'][2], rule['#'][3]) - interval
+
+        while True:
+            end = start + rend
+
+            if start > maxend:
+                break
+            elif end >= minstart:
+                occs.except_safe(filename, id_, start, end, inclusive)
+
+            start += interval
+
+
+def make_loop_rules():
+    # The same handlers, except the except_regularly ones
+    rules = items.Rules()
+    rules.handlers.update(RULES.handlers)
+    rules.compilers.update(RULES.compilers)
+    rules.handlers[except_regularly._RULE_NAMES['local']] = search_loop_local
+    rules.handlers[except_regularly._RULE_NAMES['UTC']] = search_loop_UTC
+    return rules
+
+
+LOOP_RULES = make_loop_rules()
+
+
+class Database(object):
+    # The materialized occurrences are not used, so every range is searched
+    # through the rule handlers
+    version = 0
+
+    def __init__(self, itemrules):
+        self.itemrules = itemrules
+
+    def get_occurrences_range_rows(self, mint, maxt):
+        return None
+
+    def iter_valid_item_rules_range(self, mint, maxt):
+        return iter(self.itemrules)
+
+
+def make_random_occurrence_rule():
+    standard = random.choice(('local', 'UTC'))
+    choice = random.random()
+
+    if choice < 0.2:
+        start = T0 + random.randint(-200, 200) * H
+        return occur_once.make_rule(start, random.choice((None, start +
+                            random.randint(1, 80) * H)), random.choice((None,
+                            start - 600, start + 2 * H)), standard, None)
+    elif choice < 0.8:
+        return occur_regularly.make_rule(T0 + random.randint(-50, 50) * 600,
+                            random.choice((900, H, 6 * H, D, 7 * D)),
+                            random.choice((None, 1800, 20 * H, 100 * H)),
+                            random.choice((None, 300, -300, -30 * H, 20 * H)),
+                            standard, None)
+    else:
+        return occur_regularly_group.make_rule(T0, D, [0, 3 * H, 7 * H],
+                            random.choice((None, 1800, 30 * H)),
+                            random.choice((None, 120, -5 * H)), standard, None)
+
+
+def make_random_except_rule():
+    interval = random.choice((H, 6 * H, D, 7 * D, random.randint(600, 9 * D)))
+
+    return except_regularly.make_rule(T0 + random.randint(-500, 500) * 600,
+                            interval, random.randint(1, 2 * interval),
+                            random.choice((True, False)),
+                            random.choice(('local', 'UTC')), None)
+
+
+def make_random_rules():
+    # The except rules only affect the occurrences of the rules before them
+    rules = [make_random_occurrence_rule()
+                                    for n in xrange(random.randint(1, 3))]
+
+    for n in xrange(random.randint(1, 2)):
+        rules.insert(random.randint(0, len(rules)), make_random_except_rule())
+
+    return rules
+
+
+def make_random_range():
+    # Half of the ranges start close to a UTC offset change
+    mint = T0 + random.randint(-100, 100) * D + random.randint(0, D)
+
+    if random.random() < 0.5:
+        offset, limit = UTCOffset().compute_limit(mint)
+
+        if limit is not None:
+            mint = limit + random.randint(-3 * D, H)
+
+    return (mint, mint + random.choice((0, H, D, 7 * D,
+                                                random.randint(0, 60) * D)))
+
+
+def search(mint, maxt, rules, itemrules):
+    databases = {'f': Database([(id_, rules.compile_rules(irules))
+                                            for id_, irules in itemrules])}
+    search = items.OccurrencesRangeSearch(mint, maxt, ['f'], databases, rules)
+    search.start()
+    return sorted(occ.get_tuple() for occ in search.get_results().get_list())
+
+
+class ExceptCounter(object):
+    def __init__(self, occs):
+        self.except_safe = occs.except_safe
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.except_safe(*args)
+
+
+def check_stop(itemrules):
+    # Once the search is stopped, an except rule must abort as soon as it
+    # would except a period, instead of completing its expansion
+    mint = T0 - 100 * D
+    maxt = T0 + 100 * D
+    utcoffset = UTCOffset()
+    utcmint = mint - utcoffset.compute(mint)
+
+    for id_, irules in itemrules:
+        occs = items.OccurrencesRange(mint, maxt)
+
+        for rule in RULES.compile_rules(irules):
+            if not rule['rule'].startswith('except_regularly'):
+                rule.search_range(mint, utcmint, maxt, utcoffset, 'f', id_,
+                                                                rule, occs)
+                continue
+
+            # Only the rules that would except at least a period can be
+            # aborted
+            copy = occs.copy()
+            counter = ExceptCounter(copy)
+            copy.except_safe = counter
+            rule.search_range(mint, utcmint, maxt, utcoffset, 'f', id_, rule,
+                                                                        copy)
+
+            if counter.calls:
+                copy = occs.copy()
+                copy.stop()
+
+                try:
+                    rule.search_range(mint, utcmint, maxt, utcoffset, 'f',
+                                                        id_, rule, copy)
+                except items.OccurrencesRangeSearchStop:
+                    pass
+                else:
+                    return False
+
+            rule.search_range(mint, utcmint, maxt, utcoffset, 'f', id_, rule,
+                                                                        occs)
+
+    return True
+
+
+def main():
+    random.seed(SEED)
+    failures = 0
+    tloop = 0
+    tbounded = 0
+
+    for test in xrange(TESTS):
+        mint, maxt = make_random_range()
+        itemrules = [(id_, make_random_rules())
+                                for id_ in xrange(1, random.randint(2, 6))]
+
+        start = time.time()
+        expected = search(mint, maxt, LOOP_RULES, itemrules)
+        tloop += time.time() - start
+
+        start = time.time()
+        results = search(mint, maxt, RULES, itemrules)
+        tbounded += time.time() - start
+
+        if results != expected:
+            failures += 1
+            print('Mismatch: mint={} maxt={} rules={}'.format(mint, maxt,
+                                                                itemrules))
+            print('  loop:    {}'.format(expected))
+            print('  bounded: {}'.format(results))
+        elif not check_stop(itemrules):
+            failures += 1
+            print('Not stopped: rules={}'.format(itemrules))
+
+    print('{}, {} tests, seed {}, {} mismatches'.format(os.environ['TZ'],
+                                                    TESTS, SEED, failures))
+    print('loop {:.3f} s, bounded {:.3f} s'.format(tloop, tbounded))
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+
+# Check that the month table shared by the monthly and yearly rules computes
+# the same local times as time.mktime, which the rules used to call directly,
+# on every day of a range of years, especially in the time zones with unusual
+# DST changes
+# Usage: check_month_table.py [first_year] [last_year]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    '..', 'src', 'outspline', 'extensions',
+                    'organism_basicrules'))
+
+import monthtable
+
+FIRST_YEAR = int(sys.argv[1]) if len(sys.argv) > 1 else 1970
+LAST_YEAR = int(sys.argv[2]) if len(sys.argv) > 2 else 2040
+ZONES = ('UTC', 'Europe/Paris', 'America/New_York', 'America/Sao_Paulo',
+         'America/Santiago', 'Asia/Tehran', 'Australia/Lord_Howe',
+         'Australia/Sydney', 'Pacific/Apia')
+
+
+def main():
+    failures = 0
+
+    for zone in ZONES:
+        os.environ['TZ'] = zone
+        time.tzset()
+        tests = 0
+        start = time.time()
+
+        for year in xrange(FIRST_YEAR, LAST_YEAR + 1):
+            for month in xrange(1, 13):
+                for day in xrange(-1, 33):
+                    for hour, minute in ((0, 0), (random.randint(0, 3),
+                                    random.randint(0, 59)),
+                                    (random.randint(0, 23),
+                                    random.randint(0, 59)), (23, 59)):
+                        tests += 1
+                        result = monthtable.local_time(year, month, day, hour,
+                                                                        minute)
+
+                        try:
+                            expected = int(time.mktime((year, month, day,
+                                                hour, minute, 0, 0, 0, -1)))
+                        except (ValueError, OverflowError):
+                            expected = None
+
+                        # mktime normalizes the days out of the month, while
+                        #  the rules must skip them
+                        if not 0 < day <= monthtable.monthrange(year,
+                                                                month)[1]:
+                            expected = None
+
+                        if result != expected:
+                            failures += 1
+                            print('Mismatch: {} {}-{}-{} {}:{} {} {}'.format(
+                                        zone, year, month, day, hour, minute,
+                                        result, expected))
+
+        print('{}, {} tests in {:.3f} s'.format(zone, tests,
+                                                        time.time() - start))
+
+    print('{} mismatches'.format(failures))
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
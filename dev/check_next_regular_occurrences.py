@@ -0,0 +1,255 @@
+#!/usr/bin/env python2
+
+# Check that the direct computation of the next occurrences of occur_regularly
+# and occur_regularly_group rules gives the same results as the original
+# search loop, on random rules and base times, especially around DST changes;
+# also report how many local searches had to fall back to the loop because of
+# a UTC offset change
+# The application APIs cannot be initialized outside Outspline, so only the
+# few names that occur_regularly needs are provided here
+# Usage: check_next_regular_occurrences.py [time_zone] [tests]
+
+import os
+import sys
+import time
+import types
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'src'))
+
+os.environ['TZ'] = sys.argv[1] if len(sys.argv) > 1 else 'Europe/Paris'
+time.tzset()
+
+TESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+class Occurrence(object):
+    def __init__(self, filename, id_, start, end, alarm):
+        self.filename = filename
+        self.id_ = id_
+        self.start = start
+        self.end = end
+        self.alarm = alarm
+
+    def get_tuple(self):
+        return (self.filename, self.id_, self.start, self.end, self.alarm)
+
+
+def _install_apis():
+    import outspline
+    import outspline.extensions
+
+    coreaux_api = types.ModuleType('outspline.coreaux_api')
+    coreaux_api.OutsplineError = Exception
+    sys.modules['outspline.coreaux_api'] = coreaux_api
+    outspline.coreaux_api = coreaux_api
+
+    organism_api = types.ModuleType('outspline.extensions.organism_api')
+    organism_api.Occurrence = Occurrence
+    sys.modules['outspline.extensions.organism_api'] = organism_api
+    outspline.extensions.organism_api = organism_api
+
+    # Do not run the package's __init__, which needs the running application
+    package = types.ModuleType('outspline.extensions.organism_basicrules')
+    package.__path__ = [os.path.join(outspline.extensions.__path__[0],
+                                                    'organism_basicrules')]
+    sys.modules['outspline.extensions.organism_basicrules'] = package
+
+
+_install_apis()
+
+from outspline.static.pyaux.timeaux import UTCOffset
+from outspline.extensions.organism_basicrules import occur_regularly
+from outspline.extensions.organism_basicrules import occur_regularly_group
+
+
+class CompiledRule(dict):
+    # The rules are passed to the handlers with the parameters compiled by
+    # organism
+    def __init__(self, rule, params):
+        dict.__init__(self, rule)
+        self.params = params
+
+
+class FallbackCounter(object):
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.function(*args)
+
+
+fallback = FallbackCounter(occur_regularly._search_next_item_occurrences_local)
+occur_regularly._search_next_item_occurrences_local = fallback
+
+
+class NextOccurrences(object):
+    # The same logic as organism_timer.timer.NextOccurrences
+    def __init__(self):
+        self.occs = {}
+        self.next = None
+
+    def add_safe(self, base_time, occ):
+        tl = [occ.alarm, occ.start, occ.end]
+        tl.sort()
+
+        for t in tl:
+            if base_time < t:
+                if not self.next or t < self.next:
+                    self.next = t
+                    self.occs = {occ.filename: {occ.id_: [occ]}}
+                    return True
+                elif t == self.next:
+                    self.occs.setdefault(occ.filename, {}).setdefault(
+                                                    occ.id_, []).append(occ)
+                    return True
+                else:
+                    return False
+        else:
+            return False
+
+    def get_next_occurrence_time(self):
+        return self.next
+
+    def get_state(self):
+        return (self.next, sorted((f, i, [o.get_tuple() for o in occs])
+                                        for f in self.occs
+                                        for i, occs in self.occs[f].items()))
+
+
+def search_loop(base_time, utcbase, utcoffset, filename, id_, rule, occs,
+                                                                    local):
+    # The original implementation of get_next_item_occurrences_local and
+    # get_next_item_occurrences_UTC; the groups were searched by repeating
+    # the loop for each of their reference start times
+    if isinstance(rule['#'][0], list):
+        for refstart in rule['#'][0]:
+            search_loop(base_time, utcbase, utcoffset, filename, id_,
+                    {'#': [refstart] + list(rule['#'][1:])}, occs, local)
+
+        return
+
+    interval = rule['#'][1]
+    start = occur_regularly.compute_min_time(utcbase if local else base_time,
+                        rule['#'][0], interval, rule['#'][2], rule['#'][3])
+    rend = rule['#'][4]
+    ralarm = rule['#'][5]
+
+    while True:
+        sstart = start + utcoffset.compute(start) if local else start
+        send = None if rend is None else sstart + rend
+        salarm = None if ralarm is None else sstart - ralarm
+
+        occs.add_safe(base_time, Occurrence(filename, id_, sstart, send,
+                                                                    salarm))
+        next_occ = occs.get_next_occurrence_time()
+
+        if next_occ and sstart > next_occ and (salarm is None or
+                                                            salarm > next_occ):
+            break
+
+        start += interval
+
+
+def make_random_rule():
+    interval = random.choice((60, 900, 3600, 86400, 7 * 86400,
+                                                random.randint(1, 100000)))
+    rend = random.choice((None, random.randint(1, 5 * interval),
+                                                random.randint(1, 7200)))
+    ralarm = random.choice((None, 0, random.randint(-5 * interval,
+                                5 * interval), random.randint(-7200, 7200)))
+    standard = random.choice(('local', 'UTC'))
+    refstart = random.randint(1300000000, 1500000000)
+
+    if random.random() < 0.25:
+        rstarts = [0] + random.sample(xrange(1, max(2, 3 * interval)),
+                                                        random.randint(1, 3))
+        return occur_regularly_group.make_rule(refstart, interval, rstarts,
+                                            rend, ralarm, standard, None)
+    else:
+        return occur_regularly.make_rule(refstart, interval, rend, ralarm,
+                                                            standard, None)
+
+
+def make_random_base_time():
+    # Half of the base times are close to a UTC offset change
+    base_time = random.randint(1350000000, 1450000000)
+
+    if random.random() < 0.5:
+        utcoffset = UTCOffset()
+        offset, limit = utcoffset.compute_limit(base_time)
+
+        if limit is not None:
+            base_time = limit + random.randint(-3 * 86400, 3600)
+
+    return base_time
+
+
+def main():
+    failures = 0
+    tloop = 0
+    tdirect = 0
+
+    for test in xrange(TESTS):
+        base_time = make_random_base_time()
+        utcbase = base_time - UTCOffset.compute2(base_time)
+        rules = []
+
+        for n in xrange(random.randint(1, 4)):
+            rule = make_random_rule()
+
+            if rule['rule'].startswith('occur_regularly_group'):
+                module = occur_regularly_group
+            else:
+                module = occur_regularly
+
+            rules.append((module, rule, CompiledRule(rule,
+                                                module.compile_rule(rule))))
+
+        results = []
+
+        for function in (search_loop, None):
+            occs = NextOccurrences()
+            utcoffset = UTCOffset()
+            start = time.time()
+
+            for id_, (module, rule, crule) in enumerate(rules):
+                local = rule['rule'].endswith('_local')
+
+                if function:
+                    function(base_time, utcbase, utcoffset, 'f', id_, rule,
+                                                                occs, local)
+                elif local:
+                    module.get_next_item_occurrences_local(base_time,
+                                        utcbase, utcoffset, 'f', id_, crule,
+                                        occs)
+                else:
+                    module.get_next_item_occurrences_UTC(base_time, utcbase,
+                                            utcoffset, 'f', id_, crule, occs)
+
+            if function:
+                tloop += time.time() - start
+            else:
+                tdirect += time.time() - start
+
+            results.append(occs.get_state())
+
+        if results[0] != results[1]:
+            failures += 1
+            print('Mismatch: base_time={} rules={}'.format(base_time,
+                                            [rule for m, rule, c in rules]))
+            print('  loop:   {}'.format(results[0]))
+            print('  direct: {}'.format(results[1]))
+
+    print('{}, {} tests, {} mismatches'.format(os.environ['TZ'], TESTS,
+                                                                failures))
+    print('loop {:.3f} s, direct {:.3f} s, {} fallbacks'.format(tloop,
+                                                    tdirect, fallback.calls))
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
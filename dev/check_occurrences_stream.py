@@ -0,0 +1,257 @@
+#!/usr/bin/env python2
+
+# Check that OccurrencesRangeStream yields the same occurrences as a complete
+# OccurrencesRangeSearch of the same range, sorted by start time, on random
+# rules of all the basic types and random ranges; also check that a search
+# with a limit, like the one of wxtasklist, shows the same rows, or reports
+# the limit, exactly like searching the whole range first
+# The application APIs cannot be initialized outside Outspline, so only the
+# few names that organism's items and the basic rules need are provided here
+# Usage: check_occurrences_stream.py [time_zone] [tests] [seed]
+
+import os
+import sys
+import time
+import types
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'src'))
+
+os.environ['TZ'] = sys.argv[1] if len(sys.argv) > 1 else 'Europe/Paris'
+time.tzset()
+
+TESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+SEED = int(sys.argv[3]) if len(sys.argv) > 3 else int(time.time())
+# The values of the tasklist's maximum_items option to be emulated
+LIMITS = (0, 1, 5, 20, 100, 500)
+
+
+class Event(object):
+    def bind(self, handler, bind=True):
+        pass
+
+    def signal(self, **kwargs):
+        pass
+
+
+class Configuration(object):
+    def get_int(self, key):
+        return {'parallel_search_processes': 0,
+                'parallel_search_min_rules': 0}[key]
+
+
+def _install_apis():
+    import outspline
+    import outspline.extensions
+
+    coreaux_api = types.ModuleType('outspline.coreaux_api')
+    coreaux_api.OutsplineError = Exception
+    coreaux_api.Event = Event
+    coreaux_api.log = logging.getLogger('check')
+    coreaux_api.get_extension_configuration = lambda name: Configuration()
+    sys.modules['outspline.coreaux_api'] = coreaux_api
+    outspline.coreaux_api = coreaux_api
+
+    core_api = types.ModuleType('outspline.core_api')
+    sys.modules['outspline.core_api'] = core_api
+    outspline.core_api = core_api
+
+    # Do not run organism's __init__, which needs the running application
+    package = types.ModuleType('outspline.extensions.organism')
+    package.__path__ = [os.path.join(outspline.extensions.__path__[0],
+                                                                'organism')]
+    sys.modules['outspline.extensions.organism'] = package
+
+    from outspline.extensions.organism import items
+
+    rules = items.Rules()
+
+    # The basic rules install their handlers in this Rules object like they
+    # do in organism's
+    organism_api = types.ModuleType('outspline.extensions.organism_api')
+    organism_api.Occurrence = items.Occurrence
+    organism_api.install_rule_handler = rules.install_rule_handler
+    organism_api.install_rule_span_handler = rules.install_rule_span_handler
+    organism_api.install_rule_compiler = rules.install_rule_compiler
+    sys.modules['outspline.extensions.organism_api'] = organism_api
+    outspline.extensions.organism_api = organism_api
+
+    organism_timer_api = types.ModuleType(
+                                    'outspline.extensions.organism_timer_api')
+    organism_timer_api.install_rule_handler = rules.install_next_rule_handler
+    sys.modules['outspline.extensions.organism_timer_api'] = \
+                                                            organism_timer_api
+    outspline.extensions.organism_timer_api = organism_timer_api
+
+    return rules
+
+
+RULES = _install_apis()
+
+from outspline.extensions.organism.items import (OccurrencesRangeSearch,
+                                                    OccurrencesRangeStream)
+from outspline.extensions import organism_basicrules
+from outspline.extensions.organism_basicrules import (occur_once,
+                    occur_regularly, occur_regularly_group, occur_yearly,
+                    occur_monthly_number_direct, occur_monthly_weekday_direct,
+                    except_once, except_regularly)
+
+organism_basicrules.main()
+
+H = 3600
+D = 86400
+T0 = 1400000000
+
+
+class Database(object):
+    # The materialized occurrences are not used, so every range is searched
+    # through the rule handlers
+    version = 0
+
+    def __init__(self, itemrules):
+        self.itemrules = itemrules
+
+    def get_occurrences_range_rows(self, mint, maxt):
+        return None
+
+    def iter_valid_item_rules_range(self, mint, maxt):
+        return iter(self.itemrules)
+
+
+def make_random_rule():
+    standard = random.choice(('local', 'UTC'))
+    choice = random.random()
+
+    if choice < 0.15:
+        start = T0 + random.randint(-1500, 1500) * H
+        return occur_once.make_rule(start, random.choice((None, start +
+                            random.randint(1, 80) * H)), random.choice((None,
+                            start - 600, start + 2 * H)), standard, None)
+    elif choice < 0.4:
+        return occur_regularly.make_rule(T0 + random.randint(-50, 50) * 600,
+                            random.choice((H, 6 * H, D, 7 * D)),
+                            random.choice((None, 1800, 20 * H, 100 * H)),
+                            random.choice((None, 300, -300, -30 * H, 20 * H)),
+                            standard, None)
+    elif choice < 0.5:
+        return occur_regularly_group.make_rule(T0, D, [0, 3 * H, 7 * H],
+                            random.choice((None, 1800, 30 * H)),
+                            random.choice((None, 120, -5 * H)), standard, None)
+    elif choice < 0.6:
+        return occur_monthly_number_direct.make_rule(
+                            random.sample(range(1, 13), 3),
+                            random.randint(1, 31), random.randint(0, 23), 0,
+                            random.choice((None, H, 40 * D)),
+                            random.choice((None, -3 * D, D)), standard, None)
+    elif choice < 0.7:
+        return occur_monthly_weekday_direct.make_rule(range(1, 13),
+                            random.randint(0, 6), random.randint(1, 4), 8, 0,
+                            random.choice((None, 20 * D)),
+                            random.choice((None, -D)), standard, None)
+    elif choice < 0.8:
+        return occur_yearly.make_rule(1, 2013, random.randint(1, 12),
+                            random.randint(1, 28), 10, 0,
+                            random.choice((None, 200 * D)),
+                            random.choice((None, -100 * D)), standard, None)
+    elif choice < 0.9:
+        start = T0 + random.randint(-1500, 1500) * H
+        return except_once.make_rule(start, start + random.randint(1, 300) * H,
+                            random.choice((True, False)), standard, None)
+    else:
+        return except_regularly.make_rule(T0 + random.randint(-50, 50) * 600,
+                            random.choice((D, 7 * D)),
+                            random.randint(1, 20) * H,
+                            random.choice((True, False)), standard, None)
+
+
+def make_random_databases():
+    itemrules = []
+
+    for id_ in xrange(1, random.randint(2, 40)):
+        rules = [make_random_rule() for n in xrange(random.randint(1, 3))]
+        itemrules.append((id_, RULES.compile_rules(rules)))
+
+    return {'f': Database(itemrules)}
+
+
+def show_page(mint, maxt, databases, limit):
+    # The same logic as wxtasklist's RefreshEngine._refresh_continue
+    search = OccurrencesRangeSearch(mint, maxt, ['f'], databases, RULES,
+                                                                limit=limit)
+    search.start()
+
+    if search.is_limit_exceeded():
+        return None
+
+    return sorted(occ.get_tuple() for occ in search.get_results().get_list())
+
+
+def check_order(yielded):
+    # All the occurrences, including the ones that start out of the range,
+    # are yielded by start time, so that a consumer that stops after N of
+    # them has seen the earliest N
+    starts = [occ.start for occ in yielded]
+
+    return starts == sorted(starts)
+
+
+def main():
+    random.seed(SEED)
+    failures = 0
+    tsearch = 0
+    tstream = 0
+
+    for test in xrange(TESTS):
+        databases = make_random_databases()
+        mint = T0 + random.randint(-300, 300) * D + random.randint(0, D)
+        maxt = mint + random.choice((0, H, D, 7 * D,
+                                                random.randint(0, 60) * D))
+
+        start = time.time()
+        search = OccurrencesRangeSearch(mint, maxt, ['f'], databases, RULES)
+        search.start()
+        expected = search.get_results().get_list()
+        tsearch += time.time() - start
+
+        start = time.time()
+        stream = OccurrencesRangeStream(mint, maxt, ['f'], databases, RULES)
+        yielded = list(stream)
+        tstream += time.time() - start
+
+        errors = []
+
+        if sorted(occ.get_tuple() for occ in yielded) != sorted(
+                                        occ.get_tuple() for occ in expected):
+            errors.append('different occurrences')
+
+        if sorted(occ.get_tuple() for occ in stream.get_results().get_list()
+                    ) != sorted(occ.get_tuple() for occ in expected):
+            errors.append('different results')
+
+        if not check_order(yielded):
+            errors.append('wrong order')
+
+        for limit in LIMITS:
+            if len(expected) > limit:
+                page = None
+            else:
+                page = sorted(occ.get_tuple() for occ in expected)
+
+            if show_page(mint, maxt, databases, limit) != page:
+                errors.append('different page with limit {}'.format(limit))
+
+        if errors:
+            failures += 1
+            print('Mismatch: mint={} maxt={}: {}'.format(mint, maxt,
+                                                        ', '.join(errors)))
+
+    print('{}, {} tests, seed {}, {} mismatches'.format(os.environ['TZ'],
+                                                    TESTS, SEED, failures))
+    print('search {:.3f} s, stream {:.3f} s'.format(tsearch, tstream))
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
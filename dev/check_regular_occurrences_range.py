@@ -0,0 +1,204 @@
+#!/usr/bin/env python2
+
+# Check that the bulk expansion of the occurrences of occur_regularly rules,
+# which hands all the occurrences of a rule to OccurrencesRange.add_many, finds
+# the same occurrences as the original search loop, which tested them one by
+# one with OccurrencesRange.add_safe, on random rules and ranges, especially
+# around DST changes
+# The application APIs cannot be initialized outside Outspline, so only the
+# few names that organism's items and occur_regularly need are provided here
+# Usage: check_regular_occurrences_range.py [time_zone] [tests]
+
+import os
+import sys
+import time
+import types
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'src'))
+
+os.environ['TZ'] = sys.argv[1] if len(sys.argv) > 1 else 'Europe/Paris'
+time.tzset()
+
+TESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+
+class Event(object):
+    def bind(self, handler, bind=True):
+        pass
+
+    def signal(self, **kwargs):
+        pass
+
+
+def _install_apis():
+    import outspline
+    import outspline.extensions
+
+    coreaux_api = types.ModuleType('outspline.coreaux_api')
+    coreaux_api.OutsplineError = Exception
+    coreaux_api.Event = Event
+    coreaux_api.log = logging.getLogger('check')
+    sys.modules['outspline.coreaux_api'] = coreaux_api
+    outspline.coreaux_api = coreaux_api
+
+    core_api = types.ModuleType('outspline.core_api')
+    sys.modules['outspline.core_api'] = core_api
+    outspline.core_api = core_api
+
+    # Do not run the packages' __init__, which need the running application
+    for name in ('organism', 'organism_basicrules'):
+        package = types.ModuleType('outspline.extensions.' + name)
+        package.__path__ = [os.path.join(outspline.extensions.__path__[0],
+                                                                        name)]
+        sys.modules['outspline.extensions.' + name] = package
+
+    from outspline.extensions.organism import items
+
+    organism_api = types.ModuleType('outspline.extensions.organism_api')
+    organism_api.Occurrence = items.Occurrence
+    sys.modules['outspline.extensions.organism_api'] = organism_api
+    outspline.extensions.organism_api = organism_api
+
+
+_install_apis()
+
+from outspline.static.pyaux.timeaux import UTCOffset
+from outspline.extensions.organism.items import Occurrence, OccurrencesRange
+from outspline.extensions.organism_basicrules import occur_regularly
+
+
+def search_loop_local(mint, utcmint, maxt, utcoffset, filename, id_, rule,
+                                                                        occs):
+    # The original implementation of get_occurrences_range_local, with the
+    # same margin for the DST shift as the bulk expansion
+    interval = rule['#'][1]
+    start = occur_regularly.compute_min_time(utcmint - abs(time.timezone -
+                                time.altzone), rule['#'][0], interval,
+                                rule['#'][2], rule['#'][3])
+    rend = rule['#'][4]
+    ralarm = rule['#'][5]
+
+    while True:
+        sstart = start + utcoffset.compute(start)
+        send = None if rend is None else sstart + rend
+        salarm = None if ralarm is None else sstart - ralarm
+
+        if sstart > maxt and (salarm is None or salarm > maxt):
+            break
+
+        occs.add_safe(Occurrence(filename, id_, sstart, send, salarm))
+
+        start += interval
+
+
+def search_loop_UTC(mint, utcmint, maxt, utcoffset, filename, id_, rule,
+                                                                        occs):
+    # The original implementation of get_occurrences_range_UTC
+    interval = rule['#'][1]
+    start = occur_regularly.compute_min_time(mint, rule['#'][0], interval,
+                                                rule['#'][2], rule['#'][3])
+    rend = rule['#'][4]
+    ralarm = rule['#'][5]
+
+    while True:
+        end = None if rend is None else start + rend
+        alarm = None if ralarm is None else start - ralarm
+
+        if start > maxt and (alarm is None or alarm > maxt):
+            break
+
+        occs.add_safe(Occurrence(filename, id_, start, end, alarm))
+
+        start += interval
+
+
+def make_random_rule():
+    interval = random.choice((60, 900, 3600, 86400, 7 * 86400,
+                                                random.randint(60, 100000)))
+    rend = random.choice((None, random.randint(1, 5 * interval),
+                                                random.randint(1, 7200)))
+    ralarm = random.choice((None, 0, random.randint(-5 * interval,
+                                5 * interval), random.randint(-7200, 7200)))
+    standard = random.choice(('local', 'UTC'))
+
+    return occur_regularly.make_rule(random.randint(1300000000, 1500000000),
+                                interval, rend, ralarm, standard, None)
+
+
+def make_random_range():
+    # Half of the ranges start close to a UTC offset change
+    mint = random.randint(1350000000, 1450000000)
+
+    if random.random() < 0.5:
+        offset, limit = UTCOffset().compute_limit(mint)
+
+        if limit is not None:
+            mint = limit + random.randint(-3 * 86400, 3600)
+
+    return (mint, mint + random.choice((0, 3600, 86400, 7 * 86400,
+                                                random.randint(0, 40 * 86400))))
+
+
+def get_state(occs):
+    return sorted(occ.get_tuple() for occ in occs.get_list())
+
+
+def main():
+    failures = 0
+    tloop = 0
+    tbulk = 0
+
+    for test in xrange(TESTS):
+        mint, maxt = make_random_range()
+        utcmint = mint - UTCOffset.compute2(mint)
+        rules = [make_random_rule() for n in xrange(random.randint(1, 4))]
+        # The handlers receive the parameters compiled by organism
+        params = [occur_regularly.compile_rule(rule) for rule in rules]
+        results = []
+
+        for loop in (True, False):
+            occs = OccurrencesRange(mint, maxt)
+            utcoffset = UTCOffset()
+            start = time.time()
+
+            for id_, rule in enumerate(rules):
+                local = rule['rule'] == 'occur_regularly_local'
+
+                if loop and local:
+                    search_loop_local(mint, utcmint, maxt, utcoffset, 'f',
+                                                        id_, rule, occs)
+                elif loop:
+                    search_loop_UTC(mint, utcmint, maxt, utcoffset, 'f', id_,
+                                                                rule, occs)
+                elif local:
+                    occur_regularly.search_range_local(mint, utcmint, maxt,
+                                    utcoffset, 'f', id_, params[id_], occs)
+                else:
+                    occur_regularly.search_range_UTC(mint, utcmint, maxt,
+                                    utcoffset, 'f', id_, params[id_], occs)
+
+            if loop:
+                tloop += time.time() - start
+            else:
+                tbulk += time.time() - start
+
+            results.append(get_state(occs))
+
+        if results[0] != results[1]:
+            failures += 1
+            print('Mismatch: mint={} maxt={} rules={}'.format(mint, maxt,
+                                                                    rules))
+            print('  loop: {}'.format(results[0]))
+            print('  bulk: {}'.format(results[1]))
+
+    print('{}, {} tests, {} mismatches'.format(os.environ['TZ'], TESTS,
+                                                                failures))
+    print('loop {:.3f} s, bulk {:.3f} s'.format(tloop, tbulk))
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -35,11 +35,20 @@ data = (
             )),
             OD()
         )),
+        ("Databases", (
+            OD((
+                ("wal_mode", "no"),
+                ("read_connections", "2"),
+            )),
+            OD()
+        )),
         ("History", (
             OD((
                 ("default_soft_limit", "60"),
                 ("time_limit", "15"),
                 ("hard_limit", "120"),
+                ("trim_rows_threshold", "500"),
+                ("trim_time_threshold", "2"),
             )),
             OD()
         )),
@@ -21,6 +21,12 @@ from collections import OrderedDict as OD
 data = (
     OD((
         ("enabled", "on"),
+        ("occurrences_horizon_days", "366"),
+        ("occurrences_item_limit", "2000"),
+        ("parallel_search_processes", "0"),
+        ("parallel_search_min_rules", "5000"),
+        ("range_cache_size", "32"),
+        ("profile_rules", "no"),
     )),
     OD()
 )
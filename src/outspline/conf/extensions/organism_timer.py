@@ -22,6 +22,7 @@ data = (
     OD((
         ("enabled", "on"),
         ("old_alarms_delay", "250"),
+        ("old_alarms_window_days", "7"),
     )),
     OD()
 )
@@ -24,6 +24,7 @@ data = (
         ("debug_mode", "off"),
         ("refresh_delay", "25"),
         ("maximum_items", "300"),
+        ("prefetch_adjacent_pages", "yes"),
         ("first_weekday", "0"),
         ("show_navigator", "yes"),
         ("navigator_buttons", "previous,next,reset,set,apply"),
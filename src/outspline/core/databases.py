@@ -20,6 +20,8 @@ import os
 import errno
 import Queue as queue
 import sqlite3
+import threading
+import time as time_
 
 import outspline.info
 import outspline.coreaux_api as coreaux_api
@@ -41,6 +43,7 @@ closing_database_event = Event()
 close_database_event = Event()
 save_permission_check_event = Event()
 save_database_event = Event()
+save_database_copy_progress_event = Event()
 delete_subtree_event = Event()
 exit_app_event_1 = Event()
 exit_app_event_2 = Event()
@@ -69,29 +72,121 @@ class Protection(object):
     # Another advantage is that this class makes sure that when a function sets
     #     the history group, it's impossible that another function manages to
     #     set the same group
+    # Operations that only read the databases can block them in shared mode,
+    #   so that they can run concurrently with each other, while still
+    #   excluding any operation that blocks them in exclusive mode
+    # Waiting exclusive requests take precedence over new shared ones, so
+    #   that a stream of readers cannot starve a writer
     def __init__(self):
-        baton = True
-        self.q = queue.Queue()
-        self.q.put(baton)
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.statistics = {
+            'exclusive': LockStatistics(),
+            'shared': LockStatistics(),
+        }
 
     def block(self, block=False, quiet=False):
-        try:
-            self.s = self.q.get(block)
-        except queue.Empty:
+        return self._acquire('exclusive', self._can_block_exclusive,
+                                                                block, quiet)
+
+    def block_shared(self, block=False, quiet=False):
+        return self._acquire('shared', self._can_block_shared, block, quiet)
+
+    def _can_block_exclusive(self):
+        return not self.writer and self.readers == 0
+
+    def _can_block_shared(self):
+        return not self.writer and self.waiting_writers == 0
+
+    def _acquire(self, mode, test, block, quiet):
+        start = time_.time()
+
+        with self.condition:
+            refused = not test() and not block
+
+            if refused:
+                self.statistics[mode].refuse()
+            elif not test():
+                if mode == 'exclusive':
+                    self.waiting_writers += 1
+
+                while not test():
+                    self.condition.wait()
+
+                if mode == 'exclusive':
+                    self.waiting_writers -= 1
+
+            if not refused:
+                if mode == 'exclusive':
+                    self.writer = True
+                else:
+                    self.readers += 1
+
+                self.statistics[mode].acquire(time_.time() - start)
+
+        if refused:
+            # Signal the event outside of the lock, its handlers may take long
             if not quiet:
                 blocked_databases_event.signal()
 
             return False
         else:
-            log.debug('Block databases')
+            log.debug('Block databases ({})'.format(mode))
             return True
 
     def release(self):
-        log.debug('Release databases')
+        log.debug('Release databases (exclusive)')
+
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    def release_shared(self):
+        log.debug('Release databases (shared)')
 
-        self.q.task_done()
-        self.q.join()
-        self.q.put(self.s)
+        with self.condition:
+            self.readers -= 1
+
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def get_statistics(self):
+        with self.condition:
+            return {mode: stats.get() for mode, stats in
+                                                self.statistics.iteritems()}
+
+
+class LockStatistics(object):
+    # Contention metrics for one mode of Protection: all times are in seconds
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0
+        self.refused = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, wait):
+        self.acquired += 1
+
+        if wait > 0.001:
+            self.contended += 1
+
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def refuse(self):
+        self.refused += 1
+
+    def get(self):
+        return {
+            'acquired': self.acquired,
+            'contended': self.contended,
+            'refused': self.refused,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+        }
 
 
 class DBQueue(queue.Queue):
@@ -102,6 +197,39 @@ class DBQueue(queue.Queue):
         return True
 
 
+class FileDBQueue(DBQueue):
+    # The queue of the main connection of a database file, which also tracks
+    # whether the connection has uncommitted changes: all the writes go through
+    # the queue, so the state is updated by the thread that gives the
+    # connection back, and it is exact for the thread that is holding it
+    # The other threads can read the state without waiting for the connection
+    def __init__(self):
+        DBQueue.__init__(self)
+        self.state_lock = threading.Lock()
+        self.committed_changes = 0
+        self.committed = True
+
+    def give(self, item):
+        # total_changes only grows, so as long as it does not change after a
+        # commit, the file and the main connection contain the same data
+        with self.state_lock:
+            self.committed = item.connection.total_changes == \
+                                                        self.committed_changes
+
+        return DBQueue.give(self, item)
+
+    def set_committed_state(self, item):
+        # item must be the connection held by the calling thread, right after
+        # committing it
+        with self.state_lock:
+            self.committed_changes = item.connection.total_changes
+            self.committed = True
+
+    def is_committed(self):
+        with self.state_lock:
+            return self.committed
+
+
 class MemoryDB(DBQueue):
     def __init__(self):
         DBQueue.__init__(self)
@@ -124,8 +252,36 @@ class MemoryDB(DBQueue):
         exit_app_event_2.signal()
 
 
+class ReadPool(queue.Queue):
+    # Read-only connections used when the database file is in WAL mode: they
+    # read the last committed snapshot of the file without waiting for the
+    # main connection, which keeps being the only writer
+    # Note that the changes are committed only when the database is saved, so
+    # the pool can only be used while the database has no unsaved changes,
+    # i.e. it speeds up the long reads on databases that are only consulted,
+    # not the ones running while the user is editing
+    def __init__(self, filename, size):
+        queue.Queue.__init__(self)
+        self.connections = []
+
+        for n in xrange(size):
+            conn = sqlite3.connect(filename, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(queries.pragma_query_only)
+            self.connections.append(conn)
+            self.put(conn)
+
+    def close(self):
+        # Wait for the connections that are still being used by other threads
+        # (e.g. background searches that have just been stopped) to be given
+        # back, like Database.close does with the main connection
+        for n in xrange(len(self.connections)):
+            self.get().close()
+
+
 class FileDB(object):
-    def __init__(self, filename, check_same_thread=False, name_based=False):
+    def __init__(self, filename, check_same_thread=False, name_based=False,
+                                                        journal_mode=None):
         self.connection = sqlite3.connect(filename,
                                         check_same_thread=check_same_thread)
 
@@ -145,6 +301,12 @@ class FileDB(object):
         # If == 0 it means the database is new (just been created)
         if cursor.fetchone()[0] > 0:
             try:
+                # The journal mode can only be changed outside a transaction,
+                # i.e. before the locking test below; note that this fails too
+                # if another instance is using the file
+                if journal_mode:
+                    cursor.execute(journal_mode)
+
                 # In order to test if the database is locked (open by another
                 # instance of Outspline), a SELECT query is not enough
                 cursor.execute(queries.properties_insert_dummy)
@@ -169,16 +331,34 @@ class FileDB(object):
 
 
 class Database(object):
+    # Rows copied by save_copy in each step
+    COPY_ROWS = 2000
+
     def __init__(self, filename):
-        self.connection = DBQueue()
+        self.connection = FileDBQueue()
         self.filename = filename
         self.items = {}
+        self.adjacency = items.Adjacency()
         self.dbhistory = history.DBHistory(self.connection, self.items,
-                                                                self.filename)
+                                                self.adjacency, self.filename)
+
+        dbconfig = coreaux_api.get_configuration()('Databases')
+
+        if dbconfig.get_bool('wal_mode'):
+            journal_mode = queries.pragma_journal_mode_wal
+        else:
+            journal_mode = queries.pragma_journal_mode_delete
 
         # Enable multi-threading, as the database is protected with a queue
         self.connection.put(FileDB(filename, check_same_thread=False,
-                                                            name_based=True))
+                                name_based=True, journal_mode=journal_mode))
+
+        if dbconfig.get_bool('wal_mode'):
+            self.readpool = ReadPool(filename,
+                                        dbconfig.get_int('read_connections'))
+        else:
+            self.readpool = None
+
         qconn = self.connection.get()
         cursor = qconn.cursor()
 
@@ -188,13 +368,22 @@ class Database(object):
         timelimit = config.get_int('time_limit')
         hardlimit = config.get_int('hard_limit')
         self.dbhistory.set_limits(softlimit, timelimit, hardlimit)
-
-        dbitems = cursor.execute(queries.items_select_tree)
+        self.dbhistory.set_trim_thresholds(
+                                    config.get_int('trim_rows_threshold'),
+                                    config.get_int('trim_time_threshold'))
+
+        dbitems = cursor.execute(queries.items_select_tree_adjacency)
+        # The connection has only checked that the file is not locked, so it
+        # contains the same data as the file
+        self.connection.set_committed_state(qconn)
         self.connection.give(qconn)
 
         for item in dbitems:
             self.items[item['I_id']] = items.Item(self.connection,
-                    self.dbhistory, self.items, self.filename, item['I_id'])
+                                    self.dbhistory, self.items, self.adjacency,
+                                    self.filename, item['I_id'])
+            self.adjacency.insert(item['I_id'], item['I_parent'],
+                                                        item['I_previous'])
 
     @staticmethod
     def create(filename):
@@ -230,7 +419,11 @@ class Database(object):
                                     int(float(outspline.info.core.version)), ))
 
                 cursor.execute(queries.items_create)
+                cursor.execute(queries.items_create_index_parent)
+                cursor.execute(queries.items_create_index_previous)
                 cursor.execute(queries.history_create)
+                cursor.execute(queries.history_create_index_group)
+                cursor.execute(queries.history_create_index_status)
 
                 conn.save_and_disconnect()
 
@@ -276,6 +469,7 @@ class Database(object):
         cursor.execute(queries.history_update_status_new)
         cursor.execute(queries.history_update_status_old)
         qconn.save()
+        self.connection.set_committed_state(qconn)
         self.connection.give(qconn)
 
         self.dbhistory.reset_modified_state()
@@ -289,33 +483,56 @@ class Database(object):
 
         # Of course the original file cannot be simply copied, in fact in that
         # case it should be saved first, and that's not what is expected
-
-        qconn = self.connection.get()
+        # Copy the tables in chunks of rows, giving the connection back between
+        # a chunk and the next, so that the other threads are not frozen for
+        # the whole copy
         qconnd = FileDB(destination)
-        cursor = qconn.cursor()
         cursord = qconnd.cursor()
 
+        qconn = self.connection.get()
+        cursor = qconn.cursor()
         cursor.execute(queries.master_select_tables)
+        tables = [row["name"] for row in cursor]
+        total = 0
+
+        for tname in tables:
+            cursor.execute(queries.master_select_count.format(tname))
+            total += cursor.fetchone()[0]
 
-        for row in cursor:
-            tname = row["name"]
+        self.connection.give(qconn)
+
+        done = 0
 
+        for tname in tables:
             # Some tables are initialized by self.create
             cursord.execute(queries.master_delete.format(tname))
 
+            qconn = self.connection.get()
             tcursor = qconn.cursor()
             tcursor.execute(queries.master_select_table.format(tname))
+            columns = [column[0] for column in tcursor.description]
+            rows = tcursor.fetchmany(self.COPY_ROWS)
+            self.connection.give(qconn)
+
+            insert = queries.master_insert.format(tname, ", ".join(columns),
+                                            ", ".join(["?", ] * len(columns)))
+
+            while rows:
+                cursord.executemany(insert, rows)
+                done += len(rows)
+
+                save_database_copy_progress_event.signal(
+                                        filename=self.filename,
+                                        destination=destination, done=done,
+                                        total=total)
 
-            for trow in tcursor:
-                cursord.execute(queries.master_insert.format(tname,
-                                    ", ".join(trow.keys()),
-                                    ", ".join(["?", ] * len(trow))), (trow))
+                qconn = self.connection.get()
+                rows = tcursor.fetchmany(self.COPY_ROWS)
+                self.connection.give(qconn)
 
         cursord.execute(queries.history_update_status_new)
         cursord.execute(queries.history_update_status_old)
 
-        self.connection.give(qconn)
-
         qconnd.save_and_disconnect()
 
     def close(self):
@@ -324,6 +541,9 @@ class Database(object):
         global dbs
         del dbs[self.filename]
 
+        if self.readpool:
+            self.readpool.close()
+
         qconn = self.connection.get()
         qconn.disconnect()
         self.connection.task_done()
@@ -338,7 +558,13 @@ class Database(object):
         return True
 
     def delete_subtree(self, id_, group, description='Delete subtree'):
-        self.items[id_].delete_subtree(group, description=description)
+        self.dbhistory.begin_history_group()
+
+        try:
+            self.items[id_].delete_subtree(group, description=description)
+        finally:
+            self.dbhistory.commit_history_group()
+
         delete_subtree_event.signal()
 
     def find_independent_items(self, ids):
@@ -360,7 +586,47 @@ class Database(object):
         return cursor
 
     def get_all_items_text(self):
-        return self.get_all_items().fetchall()
+        qconn = self.get_read_connection()
+        cursor = qconn.cursor()
+        cursor.execute(queries.items_select_search)
+        rows = cursor.fetchall()
+        self.give_read_connection(qconn)
+        return rows
+
+    def commit_derived_changes(self, qconn):
+        # qconn is the main connection, still held by the caller, which has
+        # just written data that are only derived from the saved ones (e.g.
+        # caches), and can be committed without asking the user; this is
+        # done only if the connection had no other uncommitted changes, since
+        # the changes of the user are committed only when saving the database
+        # Return True if the changes have been committed
+        if self.connection.is_committed():
+            qconn.save()
+            self.connection.set_committed_state(qconn)
+            return True
+
+        return False
+
+    def get_read_connection(self):
+        # The changes are committed only when saving the database, and the
+        # connections in the pool can only see committed data: as long as
+        # there are unsaved changes fall back to the main connection
+        # The state is read without taking the main connection, otherwise the
+        # readers would be queued behind the writers anyway; if a writer is
+        # changing the database right now, its changes are not committed, so
+        # the pooled connection reads the data as they were before the write,
+        # just like if the read had been queued before it
+        if self.readpool and self.connection.is_committed():
+            return self.readpool.get()
+
+        return self.connection.get()
+
+    def give_read_connection(self, qconn):
+        if isinstance(qconn, FileDB):
+            return self.connection.give(qconn)
+        else:
+            self.readpool.put(qconn)
+            return True
 
     def add_ignored_dependency(self, extension):
         qconn = self.connection.get()
@@ -17,6 +17,7 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import time as time_
 
 from outspline.coreaux_api import Event
 
@@ -37,39 +38,62 @@ history_clean_event = Event()
 
 
 class DBHistory(object):
-    def __init__(self, connection, items, filename):
+    def __init__(self, connection, items, adjacency, filename):
         self.connection = connection
         self.items = items
+        self.adjacency = adjacency
         self.filename = filename
 
+        # The core handlers are all batch handlers, see _do_history
         self.hactions = {
             'insert': {
-                'undo': self._do_history_row_delete,
-                'redo': self._do_history_row_insert,
+                'undo': self._do_history_rows_delete,
+                'redo': self._do_history_rows_insert,
+                'batch': True,
             },
             'update_previous': {
-                'undo': self._do_history_row_update_previous,
-                'redo': self._do_history_row_update_previous,
+                'undo': self._do_history_rows_update_previous,
+                'redo': self._do_history_rows_update_previous,
+                'batch': True,
             },
             'update_parent': {
-                'undo': self._do_history_row_update_parent,
-                'redo': self._do_history_row_update_parent,
+                'undo': self._do_history_rows_update_parent,
+                'redo': self._do_history_rows_update_parent,
+                'batch': True,
             },
             'update_text': {
-                'undo': self._do_history_row_update_text,
-                'redo': self._do_history_row_update_text,
+                'undo': self._do_history_rows_update_text,
+                'redo': self._do_history_rows_update_text,
+                'batch': True,
             },
             'delete': {
-                'undo': self._do_history_row_insert,
-                'redo': self._do_history_row_delete,
+                'undo': self._do_history_rows_insert,
+                'redo': self._do_history_rows_delete,
+                'batch': True,
             },
         }
 
+        # The rows of these types change the structure of the tree, so they
+        # must always be executed in their original relative order
+        self.structure_types = set(('insert', 'update_previous',
+                                                'update_parent', 'delete'))
+
         self.status_updates = {0: 1, 1: 0, 2: 3, 3: 2, 4: 5, 5: 4}
 
+        # Trimming the history is expensive, so while a group is open it is
+        # deferred until the group is committed, unless too many rows have
+        # been inserted or too much time has passed since the last trim
+        self.opengroups = 0
+        self.untrimmedrows = 0
+        self.lasttrim = time_.time()
+
     def set_limits(self, soft, time, hard):
         self.historylimits = [soft, time, hard]
 
+    def set_trim_thresholds(self, rows, seconds):
+        self.trimrows = rows
+        self.trimtime = seconds
+
     def update_soft_limit(self, limit):
         qconn = self.connection.get()
         cur = qconn.cursor()
@@ -80,11 +104,20 @@ class DBHistory(object):
 
         self.historylimits[0] = limit
 
-    def register_action_handlers(self, name, redo_handler, undo_handler):
+    def register_action_handlers(self, name, redo_handler, undo_handler,
+                                                                batch=False):
+        # Normal handlers are called for each history row as
+        #   handler(filename, action, jparams, hid, type_, itemid)
+        # batch handlers are called once for each batch of rows of their type
+        # as
+        #   handler(filename, action, type_, rows)
+        # where rows is a list of (jparams, hid, itemid) tuples in execution
+        # order
         if name not in self.hactions:
             self.hactions[name] = {
                 'undo': undo_handler,
                 'redo': redo_handler,
+                'batch': batch,
             }
         else:
             raise exceptions.ConflictingActionHandlersError()
@@ -95,9 +128,48 @@ class DBHistory(object):
         cur = qconn.cursor()
         cur.execute(queries.history_insert, (group, id_, type_, description,
                                                     query_redo, query_undo))
+        self.connection.give(qconn)
+
+        self._request_trim(1)
+
+    def insert_history_bulk(self, group, rows):
+        # rows is a list of (id_, type_, description, query_redo, query_undo)
+        # tuples
+        qconn = self.connection.get()
+        cur = qconn.cursor()
+        cur.executemany(queries.history_insert, [(group, ) + tuple(row)
+                                                            for row in rows])
+        self.connection.give(qconn)
+
+        self._request_trim(len(rows))
+
+    def begin_history_group(self):
+        # Groups can be nested, the history is trimmed only when the outermost
+        # one is committed
+        self.opengroups += 1
+
+    def commit_history_group(self):
+        self.opengroups -= 1
+
+        if self.opengroups == 0 and self.untrimmedrows > 0:
+            self._trim_history()
+
+    def _request_trim(self, rows):
+        self.untrimmedrows += rows
+
+        if self.opengroups == 0 or self.untrimmedrows >= self.trimrows or \
+                            time_.time() - self.lasttrim >= self.trimtime:
+            self._trim_history()
+
+    def _trim_history(self):
+        qconn = self.connection.get()
+        cur = qconn.cursor()
         cur.execute(queries.history_delete_union, self.historylimits)
         self.connection.give(qconn)
 
+        self.untrimmedrows = 0
+        self.lasttrim = time_.time()
+
     def get_next_history_group(self):
         qconn = self.connection.get()
         cursor = qconn.cursor()
@@ -122,11 +194,11 @@ class DBHistory(object):
 
         return cursor
 
-    def _update_history_id(self, id_, status):
+    def _update_history_group(self, group, status):
         newstatus = self.status_updates[status]
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.history_update_id, (newstatus, id_))
+        cursor.execute(queries.history_update_group_status, (newstatus, group))
         self.connection.give(qconn)
 
     def check_pending_changes(self):
@@ -216,6 +288,7 @@ class DBHistory(object):
                                                     (lastgroup['H_group'], )))
             self.connection.give(qconn)
             return {'history': history,
+                    'group': lastgroup['H_group'],
                     'status': lastgroup['H_status']}
         else:
             return False
@@ -228,79 +301,152 @@ class DBHistory(object):
 
     def _do_history(self, read, action):
         if read:
-            history = read['history']
-            status = read['status']
+            for type_, rows in self._make_history_batches(read['history']):
+                handlers = self.hactions[type_]
 
-            for row in history:
-                self.hactions[row['H_type']][action](self.filename, action,
-                            row[3], row['H_id'], row['H_type'], row['H_item'])
-                self._update_history_id(row['H_id'], status)
+                if handlers['batch']:
+                    handlers[action](self.filename, action, type_, rows)
+                else:
+                    for jparams, hid, itemid in rows:
+                        handlers[action](self.filename, action, jparams, hid,
+                                                                type_, itemid)
+
+            # All the rows of a group always share the same status
+            self._update_history_group(read['group'], read['status'])
 
             history_event.signal(filename=self.filename)
 
-    def _do_history_row_insert(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
-        parent, previous, text = json.loads(jparams)
+    def _make_history_batches(self, history):
+        # Collect the rows of the same type in as few batches as possible: a
+        # row can join the last batch of its type only if this does not move
+        # it before a previous row of the same item or, for the rows that
+        # change the structure of the tree, before a previous structure row;
+        # for example a group that deletes a subtree alternates rules_delete,
+        # link_delete and delete rows, and it is executed in three batches
+        batches = []
+        lasttype = {}
+        lastitem = {}
+        laststructure = -1
+
+        for row in history:
+            type_ = row['H_type']
+            itemid = row['H_item']
+            structure = type_ in self.structure_types
+
+            floor = lastitem.get(itemid, -1)
+
+            if structure:
+                floor = max(floor, laststructure)
+
+            index = lasttype.get(type_, -1)
+
+            if index < 0 or index < floor:
+                index = len(batches)
+                batches.append((type_, []))
+                lasttype[type_] = index
+
+            batches[index][1].append((row[3], row['H_id'], itemid))
+            lastitem[itemid] = index
+
+            if structure:
+                laststructure = index
+
+        return batches
+
+    def _do_history_rows_insert(self, filename, action, type_, rows):
+        params = []
+
+        for jparams, hid, itemid in rows:
+            parent, previous, text = json.loads(jparams)
+            params.append((itemid, parent, previous, text))
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_insert, (itemid, parent, previous, text))
+        cursor.executemany(queries.items_insert, params)
         self.connection.give(qconn)
 
-        self.items[itemid] = items.Item(self.connection, self, self.items,
-                                                        self.filename, itemid)
+        inserted = []
+
+        for (itemid, parent, previous, text), row in zip(params, rows):
+            self.adjacency.insert(itemid, parent, previous)
+            self.items[itemid] = items.Item(self.connection, self, self.items,
+                                        self.adjacency, self.filename, itemid)
+            inserted.append({'id_': itemid, 'parent': parent,
+                            'previous': previous, 'text': text, 'hid': row[1]})
+
+        history_insert_event.signal(filename=self.filename, items=inserted)
 
-        history_insert_event.signal(filename=self.filename, id_=itemid,
-                        parent=parent, previous=previous, text=text, hid=hid)
+    def _do_history_rows_update_previous(self, filename, action, type_, rows):
+        params = []
+        updated = []
 
-    def _do_history_row_update_previous(self, filename, action, jparams, hid,
-                                                                type_, itemid):
-        parent, previous = json.loads(jparams)
+        for jparams, hid, itemid in rows:
+            parent, previous = json.loads(jparams)
+            params.append((previous, itemid))
+            updated.append({'id_': itemid, 'parent': parent,
+                                                        'previous': previous})
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_previous, (previous, itemid))
+        cursor.executemany(queries.items_update_previous, params)
         self.connection.give(qconn)
 
+        for previous, itemid in params:
+            self.adjacency.update_previous(itemid, previous)
+
         history_update_previous_event.signal(filename=self.filename,
-                                id_=itemid, parent=parent, previous=previous)
+                                                                items=updated)
+
+    def _do_history_rows_update_parent(self, filename, action, type_, rows):
+        params = []
+        updated = []
 
-    def _do_history_row_update_parent(self, filename, action, jparams, hid,
-                                                                type_, itemid):
-        oldparent, newparent, previous = json.loads(jparams)
+        for jparams, hid, itemid in rows:
+            oldparent, newparent, previous = json.loads(jparams)
+            params.append((newparent, previous, itemid))
+            updated.append({'id_': itemid, 'oldparent': oldparent,
+                                'newparent': newparent, 'previous': previous})
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_parent, (newparent, previous,
-                                                                    itemid))
+        cursor.executemany(queries.items_update_parent, params)
         self.connection.give(qconn)
 
-        history_update_parent_event.signal(filename=self.filename, id_=itemid,
-                oldparent=oldparent, newparent=newparent, previous=previous)
+        for newparent, previous, itemid in params:
+            self.adjacency.update_parent(itemid, newparent, previous)
+
+        history_update_parent_event.signal(filename=self.filename,
+                                                                items=updated)
+
+    def _do_history_rows_update_text(self, filename, action, type_, rows):
+        params = [(jparams, itemid) for jparams, hid, itemid in rows]
 
-    def _do_history_row_update_text(self, filename, action, jparams, hid,
-                                                                type_, itemid):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_text, (jparams, itemid))
+        cursor.executemany(queries.items_update_text, params)
         self.connection.give(qconn)
 
-        history_update_text_event.signal(filename=self.filename, id_=itemid,
-                                                                text=jparams)
-
-    def _do_history_row_delete(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
-        parent, text = json.loads(jparams)
+        history_update_text_event.signal(filename=self.filename,
+                    items=[{'id_': itemid, 'text': text}
+                                                for text, itemid in params])
 
+    def _do_history_rows_delete(self, filename, action, type_, rows):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_delete_id, (itemid, ))
+        cursor.executemany(queries.items_delete_id, [(itemid, )
+                                            for jparams, hid, itemid in rows])
         self.connection.give(qconn)
 
-        self.items[itemid].remove()
+        deleted = []
+
+        for jparams, hid, itemid in rows:
+            parent, text = json.loads(jparams)
+            self.adjacency.delete(itemid)
+            self.items[itemid].remove()
+            deleted.append({'id_': itemid, 'hid': hid, 'parent': parent,
+                                                                'text': text})
 
-        history_delete_event.signal(filename=self.filename, id_=itemid,
-                                            hid=hid, parent=parent, text=text)
+        history_delete_event.signal(filename=self.filename, items=deleted)
 
     def clean_history(self):
         # This operation must be performed on a different connection than
@@ -25,6 +25,7 @@ import queries
 import exceptions
 
 item_insert_event = Event()
+items_insert_event = Event()
 item_update_previous_event = Event()
 item_update_parent_event = Event()
 item_update_text_event = Event()
@@ -33,11 +34,128 @@ item_deleted_event = Event()
 item_deleted_2_event = Event()
 
 
+class Adjacency(object):
+    # In-memory mirror of the I_parent and I_previous columns of the Items
+    # table, kept up to date by Item and DBHistory so that tree navigation
+    # never has to query the database
+    def __init__(self):
+        # id -> [parent, previous]
+        self.links = {}
+        # (parent, previous) -> set of ids; a set is needed because while an
+        # item is being inserted or moved two siblings can temporarily share
+        # the same previous item, exactly as it happens in the Items table
+        self.nexts = {}
+        # parent -> set of ids
+        self.children = {0: set()}
+
+    def _link(self, id_, parent, previous):
+        self.links[id_] = [parent, previous]
+        self.nexts.setdefault((parent, previous), set()).add(id_)
+        self.children.setdefault(parent, set()).add(id_)
+
+    def _unlink(self, id_):
+        parent, previous = self.links.pop(id_)
+
+        key = (parent, previous)
+        self.nexts[key].discard(id_)
+
+        if not self.nexts[key]:
+            del self.nexts[key]
+
+        self.children[parent].discard(id_)
+
+        # Never delete the children set of the root
+        if not self.children[parent] and parent != 0:
+            del self.children[parent]
+
+        return parent, previous
+
+    def insert(self, id_, parent, previous):
+        self._link(id_, parent, previous)
+
+    def update_previous(self, id_, previous):
+        parent, oldprevious = self._unlink(id_)
+        self._link(id_, parent, previous)
+        return parent, oldprevious
+
+    def update_parent(self, id_, parent, previous):
+        oldvalues = self._unlink(id_)
+        self._link(id_, parent, previous)
+        return oldvalues
+
+    def delete(self, id_):
+        return self._unlink(id_)
+
+    def get_parent(self, id_):
+        return self.links[id_][0]
+
+    def get_previous(self, id_):
+        return self.links[id_][1]
+
+    def get_next(self, id_):
+        try:
+            nexts = self.nexts[(self.links[id_][0], id_)]
+        except KeyError:
+            return None
+        else:
+            for nid in nexts:
+                return nid
+
+    def get_children_unsorted(self, id_):
+        return list(self.children.get(id_, ()))
+
+    def get_children_sorted(self, parent):
+        ids = []
+        key = (parent, 0)
+
+        while key in self.nexts:
+            for id_ in self.nexts[key]:
+                ids.append(id_)
+                break
+
+            key = (parent, id_)
+
+        return ids
+
+    def has_children(self, id_):
+        return bool(self.children.get(id_))
+
+    def get_ancestors(self, id_):
+        # From the parent up to the root item
+        ancestors = []
+        parent = self.links[id_][0]
+
+        while parent != 0:
+            ancestors.append(parent)
+            parent = self.links[parent][0]
+
+        return ancestors
+
+    def get_descendants_sorted(self, id_):
+        # Walk the subtree depth-first in document order; use a stack instead
+        # of recursion, so that very deep trees cannot exceed the recursion
+        # limit
+        descendants = []
+        stack = self.get_children_sorted(id_)
+        stack.reverse()
+
+        while stack:
+            cid = stack.pop()
+            descendants.append(cid)
+            children = self.get_children_sorted(cid)
+            children.reverse()
+            stack.extend(children)
+
+        return descendants
+
+
 class Item(object):
-    def __init__(self, connection, dbhistory, items, filename, id_):
+    def __init__(self, connection, dbhistory, items, adjacency, filename,
+                                                                        id_):
         self.connection = connection
         self.dbhistory = dbhistory
         self.items = items
+        self.adjacency = adjacency
         self.filename = filename
         self.id_ = id_
 
@@ -61,6 +179,8 @@ class Item(object):
 
         databases.dbs[filename].connection.give(qconn)
 
+        databases.dbs[filename].adjacency.insert(id_, parent, previous)
+
         # For the moment it's necessary to pass 'text' for both the redo and
         # undo queries, because it's needed also when a history action removes
         # an item
@@ -71,7 +191,7 @@ class Item(object):
 
         db = databases.dbs[filename]
         databases.dbs[filename].items[id_] = cls(db.connection, db.dbhistory,
-                                                    db.items, filename, id_)
+                                        db.items, db.adjacency, filename, id_)
 
         if updnext:
             items[updnext.get_id()].update_previous(id_, group,
@@ -83,19 +203,89 @@ class Item(object):
 
         return id_
 
+    @classmethod
+    def insert_bulk(cls, filename, parent, previous, rows, group,
+                                                description='Insert items'):
+        # rows is a list of (text, children) tuples, where children is a list
+        # of rows in turn; the ids of the new items are returned in the same
+        # depth-first order in which rows are visited
+        if not rows:
+            return []
+
+        db = databases.dbs[filename]
+
+        # Set updnext *before* inserting the new items in the database
+        if previous > 0:
+            updnext = db.items[previous]._get_next()
+        else:
+            siblings = cls.get_children_sorted(filename, parent)
+
+            try:
+                updnext = db.items[siblings[0]]
+            except IndexError:
+                updnext = None
+
+        qconn = db.connection.get()
+        cursor = qconn.cursor()
+
+        cursor.execute(queries.items_select_max_id)
+        # This is the same id that SQLite would assign to a new row
+        firstid = (cursor.fetchone()[0] or 0) + 1
+        records = []
+
+        def flatten(parent, previous, rows):
+            for text, children in rows:
+                id_ = firstid + len(records)
+                records.append((id_, parent, previous, text))
+                flatten(id_, 0, children)
+                previous = id_
+
+            return previous
+
+        lastroot = flatten(parent, previous, rows)
+
+        cursor.executemany(queries.items_insert, records)
+        db.connection.give(qconn)
+
+        # For the moment it's necessary to pass 'text' for both the redo and
+        # undo queries, because it's needed also when a history action removes
+        # an item
+        db.dbhistory.insert_history_bulk(group, [(id_, 'insert',
+                description,
+                json.dumps((iparent, iprevious, text), separators=(',',':')),
+                json.dumps((iparent, text), separators=(',',':')))
+                for id_, iparent, iprevious, text in records])
+
+        for id_, iparent, iprevious, text in records:
+            db.adjacency.insert(id_, iparent, iprevious)
+            db.items[id_] = cls(db.connection, db.dbhistory, db.items,
+                                                db.adjacency, filename, id_)
+
+        if updnext:
+            updnext.update_previous(lastroot, group, description=description)
+
+        ids = [record[0] for record in records]
+
+        # Signal the event *after* updating the next item
+        items_insert_event.signal(filename=filename, ids=ids,
+                    items=[{'id_': id_, 'parent': iparent,
+                    'previous': iprevious, 'text': text}
+                    for id_, iparent, iprevious, text in records],
+                    group=group, description=description)
+
+        return ids
+
     def update_previous(self, previous, group, description='Update item'):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-
-        cursor.execute(queries.items_select_parent_previous, (self.id_, ))
-        oldvalues = cursor.fetchone()
-        parent = oldvalues["I_parent"]
         cursor.execute(queries.items_update_previous, (previous, self.id_))
         self.connection.give(qconn)
 
+        parent, oldprevious = self.adjacency.update_previous(self.id_,
+                                                                    previous)
+
         jhparams = json.dumps((parent, previous), separators=(',',':'))
-        jhunparams = json.dumps((parent, oldvalues["I_previous"]),
-                                                        separators=(',',':'))
+        jhunparams = json.dumps((parent, oldprevious), separators=(',',':'))
         self.dbhistory.insert_history(group, self.id_, 'update_previous',
                                             description, jhparams, jhunparams)
 
@@ -107,17 +297,17 @@ class Item(object):
                                                     description='Update item'):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-
-        cursor.execute(queries.items_select_parent_previous, (self.id_, ))
-        oldvalues = cursor.fetchone()
         cursor.execute(queries.items_update_parent, (parent, previous,
                                                                     self.id_))
         self.connection.give(qconn)
 
-        jhparams = json.dumps((oldvalues["I_parent"], parent, previous),
+        oldparent, oldprevious = self.adjacency.update_parent(self.id_, parent,
+                                                                    previous)
+
+        jhparams = json.dumps((oldparent, parent, previous),
+                                                        separators=(',',':'))
+        jhunparams = json.dumps((parent, oldparent, oldprevious),
                                                         separators=(',',':'))
-        jhunparams = json.dumps((parent, oldvalues["I_parent"],
-                                oldvalues["I_previous"]), separators=(',',':'))
         self.dbhistory.insert_history(group, self.id_, 'update_parent',
                                             description, jhparams, jhunparams)
 
@@ -178,6 +368,8 @@ class Item(object):
 
         self.connection.give(qconn)
 
+        self.adjacency.delete(self.id_)
+
         self.dbhistory.insert_history(group, self.id_, 'delete',
                                             description, hparams, hunparams)
 
@@ -281,11 +473,8 @@ class Item(object):
         return [self.items[id_] for id_ in self.get_children()]
 
     def _get_children_unsorted(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_children, (self.id_, ))
-        self.connection.give(qconn)
-        return [self.items[row["I_id"]] for row in cursor]
+        return [self.items[id_] for id_ in
+                            self.adjacency.get_children_unsorted(self.id_)]
 
     def get_children(self):
         return self.get_children_sorted(self.filename, self.id_)
@@ -303,23 +492,12 @@ class Item(object):
                 'text': row['I_text']}
 
     def get_ancestors(self):
-        ancestors = []
-        parent = self._get_parent()
-
-        if parent:
-            ancestors.append(parent.get_id())
-            ancestors.extend(parent.get_ancestors())
-
-        return ancestors
+        # Return the ancestors from the parent up to the root item
+        return self.adjacency.get_ancestors(self.id_)
 
     def get_descendants(self):
-        descendants = []
-
-        for child in self._get_children_unsorted():
-            descendants.append(child.get_id())
-            descendants.extend(child.get_descendants())
-
-        return descendants
+        # Return the whole subtree in document order
+        return self.adjacency.get_descendants_sorted(self.id_)
 
     def _get_previous(self):
         try:
@@ -328,11 +506,7 @@ class Item(object):
             return None
 
     def get_previous(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_previous, (self.id_, ))
-        self.connection.give(qconn)
-        return cursor.fetchone()['I_previous']
+        return self.adjacency.get_previous(self.id_)
 
     def _get_next(self):
         try:
@@ -341,16 +515,7 @@ class Item(object):
             return None
 
     def get_next(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_next, (self.id_, ))
-        self.connection.give(qconn)
-        nid = cursor.fetchone()
-
-        if nid:
-            return nid['I_id']
-        else:
-            return None
+        return self.adjacency.get_next(self.id_)
 
     def _get_parent(self):
         pid = self.get_parent()
@@ -361,12 +526,7 @@ class Item(object):
             return None
 
     def get_parent(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_parent, (self.id_, ))
-        self.connection.give(qconn)
-        pid = cursor.fetchone()
-        return pid['I_parent']
+        return self.adjacency.get_parent(self.id_)
 
     def get_text(self):
         qconn = self.connection.get()
@@ -377,26 +537,10 @@ class Item(object):
         return text
 
     def has_children(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_haschildren, (self.id_, ))
-        self.connection.give(qconn)
-
-        if cursor.fetchone():
-            return True
-        else:
-            return False
+        return self.adjacency.has_children(self.id_)
 
     def is_root(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_parent, (self.id_, ))
-        self.connection.give(qconn)
-
-        if cursor.fetchone()["I_parent"] == 0:
-            return True
-        else:
-            return False
+        return self.adjacency.get_parent(self.id_) == 0
 
     @classmethod
     def get_last_child(cls, filename, id_):
@@ -409,23 +553,4 @@ class Item(object):
 
     @staticmethod
     def get_children_sorted(filename, parent):
-        qconn = databases.dbs[filename].connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_parent, (parent, 0))
-        row = cursor.fetchone()
-        ids = []
-
-        if row:
-            ids.append(row["I_id"])
-
-            while True:
-                cursor.execute(queries.items_select_id_next, (ids[-1], ))
-                row = cursor.fetchone()
-
-                if row:
-                    ids.append(row["I_id"])
-                else:
-                    break
-
-        databases.dbs[filename].connection.give(qconn)
-        return ids
+        return databases.dbs[filename].adjacency.get_children_sorted(parent)
@@ -18,10 +18,18 @@
 
 pragma_valid_test = "PRAGMA schema_version"
 
+pragma_journal_mode_wal = "PRAGMA journal_mode=WAL"
+
+pragma_journal_mode_delete = "PRAGMA journal_mode=DELETE"
+
+pragma_query_only = "PRAGMA query_only=ON"
+
 master_select_tables = "SELECT name FROM sqlite_master WHERE type='table'"
 
 master_select_table = "SELECT * FROM {}"
 
+master_select_count = "SELECT COUNT(*) FROM {}"
+
 master_insert = "INSERT INTO {} ({}) VALUES ({})"
 
 master_delete = "DELETE FROM {}"
@@ -68,8 +76,21 @@ items_create = ("CREATE TABLE Items (I_id INTEGER PRIMARY KEY, "
                                     "I_previous INTEGER, "
                                     "I_text TEXT)")
 
+# Serves items_select_parent, items_select_id_children and
+# items_select_id_haschildren
+items_create_index_parent = ('CREATE INDEX Items_parent_previous '
+                                            'ON Items (I_parent, I_previous)')
+
+# Serves items_select_id_next
+items_create_index_previous = ('CREATE INDEX Items_previous '
+                                                    'ON Items (I_previous)')
+
 items_select_tree = 'SELECT I_id FROM Items'
 
+items_select_max_id = 'SELECT MAX(I_id) FROM Items'
+
+items_select_tree_adjacency = 'SELECT I_id, I_parent, I_previous FROM Items'
+
 items_select_id = ('SELECT I_parent, I_previous, I_text FROM Items '
                    'WHERE I_id=? LIMIT 1')
 
@@ -118,6 +139,14 @@ history_create = ("CREATE TABLE History (H_id INTEGER PRIMARY KEY, "
                                         "H_redo TEXT, "
                                         "H_undo TEXT)")
 
+# Serves history_select_group_undo, history_select_group_redo and the
+# subqueries of history_delete_select and history_delete_union
+history_create_index_group = 'CREATE INDEX History_group ON History (H_group)'
+
+# Serves history_select_status_*
+history_create_index_status = ('CREATE INDEX History_status '
+                                            'ON History (H_status, H_group)')
+
 # Do not change the index of H_undo [3]
 history_select_group_undo = ('SELECT H_id, H_item, H_type, H_undo '
                              'FROM History WHERE H_group=? ORDER BY H_id DESC')
@@ -154,7 +183,7 @@ history_update_status_new = ('UPDATE History SET H_status=5 '
 history_update_status_old = ('UPDATE History SET H_status=2 '
                              'WHERE H_status IN (0, 4)')
 
-history_update_id = 'UPDATE History SET H_status=? WHERE H_id=?'
+history_update_group_status = 'UPDATE History SET H_status=? WHERE H_group=?'
 
 # This won't be needed anymore when bug #13 will be implemented
 history_update_group = ('UPDATE History '
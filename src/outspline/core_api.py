@@ -31,6 +31,14 @@ def give_memory_connection(conn):
     return databases.memory.give(conn)
 
 
+def get_read_connection(filename):
+    return databases.dbs[filename].get_read_connection()
+
+
+def give_read_connection(filename, conn):
+    return databases.dbs[filename].give_read_connection(conn)
+
+
 def get_connection(filename):
     return databases.dbs[filename].connection.get()
 
@@ -39,6 +47,10 @@ def give_connection(filename, conn):
     return databases.dbs[filename].connection.give(conn)
 
 
+def commit_derived_changes(filename, conn):
+    return databases.dbs[filename].commit_derived_changes(conn)
+
+
 def create_database(filename):
     return databases.Database.create(filename)
 
@@ -101,6 +113,20 @@ def insert_item_after(filename, previous, group=None, text='New item',
             previous=previous, group=group, text=text, description=description)
 
 
+def insert_items_bulk(filename, parent, previous, rows, group=None,
+                                                description='Insert items'):
+    # If previous is None, append the new items as the last children of parent
+    if previous is None:
+        previous = items.Item.get_last_child(filename, parent)
+
+    if group == None:
+        group = databases.dbs[filename].dbhistory.get_next_history_group()
+
+    return items.Item.insert_bulk(filename=filename, parent=parent,
+                                previous=previous, rows=rows, group=group,
+                                description=description)
+
+
 def move_item_up(filename, id_, description='Move item up'):
     group = databases.dbs[filename].dbhistory.get_next_history_group()
     try:
@@ -137,9 +163,9 @@ def update_item_text(filename, id_, text, group=None,
 
 
 def register_history_action_handlers(filename, name, redo_handler,
-                                                                undo_handler):
+                                                    undo_handler, batch=False):
     return databases.dbs[filename].dbhistory.register_action_handlers(name,
-                                                    redo_handler, undo_handler)
+                                            redo_handler, undo_handler, batch)
 
 
 def insert_history(filename, group, id_, type, description, query_redo,
@@ -148,6 +174,18 @@ def insert_history(filename, group, id_, type, description, query_redo,
                                         description, query_redo, query_undo)
 
 
+def insert_history_bulk(filename, group, rows):
+    return databases.dbs[filename].dbhistory.insert_history_bulk(group, rows)
+
+
+def begin_history_group(filename):
+    return databases.dbs[filename].dbhistory.begin_history_group()
+
+
+def commit_history_group(filename):
+    return databases.dbs[filename].dbhistory.commit_history_group()
+
+
 def preview_undo_tree(filename):
     read = databases.dbs[filename].dbhistory.read_history_undo()
     if read:
@@ -348,6 +386,18 @@ def release_databases():
     return databases.protection.release()
 
 
+def block_databases_shared(block=False, quiet=False):
+    return databases.protection.block_shared(block=block, quiet=quiet)
+
+
+def release_databases_shared():
+    return databases.protection.release_shared()
+
+
+def get_databases_lock_statistics():
+    return databases.protection.get_statistics()
+
+
 def get_open_databases():
     return tuple(databases.dbs.keys())
 
@@ -388,6 +438,10 @@ def bind_to_save_database(handler, bind=True):
     return databases.save_database_event.bind(handler, bind)
 
 
+def bind_to_save_database_copy_progress(handler, bind=True):
+    return databases.save_database_copy_progress_event.bind(handler, bind)
+
+
 def bind_to_delete_subtree(handler, bind=True):
     return databases.delete_subtree_event.bind(handler, bind)
 
@@ -440,6 +494,10 @@ def bind_to_insert_item(handler, bind=True):
     return items.item_insert_event.bind(handler, bind)
 
 
+def bind_to_insert_items(handler, bind=True):
+    return items.items_insert_event.bind(handler, bind)
+
+
 def bind_to_update_item_simple(handler, bind=True):
     return items.item_update_previous_event.bind(handler, bind)
 
@@ -24,14 +24,24 @@ from outspline.extensions.organism import queries
 
 def add(cursor):
     cursor.execute(queries.rules_create)
+    cursor.execute(queries.rules_create_index_max)
     rows = cursor.execute(core_queries.items_select_tree).fetchall()
 
     for row in rows:
         cursor.execute(queries.rules_insert, (row['I_id'], json.dumps([])))
 
+    cursor.execute(queries.occurrences_create)
+    cursor.execute(queries.occurrences_create_index_item)
+    cursor.execute(queries.occurrences_create_index_start)
+    cursor.execute(queries.occurrences_create_index_alarm)
+    cursor.execute(queries.occurrencesproperties_create)
+    cursor.execute(queries.occurrencesproperties_insert_init)
+
 
 def remove(cursor):
     cursor.execute(queries.rules_drop)
+    cursor.execute(queries.occurrences_drop)
+    cursor.execute(queries.occurrencesproperties_drop)
 
 
 def upgrade_0_to_1(cursor):
@@ -46,3 +56,38 @@ def upgrade_1_to_2(cursor):
     # These queries must stay here because they must not be updated with the
     # normal queries
     pass
+
+
+def upgrade_2_to_3(cursor):
+    # These queries must stay here because they must not be updated with the
+    # normal queries
+    # The occurrences are generated when the database is opened, since the
+    # horizon is NULL
+    cursor.execute('CREATE TABLE Occurrences (O_id INTEGER PRIMARY KEY, '
+                                                'O_item INTEGER, '
+                                                'O_start INTEGER, '
+                                                'O_end INTEGER, '
+                                                'O_alarm INTEGER)')
+    cursor.execute('CREATE INDEX Occurrences_item ON Occurrences (O_item)')
+    cursor.execute('CREATE INDEX Occurrences_start ON Occurrences (O_start)')
+    cursor.execute('CREATE INDEX Occurrences_alarm ON Occurrences (O_alarm)')
+    cursor.execute('CREATE TABLE OccurrencesProperties '
+                                        '(OP_id INTEGER PRIMARY KEY, '
+                                         'OP_min INTEGER, '
+                                         'OP_max INTEGER, '
+                                         'OP_max_duration INTEGER, '
+                                         'OP_time_zone TEXT)')
+    cursor.execute('INSERT INTO OccurrencesProperties (OP_id, OP_min, OP_max, '
+                            'OP_max_duration, OP_time_zone) '
+                            'VALUES (NULL, NULL, NULL, 0, NULL)')
+
+
+def upgrade_3_to_4(cursor):
+    # These queries must stay here because they must not be updated with the
+    # normal queries
+    # Resetting the horizon makes organism regenerate the occurrences, and
+    # compute the time spans of the items, when the database is opened
+    cursor.execute('ALTER TABLE Rules ADD COLUMN R_min INTEGER')
+    cursor.execute('ALTER TABLE Rules ADD COLUMN R_max INTEGER')
+    cursor.execute('CREATE INDEX Rules_max ON Rules (R_max)')
+    cursor.execute('UPDATE OccurrencesProperties SET OP_min=NULL')
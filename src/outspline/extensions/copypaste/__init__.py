@@ -58,49 +58,57 @@ def paste_items(filename, baseid, mode, group, description='Paste items'):
     cursor = qmemory.cursor()
     cursor.execute(queries.copy_select_parent_roots)
     old_roots = cursor.fetchall()
-    core_api.give_memory_connection(qmemory)
 
-    old_to_new_ids = {}
+    # The old ids are stored in the same depth-first order in which
+    # core_api.insert_items_bulk assigns the new ids
+    old_ids = []
+
+    def read_children(baseid):
+        rows = []
+        previd = 0
 
-    def recurse(baseid, previd):
-        cursor.execute(queries.copy_select_parent, (baseid, previd))
-        child = cursor.fetchone()
+        while True:
+            cursor.execute(queries.copy_select_parent, (baseid, previd))
+            child = cursor.fetchone()
 
-        if child:
-            id_ = child['C_id']
+            if child:
+                previd = child['C_id']
+                old_ids.append(previd)
+                rows.append((child['C_text'], read_children(previd)))
+            else:
+                return rows
 
-            old_to_new_ids[id_] = core_api.append_item(
-                                filename, old_to_new_ids[baseid], group=group,
-                                text=child['C_text'], description=description)
+    rows = []
 
-            item_paste_event.signal(filename=filename, id_=old_to_new_ids[id_],
-                                    oldid=id_, group=group,
-                                    description=description)
+    for root in old_roots:
+        old_ids.append(root['C_id'])
+        rows.append((root['C_text'], read_children(root['C_id'])))
 
-            recurse(id_, 0)
-            recurse(baseid, id_)
+    core_api.give_memory_connection(qmemory)
 
-    if mode == 'siblings':
-        old_roots.reverse()
+    # The extensions add their own history rows for each pasted item: trim
+    # the history only once at the end
+    core_api.begin_history_group(filename)
 
-    for root in old_roots:
+    try:
         if mode == 'children':
-            old_to_new_ids[root['C_id']] = core_api.append_item(
-                                filename, baseid, group=group,
-                                text=root['C_text'], description=description)
+            new_ids = core_api.insert_items_bulk(filename, baseid, None, rows,
+                                        group=group, description=description)
         elif mode == 'siblings':
-            old_to_new_ids[root['C_id']] = core_api.insert_item_after(
-                                filename, baseid, group=group,
-                                text=root['C_text'], description=description)
+            new_ids = core_api.insert_items_bulk(filename,
+                                core_api.get_item_parent(filename, baseid),
+                                baseid, rows, group=group,
+                                description=description)
 
-        item_paste_event.signal(filename=filename,
-                                            id_=old_to_new_ids[root['C_id']],
-                                            oldid=root['C_id'], group=group,
-                                            description=description)
+        old_to_new_ids = dict(zip(old_ids, new_ids))
 
-        recurse(root['C_id'], 0)
+        for oldid in old_ids:
+            item_paste_event.signal(filename=filename,
+                                    id_=old_to_new_ids[oldid], oldid=oldid,
+                                    group=group, description=description)
+    finally:
+        core_api.commit_history_group(filename)
 
-    new_ids = old_to_new_ids.values()
     new_roots = [old_to_new_ids[root['C_id']] for root in old_roots]
 
     items_pasted_event.signal()
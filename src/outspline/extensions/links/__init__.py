@@ -61,11 +61,14 @@ def handle_open_database(kwargs):
             links.last_known_links[filename][row['L_id']] = row['L_target']
 
         core_api.register_history_action_handlers(filename, 'link_insert',
-                    links.handle_history_insert, links.handle_history_delete)
+                    links.handle_history_insert, links.handle_history_delete,
+                    batch=True)
         core_api.register_history_action_handlers(filename, 'link_update',
-                    links.handle_history_update, links.handle_history_update)
+                    links.handle_history_update, links.handle_history_update,
+                    batch=True)
         core_api.register_history_action_handlers(filename, 'link_delete',
-                    links.handle_history_delete, links.handle_history_insert)
+                    links.handle_history_delete, links.handle_history_insert,
+                    batch=True)
 
 
 def handle_close_database(kwargs):
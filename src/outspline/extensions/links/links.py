@@ -326,33 +326,47 @@ def paste_link(filename, id_, oldid, group, description):
             upsert_link(filename, id_, target, group, description)
 
 
-def handle_history_insert(filename, action, jparams, hid, type_, itemid):
+# The history handlers are batch handlers, so rows is a list of
+# (jparams, hid, itemid) tuples
+def handle_history_insert(filename, action, type_, rows):
     qconn = core_api.get_connection(filename)
     cursor = qconn.cursor()
-    do_insert_link(filename, cursor,
+
+    for jparams, hid, itemid in rows:
+        do_insert_link(filename, cursor,
                         itemid, int(jparams) if jparams is not None else None)
+
     core_api.give_connection(filename, qconn)
 
-    history_insert_event.signal(filename=filename, id_=itemid)
+    for jparams, hid, itemid in rows:
+        history_insert_event.signal(filename=filename, id_=itemid)
 
 
-def handle_history_update(filename, action, jparams, hid, type_, itemid):
+def handle_history_update(filename, action, type_, rows):
     qconn = core_api.get_connection(filename)
     cursor = qconn.cursor()
-    do_update_link(filename, cursor,
+
+    for jparams, hid, itemid in rows:
+        do_update_link(filename, cursor,
                         int(jparams) if jparams is not None else None, itemid)
+
     core_api.give_connection(filename, qconn)
 
-    history_update_event.signal(filename=filename, id_=itemid)
+    for jparams, hid, itemid in rows:
+        history_update_event.signal(filename=filename, id_=itemid)
 
 
-def handle_history_delete(filename, action, jparams, hid, type_, itemid):
+def handle_history_delete(filename, action, type_, rows):
     qconn = core_api.get_connection(filename)
     cursor = qconn.cursor()
-    do_delete_link(cursor, itemid)
+
+    for jparams, hid, itemid in rows:
+        do_delete_link(cursor, itemid)
+
     core_api.give_connection(filename, qconn)
 
-    history_delete_event.signal(filename=filename, id_=itemid)
+    for jparams, hid, itemid in rows:
+        history_delete_event.signal(filename=filename, id_=itemid)
 
 
 def get_last_known_target(filename, id_):
@@ -19,6 +19,12 @@
 links_create = ("CREATE TABLE Links (L_id INTEGER, "
                                        "L_target INTEGER)")
 
+# Serves links_select_id, links_update_id and links_delete_id
+links_create_index_id = 'CREATE INDEX Links_id ON Links (L_id)'
+
+# Serves links_select_target
+links_create_index_target = 'CREATE INDEX Links_target ON Links (L_target)'
+
 links_select = 'SELECT * FROM Links'
 
 links_select_id = 'SELECT L_target FROM Links WHERE L_id=? LIMIT 1'
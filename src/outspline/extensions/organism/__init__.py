@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
+
 from outspline.coreaux_api import Event
 import outspline.coreaux_api as coreaux_api
 import outspline.core_api as core_api
@@ -33,15 +35,32 @@ extension = None
 
 class Main(object):
     def __init__(self):
-        self.rules = items.Rules()
+        conf = coreaux_api.get_extension_configuration('organism')
+        self.rules = items.Rules(conf.get_bool('profile_rules'))
         self.databases = {}
+        self.range_cache = items.OccurrencesRangeCache(
+                                            conf.get_int('range_cache_size'))
+
+        # The parallel search processes are forked only once, here, while the
+        # extensions are being loaded, i.e. before any thread is started:
+        # forking from a thread while another one holds a lock (e.g. the
+        # logging one) could leave the lock held forever in the child
+        processes = conf.get_int('parallel_search_processes')
+
+        if processes > 1:
+            self.search_pool = multiprocessing.Pool(processes)
+            core_api.bind_to_exit_app_2(self._handle_exit_app)
+        else:
+            self.search_pool = None
 
         self._create_copy_table()
 
         core_api.bind_to_open_database_dirty(self._handle_open_database_dirty)
         core_api.bind_to_open_database(self._handle_open_database)
+        core_api.bind_to_closing_database(self._handle_closing_database)
         core_api.bind_to_close_database(self._handle_close_database)
         core_api.bind_to_insert_item(self._handle_insert_item)
+        core_api.bind_to_insert_items(self._handle_insert_items)
         core_api.bind_to_deleting_item(self._handle_delete_item)
 
         if copypaste_api:
@@ -51,6 +70,11 @@ class Main(object):
             copypaste_api.bind_to_safe_paste_check(
                                                 self._handle_safe_paste_check)
 
+    def _handle_exit_app(self, kwargs):
+        # The databases are closed, so no search can still be using the pool
+        self.search_pool.close()
+        self.search_pool.join()
+
     def _create_copy_table(self):
         mem = core_api.get_memory_connection()
         cur = mem.cursor()
@@ -68,7 +92,7 @@ class Main(object):
             pass
         else:
             filename = kwargs['filename']
-            self.databases[filename] = items.Database(filename)
+            self.databases[filename] = items.Database(filename, self.rules)
 
     def _handle_open_database(self, kwargs):
         filename = kwargs['filename']
@@ -80,6 +104,12 @@ class Main(object):
         else:
             database_open_event.signal(filename=filename)
 
+    def _handle_closing_database(self, kwargs):
+        try:
+            self.databases[kwargs['filename']].close()
+        except KeyError:
+            pass
+
     def _handle_close_database(self, kwargs):
         try:
             del self.databases[kwargs['filename']]
@@ -93,6 +123,13 @@ class Main(object):
         except KeyError:
             pass
 
+    def _handle_insert_items(self, kwargs):
+        try:
+            self.databases[kwargs['filename']].insert_items(kwargs['ids'],
+                                        kwargs['group'], kwargs['description'])
+        except KeyError:
+            pass
+
     def _handle_delete_item(self, kwargs):
         try:
             self.databases[kwargs['filename']].delete_item_rules(kwargs['id_'],
@@ -17,10 +17,17 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import marshal
+import cPickle
 import time as time_
+import threading
+import collections
+import itertools
+from bisect import bisect_left, bisect_right
 
 from outspline.static.pyaux import timeaux
 from outspline.coreaux_api import log, Event
+import outspline.coreaux_api as coreaux_api
 import outspline.core_api as core_api
 
 import queries
@@ -31,57 +38,137 @@ update_item_rules_conditional_event = Event()
 delete_item_rules_event = Event()
 history_insert_event = Event()
 history_update_event = Event()
+history_delete_event = Event()
 get_alarms_event = Event()
 
+# The versions of the databases are drawn from a single counter, so that a
+#  database that is closed and reopened never reuses an old version
+_versions = itertools.count()
+
+# The bounds stored for the open-ended sides of the items' time spans
+_SPAN_OPEN_MIN = -2 ** 62
+_SPAN_OPEN_MAX = 2 ** 62
+
 
 class Database(object):
-    def __init__(self, filename):
+    # Maximum items and occurrences generated in each step of the refresh of
+    # the horizon
+    REFRESH_ITEMS = 200
+    REFRESH_OCCURRENCES = 20000
+
+    def __init__(self, filename, rules):
         self.filename = filename
+        self.rules = rules
+        # The decoded rules of the items, keyed by item id; the items are
+        # decoded lazily, only when a search needs them, and the searches may
+        # read the cache from other threads while the main thread updates it
+        # The items whose rules are updated or deleted are always cached, with
+        # an empty list if they have no rules, so that a search can never
+        # replace them with rules that it read before the update
+        # The cached lists are shared with the searches and the event
+        # handlers, so they must never be modified in place
+        self.rules_cache = {}
+        # Whether all the items with valid rules have been cached
+        self.rules_cache_complete = False
+        self.rules_cache_lock = threading.Lock()
+        # The version changes whenever the rules of an item change, and it
+        #  identifies the range search results that are still valid
+        self.version = next(_versions)
+
+        conf = coreaux_api.get_extension_configuration('organism')
+        self.horizon = conf.get_int('occurrences_horizon_days') * 86400
+        self.item_limit = conf.get_int('occurrences_item_limit')
+        # The (min, max) bounds of the horizon while its occurrences are being
+        # generated in the background
+        self.refresh = None
+        self.refresh_thread = None
+        self.refresh_stop = False
 
     def post_init(self):
+        # The materialized occurrences are only derived from the rules, so
+        # they are committed without waiting for the database to be saved,
+        # where possible, instead of being left among the unsaved changes,
+        # which would also keep the searches from using the read connections
+        qconn = core_api.get_connection(self.filename)
+        cursor = qconn.cursor()
+        self._check_occurrences_horizon(cursor)
+        core_api.commit_derived_changes(self.filename, qconn)
+        core_api.give_connection(self.filename, qconn)
+
         core_api.register_history_action_handlers(self.filename,
                                 'rules_insert', self._handle_history_insert,
-                                self._handle_history_delete)
+                                self._handle_history_delete, batch=True)
         core_api.register_history_action_handlers(self.filename,
                                 'rules_update', self._handle_history_update,
-                                self._handle_history_update)
+                                self._handle_history_update, batch=True)
         core_api.register_history_action_handlers(self.filename,
                                 'rules_delete', self._handle_history_delete,
-                                self._handle_history_insert)
+                                self._handle_history_insert, batch=True)
+
+        if self.refresh:
+            self.refresh_thread = threading.Thread(
+                                    target=self._refresh_occurrences_horizon)
+            self.refresh_thread.start()
+
+    def close(self):
+        # The refresh of the horizon must release the connection before the
+        # database is closed; if it is interrupted, it is restarted the next
+        # time that the database is opened
+        if self.refresh_thread:
+            self.refresh_stop = True
+            self.refresh_thread.join()
+
+    # These methods have to accept filename as the first argument, even though
+    # they're part of this object; they are batch handlers, so rows is a list
+    # of (jparams, hid, itemid) tuples
+    def _handle_history_insert(self, filename, action, type_, rows):
+        decoded = [(itemid, self.decode_rules(jparams))
+                                            for jparams, hid, itemid in rows]
 
-    # This method has to accept filename as the first argument, even though
-    # it's part of this object
-    def _handle_history_insert(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_insert, (itemid, jparams))
+        cursor.executemany(queries.rules_insert, [(itemid, jparams)
+                                            for jparams, hid, itemid in rows])
+        self._update_occurrences(cursor, decoded)
         core_api.give_connection(filename, qconn)
 
-        history_insert_event.signal(filename=filename, id_=itemid,
-                                        rules=self.string_to_rules(jparams))
+        self._cache_item_rules(decoded)
+
+        for itemid, rules in decoded:
+            history_insert_event.signal(filename=filename, id_=itemid,
+                                                                rules=rules)
+
+    def _handle_history_update(self, filename, action, type_, rows):
+        decoded = [(itemid, self.decode_rules(jparams))
+                                            for jparams, hid, itemid in rows]
 
-    # This method has to accept filename as the first argument, even though
-    # it's part of this object
-    def _handle_history_update(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_update_id, (jparams, itemid))
+        cursor.executemany(queries.rules_update_id, [(jparams, itemid)
+                                            for jparams, hid, itemid in rows])
+        self._update_occurrences(cursor, decoded)
         core_api.give_connection(filename, qconn)
 
-        history_update_event.signal(filename=filename, id_=itemid,
-                                        rules=self.string_to_rules(jparams))
+        self._cache_item_rules(decoded)
 
-    # This method has to accept filename as the first argument, even though
-    # it's part of this object
-    def _handle_history_delete(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
+        for itemid, rules in decoded:
+            history_update_event.signal(filename=filename, id_=itemid,
+                                                                rules=rules)
+
+    def _handle_history_delete(self, filename, action, type_, rows):
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_delete_id, (itemid, ))
+        cursor.executemany(queries.rules_delete_id, [(itemid, )
+                                            for jparams, hid, itemid in rows])
+        cursor.executemany(queries.occurrences_delete_item, [(itemid, )
+                                            for jparams, hid, itemid in rows])
         core_api.give_connection(filename, qconn)
 
+        self._cache_item_rules([(itemid, []) for jparams, hid, itemid in rows])
+
+        for jparams, hid, itemid in rows:
+            history_delete_event.signal(filename=filename, id_=itemid)
+
     def insert_item(self, id_, group, description='Insert item'):
         srules = self.rules_to_string([])
 
@@ -93,6 +180,18 @@ class Database(object):
         core_api.insert_history(self.filename, group, id_, 'rules_insert',
                                                     description, srules, None)
 
+    def insert_items(self, ids, group, description='Insert items'):
+        srules = self.rules_to_string([])
+
+        qconn = core_api.get_connection(self.filename)
+        cursor = qconn.cursor()
+        cursor.executemany(queries.rules_insert, [(id_, srules)
+                                                            for id_ in ids])
+        core_api.give_connection(self.filename, qconn)
+
+        core_api.insert_history_bulk(self.filename, group, [(id_,
+                    'rules_insert', description, srules, None) for id_ in ids])
+
     def update_item_rules(self, id_, rules, group,
                                             description='Update item rules'):
         self._update_item_rules_no_event(id_, rules, group,
@@ -108,6 +207,10 @@ class Database(object):
         if isinstance(rules, list):
             rules = self.rules_to_string(rules)
 
+        # Always cache a list decoded here, so that it cannot be modified by
+        # the caller
+        decoded = [(id_, self.decode_rules(rules))]
+
         qconn = core_api.get_connection(self.filename)
         cursor = qconn.cursor()
 
@@ -118,9 +221,12 @@ class Database(object):
         unrules = sel['R_rules']
 
         cursor.execute(queries.rules_update_id, (rules, id_))
+        self._update_occurrences(cursor, decoded)
 
         core_api.give_connection(self.filename, qconn)
 
+        self._cache_item_rules(decoded)
+
         core_api.insert_history(self.filename, group, id_, 'rules_update',
                                                 description, rules, unrules)
 
@@ -157,9 +263,12 @@ class Database(object):
         current_rules = sel['R_rules']
 
         cursor.execute(queries.rules_delete_id, (id_, ))
+        cursor.execute(queries.occurrences_delete_item, (id_, ))
 
         core_api.give_connection(self.filename, qconn)
 
+        self._cache_item_rules(((id_, []), ))
+
         core_api.insert_history(self.filename, group, id_, 'rules_delete',
                                             description, None, current_rules)
 
@@ -177,12 +286,283 @@ class Database(object):
         return self.string_to_rules(row['R_rules'])
 
     def get_all_valid_item_rules(self):
-        qconn = core_api.get_connection(self.filename)
+        qconn = core_api.get_read_connection(self.filename)
         cursor = qconn.cursor()
         cursor.execute(queries.rules_select_all, (self.rules_to_string([]), ))
-        core_api.give_connection(self.filename, qconn)
+        rows = cursor.fetchall()
+        core_api.give_read_connection(self.filename, qconn)
 
-        return cursor
+        return rows
+
+    def iter_all_valid_item_rules(self):
+        # Iterate over a snapshot, so that the cache can be updated during the
+        # searches
+        with self.rules_cache_lock:
+            complete = self.rules_cache_complete
+
+        if not complete:
+            self._cache_rows([(row['R_id'], row['R_rules'])
+                                for row in self.get_all_valid_item_rules()])
+
+            # The items updated in the meantime have been cached anyway
+            with self.rules_cache_lock:
+                self.rules_cache_complete = True
+
+        with self.rules_cache_lock:
+            items = [(id_, rules) for id_, rules in
+                                    self.rules_cache.iteritems() if rules]
+
+        return iter(items)
+
+    def iter_valid_item_rules(self, ids):
+        with self.rules_cache_lock:
+            if self.rules_cache_complete:
+                missing = ()
+            else:
+                missing = [id_ for id_ in ids if id_ not in self.rules_cache]
+
+        if missing:
+            rows = []
+            qconn = core_api.get_read_connection(self.filename)
+            cursor = qconn.cursor()
+
+            for id_ in missing:
+                cursor.execute(queries.rules_select_id, (id_, ))
+                row = cursor.fetchone()
+
+                if row:
+                    rows.append((id_, row['R_rules']))
+
+            core_api.give_read_connection(self.filename, qconn)
+
+            self._cache_rows(rows)
+
+        with self.rules_cache_lock:
+            items = [(id_, self.rules_cache[id_]) for id_ in ids
+                                                if self.rules_cache.get(id_)]
+
+        return iter(items)
+
+    def iter_valid_item_rules_range(self, mint, maxt):
+        # Only the items whose time span overlaps the range are decoded and
+        # returned; maxt can be None for a range without an end
+        qconn = core_api.get_read_connection(self.filename)
+        cursor = qconn.cursor()
+        cursor.execute(queries.occurrencesproperties_select)
+        props = cursor.fetchone()
+
+        # The time spans of the local rules are computed in the time zone of
+        # the materialized occurrences, and they may not have been updated yet
+        # while the horizon is being refreshed
+        if props['OP_min'] is None or \
+                                props['OP_time_zone'] != get_time_zone():
+            rows = None
+        else:
+            if maxt is None:
+                cursor.execute(queries.rules_select_span_after, (mint, ))
+            else:
+                cursor.execute(queries.rules_select_span, (mint, maxt))
+
+            rows = [(row['R_id'], row['R_rules']) for row in cursor]
+
+        core_api.give_read_connection(self.filename, qconn)
+
+        if rows is None:
+            return self.iter_all_valid_item_rules()
+        else:
+            return iter(self._cache_rows(rows))
+
+    def _cache_rows(self, rows):
+        # rows is a sequence of (id_, string) tuples read from the database;
+        # return the (id_, rules) tuples of the items with rules
+        # The items that are already cached are not decoded again, and their
+        # cached rules prevail, since they may have been updated after the
+        # rows were read
+        with self.rules_cache_lock:
+            missing = [(id_, string) for id_, string in rows
+                                                if id_ not in self.rules_cache]
+
+        decoded = [(id_, self.decode_rules(string))
+                                                for id_, string in missing]
+
+        with self.rules_cache_lock:
+            for id_, rules in decoded:
+                self.rules_cache.setdefault(id_, rules)
+
+            return [(id_, self.rules_cache[id_]) for id_, string in rows
+                                                    if self.rules_cache[id_]]
+
+    def _cache_item_rules(self, decoded):
+        # decoded is a sequence of (id_, rules) tuples
+        # The version is changed only after updating the cache, which the
+        # searches read the rules from
+        with self.rules_cache_lock:
+            for id_, rules in decoded:
+                self.rules_cache[id_] = rules
+
+            self.version = next(_versions)
+
+    def get_occurrences_range_rows(self, mint, maxt):
+        # Return None if the range is not covered by the materialized
+        # occurrences, which must then be searched on the fly
+        qconn = core_api.get_read_connection(self.filename)
+        cursor = qconn.cursor()
+        cursor.execute(queries.occurrencesproperties_select)
+        props = cursor.fetchone()
+
+        if props['OP_min'] is None or mint < props['OP_min'] or \
+                                    maxt > props['OP_max'] or \
+                                    props['OP_time_zone'] != get_time_zone():
+            rows = None
+        else:
+            cursor.execute(queries.occurrences_select_range, (mint, maxt,
+                                mint - props['OP_max_duration'], mint, mint,
+                                mint, maxt))
+            occrows = cursor.fetchall()
+            cursor.execute(queries.occurrences_select_unbounded)
+            rows = (occrows, [row['O_item'] for row in cursor.fetchall()])
+
+        core_api.give_read_connection(self.filename, qconn)
+
+        return rows
+
+    def _check_occurrences_horizon(self, cursor):
+        # The horizon is centered on the time the database is opened, and it
+        # is moved only when that time has drifted by more than half of its
+        # span; the local occurrences also depend on the time zone
+        # The old occurrences are discarded immediately, and the searches
+        # expand the rules on the fly until the new ones have been generated
+        # in the background; a NULL horizon is also left by a refresh that
+        # did not complete
+        cursor.execute(queries.occurrencesproperties_select)
+        props = cursor.fetchone()
+        now = int(time_.time())
+
+        if props['OP_min'] is None or \
+                    props['OP_time_zone'] != get_time_zone() or \
+                    props['OP_max'] - props['OP_min'] != self.horizon * 2 or \
+                    abs(now - props['OP_min'] - self.horizon) > \
+                                                        self.horizon // 2:
+            cursor.execute(queries.occurrences_delete)
+            cursor.execute(queries.occurrencesproperties_update, (None, None,
+                                                        0, get_time_zone()))
+            self.refresh = (now - self.horizon, now + self.horizon)
+
+    def _refresh_occurrences_horizon(self):
+        # Generate the occurrences of a few items at a time, giving the
+        # connection back between a step and the next, so that the database
+        # can be used in the meantime; the items are read again at every step,
+        # and the ones whose rules are changed in the meantime are regenerated
+        # by the history handlers, which already use the new horizon
+        lastid = 0
+
+        while not self.refresh_stop:
+            qconn = core_api.get_connection(self.filename)
+            cursor = qconn.cursor()
+            cursor.execute(queries.rules_select_all_after,
+                                    (self.rules_to_string([]), lastid,
+                                    self.REFRESH_ITEMS))
+            rows = cursor.fetchall()
+            occurrences = 0
+
+            for row in rows:
+                occurrences += self._update_occurrences(cursor, [(row['R_id'],
+                                        self.decode_rules(row['R_rules']))])
+                lastid = row['R_id']
+
+                if occurrences > self.REFRESH_OCCURRENCES:
+                    break
+
+            if not rows:
+                cursor.execute(queries.occurrencesproperties_update_horizon,
+                                                                self.refresh)
+                self.refresh = None
+
+            core_api.commit_derived_changes(self.filename, qconn)
+            core_api.give_connection(self.filename, qconn)
+
+            if not rows:
+                break
+
+    def _update_occurrences(self, cursor, rows):
+        # rows is a sequence of (id_, rules) tuples; the items' occurrences
+        # are regenerated from scratch, and the number of stored rows is
+        # returned
+        cursor.execute(queries.occurrencesproperties_select)
+        props = cursor.fetchone()
+
+        if self.refresh:
+            mint, maxt = self.refresh
+        else:
+            mint = props['OP_min']
+            maxt = props['OP_max']
+
+        maxduration = props['OP_max_duration']
+        occrows = []
+        spanrows = []
+        utcoffset = timeaux.UTCOffset()
+        # If the time zone has changed since the horizon was generated, the
+        # time spans are stored as open-ended, since they could not be
+        # compared with the others
+        current_zone = props['OP_time_zone'] == get_time_zone()
+
+        cursor.executemany(queries.occurrences_delete_item, [(id_, )
+                                                    for id_, rules in rows])
+
+        for id_, rules in rows:
+            if current_zone:
+                span = self.rules.get_item_time_span(rules, utcoffset)
+            else:
+                span = (None, None)
+
+            if span is None:
+                spanrows.append((None, None, id_))
+            else:
+                spanrows.append((
+                        _SPAN_OPEN_MIN if span[0] is None else span[0],
+                        _SPAN_OPEN_MAX if span[1] is None else span[1], id_))
+
+            occs = self._expand_item_rules(mint, maxt, id_, rules)
+
+            if occs is None:
+                occrows.append((id_, None, None, None))
+            else:
+                for occ in occs:
+                    occrows.append((id_, occ.start, occ.end, occ.alarm))
+
+                    if occ.end:
+                        maxduration = max(maxduration,
+                                                    occ.end - occ.start)
+
+        cursor.executemany(queries.occurrences_insert, occrows)
+        cursor.executemany(queries.rules_update_id_span, spanrows)
+
+        # The stored longest duration is only an upper bound, it is reset when
+        # the horizon is refreshed
+        if maxduration != props['OP_max_duration']:
+            cursor.execute(queries.occurrencesproperties_update_max_duration,
+                                                            (maxduration, ))
+
+        return len(occrows)
+
+    def _expand_item_rules(self, mint, maxt, id_, rules):
+        # Return None as soon as the item turns out to have more occurrences
+        # than the limit, without generating the rest of them: such an item is
+        # always searched on the fly anyway
+        occs = LimitedOccurrencesRange(mint, maxt, self.item_limit)
+
+        if rules:
+            utcoffset = timeaux.UTCOffset()
+            utcmint = mint - utcoffset.compute(mint)
+
+            try:
+                for rule in rules:
+                    rule.search_range(mint, utcmint, maxt, utcoffset,
+                                                self.filename, id_, rule, occs)
+            except OccurrencesRangeLimit:
+                return None
+
+        return occs.get_list()
 
     def get_all_item_rules(self):
         qconn = core_api.get_connection(self.filename)
@@ -203,10 +583,135 @@ class Database(object):
         # by json.loads)
         return json.loads(string)
 
+    def decode_rules(self, string):
+        # The rules used internally by the searches are compiled
+        return self.rules.compile_rules(self.string_to_rules(string))
+
+
+def get_time_zone():
+    # The local occurrence times depend on the time zone
+    return ' '.join((str(time_.timezone), str(time_.altzone),
+                                str(time_.daylight), ' '.join(time_.tzname)))
+
+
+class Occurrence(object):
+    # Occurrences are generated in large numbers, so they are stored in slotted
+    # objects instead of dictionaries; alarmid is only set for the occurrences
+    # of the alarms stored by organism_alarms
+    # The read-only dictionary interface is kept for compatibility, e.g. with
+    # the plugins that still use occ['start']
+    __slots__ = ('filename', 'id_', 'start', 'end', 'alarm', 'alarmid')
+
+    def __init__(self, filename, id_, start, end, alarm, alarmid=None):
+        self.filename = filename
+        self.id_ = id_
+        self.start = start
+        self.end = end
+        self.alarm = alarm
+        self.alarmid = alarmid
+
+    def __eq__(self, other):
+        return isinstance(other, Occurrence) and \
+                                        self.get_tuple() == other.get_tuple()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    # Like dictionaries, occurrences are compared by value, so they can't be
+    # hashed
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Occurrence{}'.format(self.get_tuple())
+
+    def __getitem__(self, key):
+        if key in self:
+            return getattr(self, key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and (key != 'alarmid' or
+                                                    self.alarmid is not None)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_tuple(self):
+        return (self.filename, self.id_, self.start, self.end, self.alarm,
+                                                                self.alarmid)
+
+
+class CompiledRule(dict):
+    # The rules are compiled when they are decoded, i.e. when they are loaded
+    # or updated, so that the searches can call their handlers directly,
+    # instead of looking them up by name for every rule they search; the
+    # compiled rules are still dictionaries, like the decoded ones
+    # search_next is the handler of organism_timer's next occurrences search
+    # params holds the constants that the handlers need, as computed once by
+    # the rule's compiler, or the rule's '#' parameters if it doesn't have one
+    __slots__ = ('search_range', 'search_next', 'params')
+
+    def __init__(self, rule, search_range, search_next, params):
+        dict.__init__(self, rule)
+        self.search_range = search_range
+        self.search_next = search_next
+        self.params = params
+
+    def __reduce__(self):
+        # The parallel search workers receive the compiled rules, so the
+        # handlers must be picklable, i.e. module-level functions
+        return (CompiledRule, (dict(self), self.search_range,
+                                            self.search_next, self.params))
+
+
+class _MissingRuleHandler(object):
+    # Searching a rule without a handler must fail like when the handler was
+    # looked up by name; this is a class so that it can be pickled
+    def __init__(self, rulename):
+        self.rulename = rulename
+
+    def __call__(self, *args):
+        raise KeyError(self.rulename)
+
+
+class _ProfiledRuleHandler(object):
+    # Wrap a rule handler to accumulate the number of its calls and the time
+    # spent in them
+    def __init__(self, stats, key, handler):
+        self.stats = stats
+        self.key = key
+        self.handler = handler
+
+    def __reduce__(self):
+        # The parallel search workers account their calls in their own
+        # statistics, which are not reported; do not pickle the shared ones,
+        # which may be changing on other threads
+        return (_ProfiledRuleHandler, ({}, self.key, self.handler))
+
+    def __call__(self, *args):
+        start = time_.time()
+
+        try:
+            return self.handler(*args)
+        finally:
+            stat = self.stats.setdefault(self.key, [0, 0.0])
+            stat[0] += 1
+            stat[1] += time_.time() - start
+
 
 class Rules(object):
-    def __init__(self):
+    def __init__(self, profile=False):
         self.handlers = {}
+        self.next_handlers = {}
+        self.span_handlers = {}
+        self.compilers = {}
+        # When profiling, the statistics of the rule handlers are collected
+        # here and logged after each range search
+        self.profile = {} if profile else None
 
     def install_rule_handler(self, rulename, handler):
         # The rules should be installed separately for each database (bug #330)
@@ -215,6 +720,111 @@ class Rules(object):
         else:
             raise ConflictingRuleHandlerError()
 
+    def install_next_rule_handler(self, rulename, handler):
+        # organism_timer checks its own handlers for conflicts
+        self.next_handlers[rulename] = handler
+
+    def install_rule_compiler(self, rulename, compiler):
+        # A compiler receives a decoded rule and returns the constants that
+        # the rule's handlers will find in its params attribute
+        if rulename not in self.compilers:
+            self.compilers[rulename] = compiler
+        else:
+            raise ConflictingRuleHandlerError()
+
+    def install_rule_span_handler(self, rulename, handler):
+        # A span handler returns the earliest and latest times (start, end or
+        # alarm) that the rule's occurrences can have, with None for an
+        # open-ended side, or None if the rule cannot produce occurrences
+        # The rules without a span handler are considered open-ended
+        if rulename not in self.span_handlers:
+            self.span_handlers[rulename] = handler
+        else:
+            raise ConflictingRuleHandlerError()
+
+    def get_item_time_span(self, rules, utcoffset):
+        # Return the span containing all the occurrences of an item, with
+        # None for an open-ended side, or None if the rules cannot produce
+        # occurrences
+        minspan = None
+        maxspan = None
+        empty = True
+
+        for rule in rules:
+            try:
+                handler = self.span_handlers[rule['rule']]
+            except KeyError:
+                return (None, None)
+
+            span = handler(utcoffset, rule)
+
+            if span is not None:
+                rmin, rmax = span
+
+                if empty:
+                    minspan = rmin
+                    maxspan = rmax
+                    empty = False
+                else:
+                    if minspan is not None:
+                        minspan = None if rmin is None else min(minspan, rmin)
+
+                    if maxspan is not None:
+                        maxspan = None if rmax is None else max(maxspan, rmax)
+
+        if empty:
+            return None
+        else:
+            return (minspan, maxspan)
+
+    def compile_rules(self, rules):
+        # Note that the handlers must be installed before the rules are
+        # decoded, i.e. before any database is opened
+        compiled = []
+
+        for rule in rules:
+            name = rule['rule']
+
+            try:
+                search_range = self.handlers[name]
+            except KeyError:
+                search_range = _MissingRuleHandler(name)
+
+            try:
+                search_next = self.next_handlers[name]
+            except KeyError:
+                search_next = _MissingRuleHandler(name)
+
+            try:
+                compiler = self.compilers[name]
+            except KeyError:
+                params = rule.get('#')
+            else:
+                params = compiler(rule)
+
+            if self.profile is not None:
+                search_range = _ProfiledRuleHandler(self.profile,
+                                                (name, 'range'), search_range)
+                search_next = _ProfiledRuleHandler(self.profile,
+                                                (name, 'next'), search_next)
+
+            compiled.append(CompiledRule(rule, search_range, search_next,
+                                                                    params))
+
+        return compiled
+
+    def log_profile(self):
+        # The statistics are reset after being logged, so that every log
+        # reports the handlers called since the previous one, including those
+        # of the next occurrences searches
+        stats = sorted(self.profile.iteritems(), key=lambda stat: stat[1][1],
+                                                                reverse=True)
+        self.profile.clear()
+
+        for (name, search), (calls, seconds) in stats:
+            log.debug('Rule {} ({}): {} calls in {} s'.format(name, search,
+                                                                calls, seconds))
+
 
 class OccurrencesRange(object):
     def __init__(self, mint, maxt):
@@ -222,8 +832,12 @@ class OccurrencesRange(object):
         self.maxt = maxt
         self.dict_ = {}
         self.actd = {}
+        # (filename, id_) -> list of (start, end, inclusive) except periods
+        #  not yet applied to the item's occurrences in self.dict_
+        self.excepts = {}
 
     def update(self, occ, origalarm):
+        self._apply_excepts()
         return self._update(self.dict_, self.add_safe, self._replace, occ,
                                                                      origalarm)
 
@@ -234,34 +848,61 @@ class OccurrencesRange(object):
     def add(self, occ):
         # Make sure this occurrence is compliant with the requirements defined
         # in organism_api.update_item_rules
-        if occ['start'] and (not occ['end'] or occ['end'] > occ['start']):
+        if occ.start and (not occ.end or occ.end > occ.start):
             return self.add_safe(occ)
         else:
             raise BadOccurrenceError()
 
     def add_safe(self, occ):
         # This method must accept the same arguments as self.add_active
-        # Occurrences with self.mint == occ['end'] shouldn't be added, as
+        # Occurrences with self.mint == occ.end shouldn't be added, as
         # they're not considered part of the end minute
-        if self.mint <= occ['start'] <= self.maxt or \
-                   (occ['end'] and occ['start'] <= self.mint < occ['end']) or \
-                     (occ['alarm'] and self.mint <= occ['alarm'] <= self.maxt):
+        if self.mint <= occ.start <= self.maxt or \
+                   (occ.end and occ.start <= self.mint < occ.end) or \
+                     (occ.alarm and self.mint <= occ.alarm <= self.maxt):
+            # The except periods of the previous rules must not affect the
+            # occurrences of the following ones
+            if self.excepts:
+                self._apply_item_excepts(occ.filename, occ.id_)
+
             self._add(self.dict_, occ)
             return True
         else:
             return False
 
+    def add_many(self, filename, id_, occs):
+        # Bulk version of self.add_safe for rules that compute all their
+        # occurrences at once; all the occurrences must belong to the same
+        # item, and are filtered with exactly the same conditions
+        mint = self.mint
+        maxt = self.maxt
+        kept = [occ for occ in occs if mint <= occ.start <= maxt or
+                            (occ.end and occ.start <= mint < occ.end) or
+                            (occ.alarm and mint <= occ.alarm <= maxt)]
+
+        if kept:
+            if self.excepts:
+                self._apply_item_excepts(filename, id_)
+
+            try:
+                self.dict_[filename][id_].extend(kept)
+            except KeyError:
+                try:
+                    self.dict_[filename][id_] = kept
+                except KeyError:
+                    self.dict_[filename] = {id_: kept}
+
+        return len(kept)
+
     def add_active(self, occ):
         # This method must accept the same arguments as self.add
         return self._add(self.actd, occ)
 
     def _update(self, occsd, add, action, occ, origalarm):
-        filename = occ['filename']
-        id_ = occ['id_']
+        filename = occ.filename
+        id_ = occ.id_
 
-        oocc = occ.copy()
-        oocc['alarm'] = origalarm
-        del oocc['alarmid']
+        oocc = Occurrence(filename, id_, occ.start, occ.end, origalarm)
 
         try:
             occsd[filename][id_]
@@ -277,8 +918,8 @@ class OccurrencesRange(object):
                 return True
 
     def _add(self, occsd, occ):
-        filename = occ['filename']
-        id_ = occ['id_']
+        filename = occ.filename
+        id_ = occ.id_
 
         try:
             occsd[filename][id_]
@@ -319,28 +960,97 @@ class OccurrencesRange(object):
         # when he saves the rules list, not here, where the exception has to be
         # just silenced
         try:
-            dc = self.dict_[filename][id_][:]
+            self.dict_[filename][id_]
         except KeyError:
             pass
         else:
-            for o in dc:
-                # Occurrences with start == o['end'] shouldn't be excepted, as
-                # they're not considered part of the end minute
-                if start <= o['start'] <= end or \
-                                (inclusive and o['start'] <= start < o['end']):
-                    self.dict_[filename][id_].remove(o)
-                    if not self.dict_[filename][id_]:
-                        del self.dict_[filename][id_]
-                        if not self.dict_[filename]:
-                            del self.dict_[filename]
+            # Rules like except_regularly call this method once per except
+            # period, so the periods are only collected here, and applied all
+            # together in a single pass when the item's occurrences are needed
+            try:
+                self.excepts[(filename, id_)].append((start, end, inclusive))
+            except KeyError:
+                self.excepts[(filename, id_)] = [(start, end, inclusive)]
+
+    def _apply_excepts(self):
+        for filename, id_ in self.excepts.keys():
+            self._apply_item_excepts(filename, id_)
+
+    def _apply_item_excepts(self, filename, id_):
+        try:
+            periods = self.excepts.pop((filename, id_))
+        except KeyError:
+            return
+
+        periods.sort()
+
+        # An occurrence is excepted if it starts in any except period, so
+        # merge the periods into disjoint intervals to bisect them; if the
+        # period is inclusive, the occurrence is also excepted if the period
+        # starts during the occurrence
+        starts = []
+        ends = []
+        inclstarts = []
+
+        for start, end, inclusive in periods:
+            if starts and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+            if inclusive:
+                inclstarts.append(start)
+
+        occs = self.dict_[filename][id_]
+        kept = []
+
+        for o in occs:
+            # Occurrences with start == o.end shouldn't be excepted, as
+            # they're not considered part of the end minute
+            i = bisect_right(starts, o.start) - 1
+
+            if i > -1 and o.start <= ends[i]:
+                continue
+
+            if o.end and inclstarts:
+                i = bisect_left(inclstarts, o.start)
+
+                if i < len(inclstarts) and inclstarts[i] < o.end:
+                    continue
+
+            kept.append(o)
+
+        if kept:
+            occs[:] = kept
+        else:
+            del self.dict_[filename][id_]
+
+            if not self.dict_[filename]:
+                del self.dict_[filename]
+
+    def copy(self):
+        # The occurrences are never modified, so only the containers are
+        # copied
+        self._apply_excepts()
+        occs = OccurrencesRange(self.mint, self.maxt)
+        occs.dict_ = {filename: {id_: list(ioccs) for id_, ioccs in
+                        self.dict_[filename].iteritems()}
+                        for filename in self.dict_}
+        occs.actd = {filename: {id_: list(ioccs) for id_, ioccs in
+                        self.actd[filename].iteritems()}
+                        for filename in self.actd}
+        return occs
 
     def get_dict(self):
+        self._apply_excepts()
         return self.dict_
 
     def get_active_dict(self):
         return self.actd
 
     def get_list(self):
+        self._apply_excepts()
         occsl = []
         for f in self.dict_:
             for i in self.dict_[f]:
@@ -358,78 +1068,196 @@ class OccurrencesRange(object):
 
     def get_next_completion_time(self):
         # Note that this method ignores self.actd _deliberately_
+        self._apply_excepts()
         ctime = None
         for f in self.dict_:
             for i in self.dict_[f]:
                 for o in self.dict_[f][i]:
-                    t = max((o['end'], o['start'], o['alarm']))
+                    t = max((o.end, o.start, o.alarm))
                     if t and (not ctime or t < ctime):
                         ctime = t
         return ctime
 
+    def get_item_occurrences(self, filename, id_):
+        # Note that this method ignores self.actd _deliberately_
+        # The returned list must not be modified
+        self._apply_item_excepts(filename, id_)
+
+        try:
+            return self.dict_[filename][id_]
+        except KeyError:
+            return []
+
+    def stop(self):
+        # Make the rule handlers abort the search as soon as they try to add
+        # an occurrence or an except period
+        self.add_safe = self._stop
+        self.add_many = self._stop
+        self.except_safe = self._stop
+
+    def _stop(self, *args):
+        raise OccurrencesRangeSearchStop()
+
     def get_item_time_span(self, filename, id_):
         # Note that this method ignores self.actd _deliberately_
+        self._apply_item_excepts(filename, id_)
+
         try:
             occs = self.dict_[filename][id_]
         except KeyError:
             return False
         else:
             # The final minstart and maxend should never end up being None
-            minstart = occs[0]['start']
+            minstart = occs[0].start
             # Initialize maxend to minstart, which is surely != None
             maxend = minstart
 
             for occ in occs:
                 # This assumes that start <= end
-                minstart = min((minstart, occ['start']))
-                # occ['end'] could be None
-                maxend = max((occ['start'], occ['end'], maxend))
+                minstart = min((minstart, occ.start))
+                # occ.end could be None
+                maxend = max((occ.start, occ.end, maxend))
 
             return (minstart, maxend)
 
 
+class LimitedOccurrencesRange(OccurrencesRange):
+    # Raise OccurrencesRangeLimit as soon as more occurrences than the limit
+    # are added; the occurrences removed by except rules are still counted,
+    # so the limit may be reached even if the final occurrences would be
+    # fewer
+    def __init__(self, mint, maxt, limit):
+        OccurrencesRange.__init__(self, mint, maxt)
+        self.limit = limit
+        self.count = 0
+
+    def add_safe(self, occ):
+        if OccurrencesRange.add_safe(self, occ):
+            self._count(1)
+            return True
+        else:
+            return False
+
+    def add_many(self, filename, id_, occs):
+        count = OccurrencesRange.add_many(self, filename, id_, occs)
+        self._count(count)
+        return count
+
+    def _count(self, count):
+        self.count += count
+
+        if self.count > self.limit:
+            raise OccurrencesRangeLimit()
+
+
+class OccurrencesRangeCache(object):
+    # The results of the latest range searches, least recently used first,
+    #  so that the identical searches repeated by the interfaces (e.g. when
+    #  paging back and forth, or refreshing after an alarm) are not expanded
+    #  again; the keys include the versions of the searched databases, so the
+    #  outdated results are never found again, and are eventually discarded
+    # The searches can run on several threads at the same time
+    def __init__(self, size):
+        self.size = size
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def make_key(self, mint, maxt, filenames, databases):
+        # The local occurrences also depend on the time zone
+        return (mint, maxt, get_time_zone(), tuple((filename,
+                                            databases[filename].version)
+                                            for filename in filenames))
+
+    def get(self, key):
+        # Return a copy of the stored results, or None
+        with self.lock:
+            try:
+                occs = self.results.pop(key)
+            except KeyError:
+                return None
+            else:
+                self.results[key] = occs
+
+        return occs.copy()
+
+    def put(self, key, occs):
+        if self.size > 0:
+            occs = occs.copy()
+
+            with self.lock:
+                self.results.pop(key, None)
+                self.results[key] = occs
+
+                while len(self.results) > self.size:
+                    self.results.popitem(last=False)
+
+
 class OccurrencesRangeSearchStop(UserWarning):
     # This class is used as an exception, but used internally, so there's no
     # need to store it in the exceptions module
     pass
 
 
+class OccurrencesRangeLimit(UserWarning):
+    # This class is used as an exception, but used internally, so there's no
+    # need to store it in the exceptions module
+    pass
+
+
 class OccurrencesRangeSearch(object):
-    def __init__(self, mint, maxt, filenames, databases, rule_handlers):
+    def __init__(self, mint, maxt, filenames, databases, rules, cache=None,
+                                                        pool=None, limit=None):
         self.mint = mint
         self.maxt = maxt
         self.filenames = filenames
         self.databases = databases
-        self.rule_handlers = rule_handlers
+        self.rules = rules
+        self.cache = cache
+        # The pool of the parallel search processes, or None to always search
+        # serially
+        self.pool = pool
+        # If more occurrences than the limit are found, the search is
+        # abandoned as soon as they are counted, instead of generating all the
+        # others; the items are counted after applying their except rules, so
+        # the limit is exceeded only if the complete results would exceed it
+        self.limit = limit
+        self.count = 0
+        self.limit_exceeded = False
         self.occs = OccurrencesRange(mint, maxt)
         self.utcoffset = timeaux.UTCOffset()
         self.utcmint = mint - self.utcoffset.compute(mint)
         self._search_item = self._search_item_continue
+        self._add_occurrence = self._add_occurrence_continue
+        self._add_item_occurrences = self._add_item_occurrences_continue
+
+        conf = coreaux_api.get_extension_configuration('organism')
+        self.processes = conf.get_int('parallel_search_processes')
+        self.parallel_min_rules = conf.get_int('parallel_search_min_rules')
 
     def start(self):
         search_start = (time_.time(), time_.clock())
 
         try:
-            # Don't use Main.databases because the searched filenames must be
-            #  coherent with the other operations that this class is used in
-            # Note that Main.databases could also change size during the
-            #  search, so it should be copied to iterate in it
+            if self.cache is None:
+                self._search()
+            else:
+                # The key is made before reading the databases, so that the
+                # results of a search that overlaps an update of the rules
+                # can only be stored under an outdated key
+                key = self.cache.make_key(self.mint, self.maxt,
+                                                self.filenames, self.databases)
+                occs = self.cache.get(key)
+
+                if occs is None:
+                    self._search()
+                    self.cache.put(key, self.occs)
+                else:
+                    self.occs = occs
+                    self._count(len(occs.get_list()))
+
+            # The alarms are never cached, since their state changes
+            #  independently of the rules
             for filename in self.filenames:
-                # Don'd iterate directly over the returned cursor, but use a
-                # fetchall, otherwise if the application is closed while the
-                # search is on (e.g. while searching the old alarms) an
-                # exception will be raised, because the database will be closed
-                # while the loop is still reading it
-                rows = self.databases[filename].get_all_valid_item_rules(
-                                                                ).fetchall()
-
-                for row in rows:
-                    id_ = row['R_id']
-                    rules = Database.string_to_rules(row['R_rules'])
-
-                    for rule in rules:
-                        self._search_item(filename, id_, rule)
-
                 # Get active alarms *after* all occurrences, to avoid except
                 # rules
                 get_alarms_event.signal(mint=self.mint, maxt=self.maxt,
@@ -438,26 +1266,225 @@ class OccurrencesRangeSearch(object):
         # All loops must be broken
         except OccurrencesRangeSearchStop:
             pass
+        except OccurrencesRangeLimit:
+            self.limit_exceeded = True
 
         log.debug('Occurrences range found in {} (time) / {} (clock) s'.format(
                                             time_.time() - search_start[0],
                                             time_.clock() - search_start[1]))
 
+        if self.rules.profile:
+            self.rules.log_profile()
+
+    def _search(self):
+        # Don't use Main.databases because the searched filenames must be
+        #  coherent with the other operations that this class is used in
+        # Note that Main.databases could also change size during the
+        #  search, so it should be copied to iterate in it
+        searches = []
+
+        for filename in self.filenames:
+            # get_occurrences_range_rows already returns fetched rows and
+            # the rules come from the decoded cache, so if the application
+            # is closed while the search is on (e.g. while searching the
+            # old alarms) the loops won't be reading a closed database
+            # The materialized occurrences cover only a horizon around the
+            # time the database was opened, outside of it the rules of
+            # the items whose time span overlaps the range are searched
+            # on the fly
+            db = self.databases[filename]
+            materialized = db.get_occurrences_range_rows(self.mint, self.maxt)
+
+            if materialized is None:
+                itemrules = db.iter_valid_item_rules_range(self.mint, self.maxt)
+            else:
+                occrows, ids = materialized
+
+                for row in occrows:
+                    self._add_occurrence(filename, row)
+
+                itemrules = db.iter_valid_item_rules(ids)
+
+            searches.append((filename, list(itemrules)))
+
+        nrules = sum(len(rules) for filename, itemrules in searches
+                                        for id_, rules in itemrules)
+
+        if self.pool is not None and nrules >= self.parallel_min_rules:
+            self._search_parallel(searches)
+        else:
+            self._search_serial(searches)
+
+    def _search_serial(self, searches):
+        for filename, itemrules in searches:
+            for id_, rules in itemrules:
+                for rule in rules:
+                    self._search_item(filename, id_, rule)
+
+                if self.limit is not None:
+                    self._count(len(self.occs.get_item_occurrences(filename,
+                                                                        id_)))
+
+    def _search_parallel(self, searches):
+        # Split the items in a few chunks per process, so that the workload is
+        # balanced even if the items have very different numbers of
+        # occurrences; the rules of an item are never split, so that its
+        # except rules are applied by the worker exactly like in a serial
+        # search
+        tasks = []
+
+        for filename, itemrules in searches:
+            size = len(itemrules) // (self.processes * 8) + 1
+
+            for n in xrange(0, len(itemrules), size):
+                tasks.append((filename, self.mint, self.utcmint, self.maxt,
+                                                    itemrules[n:n + size]))
+
+        # The compiled rules are pickled here, and not by the pool, so that if
+        # some of their handlers cannot be sent to the workers, the search can
+        # still fall back to the serial one
+        try:
+            tasks = [cPickle.dumps(task, cPickle.HIGHEST_PROTOCOL)
+                                                            for task in tasks]
+        except (cPickle.PicklingError, TypeError):
+            log.debug('Rule handlers not picklable, searching serially')
+            self._search_serial(searches)
+            return
+
+        tasks = iter(tasks)
+        pending = collections.deque()
+
+        # Keep only a couple of tasks per process queued, so that if the
+        # search is stopped, or other searches share the pool, only those have
+        # to be waited for; the results of the tasks still pending when the
+        # search is stopped are simply discarded
+        for task in itertools.islice(tasks, self.processes * 2):
+            pending.append(self.pool.apply_async(_search_items_chunk,
+                                                                    (task, )))
+
+        while pending:
+            filename, results = marshal.loads(pending.popleft().get())
+
+            for task in itertools.islice(tasks, 1):
+                pending.append(self.pool.apply_async(_search_items_chunk,
+                                                                    (task, )))
+
+            for id_, occs in results:
+                self._add_item_occurrences(filename, id_, occs)
+
     def stop(self):
         self._search_item = self._search_item_stop
+        self._add_occurrence = self._add_occurrence_stop
+        self._add_item_occurrences = self._add_item_occurrences_stop
+        # Also interrupt the rule handler that is currently running
+        self.occs.stop()
 
     def get_results(self):
         # Note that the list is practically unsorted: sorting its items is a
         # duty of the interface
         return self.occs
 
+    def is_limit_exceeded(self):
+        # If True, the results are incomplete
+        return self.limit_exceeded
+
+    def _count(self, count):
+        self.count += count
+
+        if self.limit is not None and self.count > self.limit:
+            raise OccurrencesRangeLimit()
+
     def _search_item(self, filename, id_, rule):
         # This method is defined dynamically
         pass
 
     def _search_item_continue(self, filename, id_, rule):
-        self.rule_handlers[rule['rule']](self.mint, self.utcmint, self.maxt,
-                            self.utcoffset, filename,  id_, rule, self.occs)
+        rule.search_range(self.mint, self.utcmint, self.maxt, self.utcoffset,
+                                                filename, id_, rule, self.occs)
 
     def _search_item_stop(self, filename, id_, rule):
         raise OccurrencesRangeSearchStop()
+
+    def _add_occurrence(self, filename, row):
+        # This method is defined dynamically
+        pass
+
+    def _add_occurrence_continue(self, filename, row):
+        # The rows are a superset of the occurrences in the range, add_safe
+        # applies the exact same test as the on-the-fly search
+        if self.occs.add_safe(Occurrence(filename, row['O_item'],
+                            row['O_start'], row['O_end'], row['O_alarm'])):
+            self._count(1)
+
+    def _add_occurrence_stop(self, filename, row):
+        raise OccurrencesRangeSearchStop()
+
+    def _add_item_occurrences(self, filename, id_, occs):
+        # This method is defined dynamically
+        pass
+
+    def _add_item_occurrences_continue(self, filename, id_, occs):
+        # The worker has already filtered the occurrences and applied the
+        # item's except rules
+        self._count(self.occs.add_many(filename, id_, [Occurrence(filename,
+                                        id_, start, end, alarm)
+                                        for start, end, alarm in occs]))
+
+    def _add_item_occurrences_stop(self, filename, id_, occs):
+        raise OccurrencesRangeSearchStop()
+
+
+class OccurrencesRangeStream(object):
+    def __init__(self, mint, maxt, filenames, databases, rules, cache=None,
+                                                                    pool=None):
+        # Yield the occurrences sorted by start time, including the ones that
+        # are in the range only because of their end or alarm time
+        # An occurrence that starts before the range can be in it because of
+        # its alarm, which can be anywhere in the range, so the first
+        # occurrence is only known after searching the whole range: the range
+        # is thus searched like OccurrencesRangeSearch, whose results are then
+        # sorted; use the limit of OccurrencesRangeSearch to stop generating
+        # the occurrences after a number of results
+        self.search = OccurrencesRangeSearch(mint, maxt, filenames, databases,
+                                                        rules, cache, pool)
+        self.stopped = False
+
+    def __iter__(self):
+        self.search.start()
+
+        # The search may have been stopped while running
+        if not self.stopped:
+            occs = self.search.get_results().get_list()
+            occs.sort(key=lambda occ: occ.start)
+
+            for occ in occs:
+                if self.stopped:
+                    break
+
+                yield occ
+
+    def stop(self):
+        self.stopped = True
+        self.search.stop()
+
+    def get_results(self):
+        # The results also include the active alarms, which are not yielded
+        return self.search.get_results()
+
+
+def _search_items_chunk(task):
+    # This function is executed by the parallel search worker processes
+    filename, mint, utcmint, maxt, itemrules = cPickle.loads(task)
+    occs = OccurrencesRange(mint, maxt)
+    utcoffset = timeaux.UTCOffset()
+
+    for id_, rules in itemrules:
+        for rule in rules:
+            rule.search_range(mint, utcmint, maxt, utcoffset, filename, id_,
+                                                                rule, occs)
+
+    # Return the occurrences as marshalled tuples, which are much cheaper to
+    # transfer than pickled Occurrence objects
+    return marshal.dumps((filename, [(id_, [(o.start, o.end, o.alarm)
+                        for o in ioccs]) for id_, ioccs in
+                        occs.get_dict().get(filename, {}).iteritems()]))
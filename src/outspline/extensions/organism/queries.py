@@ -16,23 +16,112 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+# R_min and R_max store the time span containing all the occurrences of the
+# item, computed from its rules in the time zone of the materialized
+# occurrences; the open-ended sides are stored as extreme values, so that the
+# span queries can always be served by the index, while NULL means that the
+# item's rules cannot produce occurrences
 rules_create = ("CREATE TABLE Rules (R_id INTEGER PRIMARY KEY, "
-                                    "R_rules TEXT)")
+                                    "R_rules TEXT, "
+                                    "R_min INTEGER, "
+                                    "R_max INTEGER)")
+
+# Serves rules_select_span and rules_select_span_after
+rules_create_index_max = 'CREATE INDEX Rules_max ON Rules (R_max)'
 
 rules_select = 'SELECT * FROM Rules'
 
 rules_select_all = 'SELECT * FROM Rules WHERE R_rules!=?'
 
+rules_select_all_after = ('SELECT R_id, R_rules FROM Rules WHERE R_rules!=? '
+                                        'AND R_id>? ORDER BY R_id LIMIT ?')
+
 rules_select_id = 'SELECT R_rules FROM Rules WHERE R_id=? LIMIT 1'
 
+rules_select_span = ('SELECT R_id, R_rules FROM Rules '
+                                        'WHERE R_max >= ? AND R_min <= ?')
+
+rules_select_span_after = 'SELECT R_id, R_rules FROM Rules WHERE R_max >= ?'
+
 rules_insert = 'INSERT INTO Rules (R_id, R_rules) VALUES (?, ?)'
 
 rules_update_id = 'UPDATE Rules SET R_rules=? WHERE R_id=?'
 
+rules_update_id_span = 'UPDATE Rules SET R_min=?, R_max=? WHERE R_id=?'
+
 rules_delete_id = 'DELETE FROM Rules WHERE R_id=?'
 
 rules_drop = 'DROP TABLE Rules'
 
+# Occurrences materializes the occurrences of the items with rules within the
+# OP_min-OP_max horizon; items whose rules produce too many occurrences are
+# stored as a single row with O_start set to NULL, and are searched on the fly
+occurrences_create = ("CREATE TABLE Occurrences (O_id INTEGER PRIMARY KEY, "
+                                                "O_item INTEGER, "
+                                                "O_start INTEGER, "
+                                                "O_end INTEGER, "
+                                                "O_alarm INTEGER)")
+
+# Serves occurrences_delete_item
+occurrences_create_index_item = ('CREATE INDEX Occurrences_item '
+                                                    'ON Occurrences (O_item)')
+
+# Serves occurrences_select_range and occurrences_select_unbounded
+occurrences_create_index_start = ('CREATE INDEX Occurrences_start '
+                                                    'ON Occurrences (O_start)')
+
+# Serves occurrences_select_range
+occurrences_create_index_alarm = ('CREATE INDEX Occurrences_alarm '
+                                                    'ON Occurrences (O_alarm)')
+
+# The second term selects the occurrences that started before the range and
+# are still ongoing at its start, and its lower bound is the start of the
+# range minus the longest stored occurrence, so that all the terms can be
+# served by an index
+occurrences_select_range = ('SELECT O_item, O_start, O_end, O_alarm '
+                    'FROM Occurrences WHERE O_start BETWEEN ? AND ? '
+                    'OR (O_start BETWEEN ? AND ? AND O_end > ?) '
+                    'OR O_alarm BETWEEN ? AND ?')
+
+occurrences_select_unbounded = ('SELECT O_item FROM Occurrences '
+                                                    'WHERE O_start IS NULL')
+
+occurrences_insert = ('INSERT INTO Occurrences (O_id, O_item, O_start, O_end, '
+                                        'O_alarm) VALUES (NULL, ?, ?, ?, ?)')
+
+occurrences_delete = 'DELETE FROM Occurrences'
+
+occurrences_delete_item = 'DELETE FROM Occurrences WHERE O_item=?'
+
+occurrences_drop = 'DROP TABLE Occurrences'
+
+occurrencesproperties_create = ('CREATE TABLE OccurrencesProperties '
+                                        '(OP_id INTEGER PRIMARY KEY, '
+                                         'OP_min INTEGER, '
+                                         'OP_max INTEGER, '
+                                         'OP_max_duration INTEGER, '
+                                         'OP_time_zone TEXT)')
+
+occurrencesproperties_select = ('SELECT * FROM OccurrencesProperties '
+                                                                    'LIMIT 1')
+
+# A NULL horizon makes organism generate the occurrences when the database is
+# opened; the horizon is also NULL while its occurrences are being generated
+occurrencesproperties_insert_init = ('INSERT INTO OccurrencesProperties '
+                        '(OP_id, OP_min, OP_max, OP_max_duration, '
+                        'OP_time_zone) VALUES (NULL, NULL, NULL, 0, NULL)')
+
+occurrencesproperties_update = ('UPDATE OccurrencesProperties SET OP_min=?, '
+                            'OP_max=?, OP_max_duration=?, OP_time_zone=?')
+
+occurrencesproperties_update_horizon = ('UPDATE OccurrencesProperties '
+                                                'SET OP_min=?, OP_max=?')
+
+occurrencesproperties_update_max_duration = ('UPDATE OccurrencesProperties '
+                                                    'SET OP_max_duration=?')
+
+occurrencesproperties_drop = 'DROP TABLE OccurrencesProperties'
+
 copyrules_create = ("CREATE TABLE CopyRules (CR_id INTEGER, "
                                             "CR_rules TEXT)")
 
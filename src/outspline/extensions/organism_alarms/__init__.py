@@ -153,10 +153,12 @@ class Main(object):
 
     def _handle_history_remove(self, kwargs):
         try:
-            self.databases[kwargs['filename']].delete_alarms(kwargs['id_'],
-                                                                kwargs['text'])
+            database = self.databases[kwargs['filename']]
         except KeyError:
             pass
+        else:
+            for item in kwargs['items']:
+                database.delete_alarms(item['id_'], item['text'])
 
     def _handle_history_clean(self, kwargs):
         filename = kwargs['filename']
@@ -185,8 +187,9 @@ class Main(object):
     def _handle_activate_occurrences_range(self, kwargs):
         try:
             self.databases[kwargs['filename']].activate_alarms_range(
-                                        kwargs['mint'], kwargs['maxt'],
-                                        kwargs['occsd'], self.OLD_THRESHOLD)
+                                        kwargs['count'], kwargs['lastoccsd'],
+                                        kwargs['iter_occsd'],
+                                        self.OLD_THRESHOLD)
         except KeyError:
             # Due to race conditions, filename could have been closed meanwhile
             # (e.g. if the modal dialog for closing the database was open in
@@ -21,6 +21,7 @@ import threading
 from outspline.coreaux_api import Event
 import outspline.coreaux_api as coreaux_api
 import outspline.core_api as core_api
+import outspline.extensions.organism_api as organism_api
 import outspline.extensions.organism_timer_api as organism_timer_api
 
 import queries
@@ -80,12 +81,8 @@ class Database(object):
             occs.try_delete_one(self.filename, itemid, start, end,
                                                                 row['A_alarm'])
 
-            alarmd = {'filename': self.filename,
-                      'id_': itemid,
-                      'alarmid': row['A_id'],
-                      'start': start,
-                      'end': end,
-                      'alarm': snooze}
+            alarmd = organism_api.Occurrence(self.filename, itemid, start, end,
+                                                        snooze, row['A_id'])
 
             # For safety, also check that there aren't any alarms with
             # snooze <= last_search left (for example this may happen if an
@@ -100,41 +97,32 @@ class Database(object):
             else:
                 occs.add_old(alarmd)
 
-    def activate_alarms_range(self, mint, maxt, occsd, threshold):
+    def activate_alarms_range(self, count, lastoccsd, iter_occsd,
+                                                                threshold):
         # Note that as long as this function remains on the same thread as
         # organism_timer's OldOccurrencesSearch search thread, it's under the
         # protection of its _handle_save_permission_check method
+        # count is the number of the old alarms to be activated, and
+        # lastoccsd holds only the most recent of them for each item; all of
+        # them are yielded by iter_occsd window by window, as they were found
+        # by the search, releasing the databases in between
         activate_alarms_range_event.signal(filename=self.filename)
 
-        count = 0
-
-        for id_ in occsd.keys():
-            for occ in occsd[id_][:]:
-                # occ may have alarm == mint, or start or end in the
-                #  interval, but none of those occurrences must be activated
-                # In particular, the alarm == mint case should have already
-                #  been activated the previous time Outspline was run
-                if mint < occ['alarm'] <= maxt:
-                    count += 1
-                else:
-                    # Do not use 'del' with an index taken by enumerating on
-                    # occsd[id_][:], because after deleting one item all the
-                    # indices wouldn't correspond anymore
-                    occsd[id_].remove(occ)
-
         if count > threshold and \
                         self.choose_unique_old_alarms is not None:
             self.choose_unique_old_alarms(self.filename, count)
             self.old_alarms_lock.acquire()
 
             if self.old_alarms_unique is True:
-                self._activate_alarms_unique(occsd)
+                self._activate_alarms_unique(lastoccsd)
             elif self.old_alarms_unique is False:
-                self._activate_alarms_all(occsd)
+                for occsd in iter_occsd():
+                    self._activate_alarms_all(occsd)
             # self.old_alarms_unique could be None, and in that case it means
             # that the alarms must not be activated
         else:
-            self._activate_alarms_all(occsd)
+            for occsd in iter_occsd():
+                self._activate_alarms_all(occsd)
 
         activate_alarms_range_end_event.signal(filename=self.filename)
 
@@ -162,10 +150,9 @@ class Database(object):
             # interface)
             if core_api.is_item(self.filename, id_):
                 try:
-                    occ = max(occsd[id_], key=lambda occ: occ['alarm'])
+                    occ = max(occsd[id_], key=lambda occ: occ.alarm)
                 except ValueError:
-                    # occsd[id_] may be have been emptied in
-                    # self.activate_alarms_range
+                    # occsd[id_] may be empty
                     pass
                 else:
                     self._activate_alarm(occ)
@@ -178,7 +165,7 @@ class Database(object):
             if core_api.is_item(self.filename, id_):
                 for occ in occsd[id_]:
                     # occ may have start or end == time
-                    if occ['alarm'] == time:
+                    if occ.alarm == time:
                         self._activate_alarm(occ)
 
     def _activate_alarm(self, alarm):
@@ -186,31 +173,31 @@ class Database(object):
         # the're not run on the main thread), the database may be closed
         # meanwhile; however this function seems to terminate safely without
         # the need of further tests here
-        if 'alarmid' not in alarm:
-            alarmid = self._insert_alarm(id_=alarm['id_'],
-                                   start=alarm['start'],
-                                   end=alarm['end'],
-                                   origalarm=alarm['alarm'],
+        if alarm.alarmid is None:
+            alarmid = self._insert_alarm(id_=alarm.id_,
+                                   start=alarm.start,
+                                   end=alarm.end,
+                                   origalarm=alarm.alarm,
                                    # Note that here passing None is correct (do
                                    # not pass False)
                                    snooze=None)
         else:
-            alarmid = alarm['alarmid']
+            alarmid = alarm.alarmid
             # Occurrence dictionaries store active alarms with False, not None
-            if alarm['alarm']:
-                filename = alarm['filename']
+            if alarm.alarm:
+                filename = alarm.filename
                 qconn = core_api.get_connection(filename)
                 cursor = qconn.cursor()
                 # Note that here using None is correct (do not use False)
                 cursor.execute(queries.alarms_update_id, (None, alarmid))
                 core_api.give_connection(filename, qconn)
 
-        alarm_event.signal(filename=alarm['filename'],
-                           id_=alarm['id_'],
+        alarm_event.signal(filename=alarm.filename,
+                           id_=alarm.id_,
                            alarmid=alarmid,
-                           start=alarm['start'],
-                           end=alarm['end'],
-                           alarm=alarm['alarm'])
+                           start=alarm.start,
+                           end=alarm.end,
+                           alarm=alarm.alarm)
 
     def get_alarms(self, mint, maxt, occs):
         conn = core_api.get_connection(self.filename)
@@ -227,12 +214,9 @@ class Database(object):
             # generic boolean tests
             snooze = False if row['A_snooze'] is None else row['A_snooze']
 
-            alarmd = {'filename': self.filename,
-                      'id_': row['A_item'],
-                      'alarmid': row['A_id'],
-                      'start': row['A_start'],
-                      'end': row['A_end'],
-                      'alarm': snooze}
+            alarmd = organism_api.Occurrence(self.filename, row['A_item'],
+                                        row['A_start'], row['A_end'], snooze,
+                                        row['A_id'])
 
             # If the alarm is not added to occs, add it to the active
             # dictionary if it's active (but not snoozed)
@@ -37,6 +37,9 @@ alarms_create = ("CREATE TABLE Alarms (A_id INTEGER PRIMARY KEY, "
                                       "A_alarm INTEGER, "
                                       "A_snooze INTEGER)")
 
+# Serves alarms_select_item and alarms_delete_item
+alarms_create_index_item = 'CREATE INDEX Alarms_item ON Alarms (A_item)'
+
 alarms_select = 'SELECT * FROM Alarms'
 
 alarms_select_item = ('SELECT A_id, A_start, A_end, A_alarm, A_snooze '
@@ -20,11 +20,36 @@ import outspline.core_api as core_api
 
 from organism import extension, items, database_open_event
 
+# The rule handlers must add instances of this class to the occurrence
+#  containers
+Occurrence = items.Occurrence
+
 
 def install_rule_handler(rulename, handler):
     return extension.rules.install_rule_handler(rulename, handler)
 
 
+def install_next_rule_handler(rulename, handler):
+    # This is used by organism_timer to bind its own rule handlers to the
+    #  compiled rules; use organism_timer_api.install_rule_handler instead
+    return extension.rules.install_next_rule_handler(rulename, handler)
+
+
+def install_rule_compiler(rulename, compiler):
+    # The compiler is called once for every rule when it is loaded or updated,
+    # and returns the constants that the rule's handlers find in rule.params
+    return extension.rules.install_rule_compiler(rulename, compiler)
+
+
+def install_rule_span_handler(rulename, handler):
+    # The handler receives a UTCOffset object and the rule, and returns the
+    #  earliest and latest times (start, end or alarm) of the rule's
+    #  occurrences, with None for an open-ended side, or None if the rule
+    #  cannot produce occurrences; the rules without a span handler are
+    #  always searched
+    return extension.rules.install_rule_span_handler(rulename, handler)
+
+
 def update_item_rules(filename, id_, rules, group,
                                             description='Update item rules'):
     # All rules must be able to produce only occurrences compliant with the
@@ -56,13 +81,46 @@ def get_all_valid_item_rules(filename):
     return extension.databases[filename].get_all_valid_item_rules()
 
 
+def iter_all_valid_item_rules(filename):
+    # The rules lists are cached, so they must not be modified
+    return extension.databases[filename].iter_all_valid_item_rules()
+
+
+def iter_valid_item_rules(filename, ids):
+    # The rules lists are cached, so they must not be modified
+    return extension.databases[filename].iter_valid_item_rules(ids)
+
+
+def iter_valid_item_rules_range(filename, mint, maxt):
+    # Only the items whose rules' time span overlaps the range are returned,
+    #  maxt can be None for a range without an end; the rules lists are
+    #  cached, so they must not be modified
+    return extension.databases[filename].iter_valid_item_rules_range(mint,
+                                                                        maxt)
+
+
 def get_all_item_rules(filename):
     return extension.databases[filename].get_all_item_rules()
 
 
-def get_occurrences_range(mint, maxt, filenames):
+def get_occurrences_range(mint, maxt, filenames, limit=None):
+    # The results of the latest searches are cached until the rules of the
+    # searched databases change; the alarms are always searched again
+    # If limit is not None, the search is abandoned as soon as it finds more
+    # occurrences than the limit, see the is_limit_exceeded method
     return items.OccurrencesRangeSearch(mint, maxt, filenames,
-                                extension.databases, extension.rules.handlers)
+                                extension.databases, extension.rules,
+                                extension.range_cache, extension.search_pool,
+                                limit)
+
+
+def iter_occurrences_range(mint, maxt, filenames):
+    # The returned object yields the occurrences sorted by start time, and its
+    # stop method cancels the search; the search is cached like the ones of
+    # get_occurrences_range
+    return items.OccurrencesRangeStream(mint, maxt, filenames,
+                                extension.databases, extension.rules,
+                                extension.range_cache, extension.search_pool)
 
 
 def convert_string_to_rules(string):
@@ -81,6 +139,10 @@ def bind_to_history_update(handler, bind=True):
     return items.history_update_event.bind(handler, bind)
 
 
+def bind_to_history_delete(handler, bind=True):
+    return items.history_delete_event.bind(handler, bind)
+
+
 def bind_to_update_item_rules_conditional(handler, bind=True):
     return items.update_item_rules_conditional_event.bind(handler, bind)
 
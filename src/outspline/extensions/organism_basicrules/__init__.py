@@ -123,6 +123,45 @@ def install_occurrence_range_handlers():
         organism_api.install_rule_handler(rulename, handler)
 
 
+def install_time_span_handlers():
+    # The other rules can occur indefinitely far in the past and in the future
+    for rulename, handler in (
+                (occur_once._RULE_NAMES['local'],
+                    occur_once.get_time_span_local),
+                (occur_once._RULE_NAMES['UTC'],
+                    occur_once.get_time_span_UTC),
+                (except_once._RULE_NAMES['local'], except_once.get_time_span),
+                (except_once._RULE_NAMES['UTC'], except_once.get_time_span),
+                (except_regularly._RULE_NAMES['local'],
+                    except_regularly.get_time_span),
+                (except_regularly._RULE_NAMES['UTC'],
+                    except_regularly.get_time_span),
+            ):
+        organism_api.install_rule_span_handler(rulename, handler)
+
+
+def compile_rule(rule):
+    # The handlers of the rules without their own compiler find the rule's
+    # parameters in rule.params, without the interface configuration, which is
+    # always the last one
+    return tuple(rule['#'][:-1])
+
+
+def install_rule_compilers():
+    for module in (occur_once, occur_regularly, occur_regularly_group,
+                        occur_monthly_number_direct,
+                        occur_monthly_number_inverse,
+                        occur_monthly_weekday_direct,
+                        occur_monthly_weekday_inverse, occur_yearly,
+                        except_once, except_regularly):
+        compiler = getattr(module, 'compile_rule', compile_rule)
+
+        for rulename in module._RULE_NAMES.itervalues():
+            organism_api.install_rule_compiler(rulename, compiler)
+
+
 def main():
+    install_rule_compilers()
     install_occurrence_range_handlers()
     install_next_occurrence_handlers()
+    install_time_span_handlers()
@@ -43,9 +43,7 @@ def make_rule(start, end, inclusive, standard, guiconfig):
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    start = rule['#'][0]
-    end = rule['#'][1]
-    inclusive = rule['#'][2]
+    start, end, inclusive = rule.params
 
     offset = utcoffset.compute(start)
 
@@ -62,19 +60,20 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    start = rule['#'][0]
-    end = rule['#'][1]
-    inclusive = rule['#'][2]
+    start, end, inclusive = rule.params
 
     # The rule is checked in make_rule, no need to use occs.except_
     occs.except_safe(filename, id_, start, end, inclusive)
 
 
+def get_time_span(utcoffset, rule):
+    # Except rules cannot produce occurrences
+    return None
+
+
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    start = rule['#'][0]
-    end = rule['#'][1]
-    inclusive = rule['#'][2]
+    start, end, inclusive = rule.params
 
     offset = utcoffset.compute(start)
 
@@ -91,9 +90,7 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    start = rule['#'][0]
-    end = rule['#'][1]
-    inclusive = rule['#'][2]
+    start, end, inclusive = rule.params
 
     # The rule is checked in make_rule, no need to use occs.except_
     occs.except_safe(filename, id_, start, end, inclusive)
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+import time as _time
+
 import occur_regularly
 from exceptions import BadRuleError
 
@@ -164,79 +166,67 @@ CGOS
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    limits = occs.get_item_time_span(filename, id_)
-
-    if limits:
-        minstart, maxend = limits
-
-        interval = rule['#'][1]
-        rend = rule['#'][4]
-        inclusive = rule['#'][5]
+    occurrences = occs.get_item_occurrences(filename, id_)
 
-        # start can't be based on mint, in fact an except rule can affect an
-        #  occurrence even if its start and end times are out of the time range
-        # Subtract utcoffset.compute(minstart) because in Western (negative)
-        #  time zones (e.g. Pacific/Honolulu), the first occurrence to be found
-        #  would otherwise be already too late; in Eastern (positive) time
-        #  zones the problem would pass unnoticed because the first occurrence
-        #  would be found too early, and simply several cycles would not
-        #  produce occurrences in the search range
-        start = occur_regularly.compute_min_time(minstart - utcoffset.compute(
-                minstart), rule['#'][0], interval, rule['#'][2], rule['#'][3])
+    if occurrences:
+        refstart, interval, overlaps, bgap, rend, inclusive = rule.params
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for example when retrieving the old alarms, and such a
-        # search couldn't be aborted, since the aborting happens there, not in
-        # this loop (bug #329)
-        while True:
-            # Every timestamp can have a different UTC offset, depending
-            # whether it's in a DST period or not
-            offset = utcoffset.compute(start)
-
-            sstart = start + offset
-            send = sstart + rend
-
-            # Do compare sstart with maxend, *not* start
-            if sstart > maxend:
-                break
-            # Do compare send with minstart, *not* end
-            elif send >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, sstart, send, inclusive)
-
-            start += interval
+        # Every timestamp can have a different UTC offset, depending whether
+        # it's in a DST period or not, so also test the periods that would
+        # affect the occurrences with any of the offsets of the time zone
+        for start in _iter_except_starts(occurrences, refstart, interval,
+                                    rend, inclusive,
+                                    min(_time.timezone, _time.altzone),
+                                    max(_time.timezone, _time.altzone)):
+            sstart = start + utcoffset.compute(start)
+            # The rule is checked in make_rule, no need to use occs.except_
+            occs.except_safe(filename, id_, sstart, sstart + rend, inclusive)
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    limits = occs.get_item_time_span(filename, id_)
-
-    if limits:
-        minstart, maxend = limits
-
-        interval = rule['#'][1]
-        rend = rule['#'][4]
-        inclusive = rule['#'][5]
-
-        # start can't be based on mint, in fact an except rule can affect an
-        # occurrence even if its start and end times are out of the time range
-        start = occur_regularly.compute_min_time(minstart, rule['#'][0],
-                                        interval, rule['#'][2], rule['#'][3])
+    occurrences = occs.get_item_occurrences(filename, id_)
+
+    if occurrences:
+        refstart, interval, overlaps, bgap, rend, inclusive = rule.params
+
+        for start in _iter_except_starts(occurrences, refstart, interval,
+                                                    rend, inclusive, 0, 0):
+            # The rule is checked in make_rule, no need to use occs.except_
+            occs.except_safe(filename, id_, start, start + rend, inclusive)
+
+
+def _iter_except_starts(occurrences, refstart, interval, rend, inclusive,
+                                                        minoffset, maxoffset):
+    # An except rule can affect an occurrence even if its start and end times
+    # are out of the time range, but stepping through all the periods between
+    # the item's first and last occurrences can take a very long time (bug
+    # #329), e.g. when retrieving the old alarms; instead, only yield the
+    # start times of the periods that can affect at least one occurrence,
+    # i.e. that start between rend before the occurrence's start and the
+    # occurrence's start, or its end if the rule is inclusive
+    spans = sorted((occ.start - rend - maxoffset, (occ.end if inclusive and
+                        occ.end else occ.start) - minoffset)
+                        for occ in occurrences)
+    # The spans can overlap, so remember the first start time not yet yielded
+    nextstart = None
+
+    for low, high in spans:
+        start = low + (refstart - low) % interval
+
+        if nextstart is not None and nextstart > start:
+            start = nextstart
+
+        while start <= high:
+            yield start
+            start += interval
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for example when retrieving the old alarms, and such a
-        # search couldn't be aborted, since the aborting happens there, not in
-        # this loop (bug #329)
-        while True:
-            end = start + rend
+        nextstart = start
 
-            if start > maxend:
-                break
-            elif end >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, start, end, inclusive)
 
-            start += interval
+def get_time_span(utcoffset, rule):
+    # Except rules cannot produce occurrences
+    return None
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
@@ -246,9 +236,7 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
     if limits:
         minstart, maxend = limits
 
-        interval = rule['#'][1]
-        rend = rule['#'][4]
-        inclusive = rule['#'][5]
+        refstart, interval, overlaps, bgap, rend, inclusive = rule.params
 
         # start can't be based on base_time, in fact an except rule can affect
         #  an occurrence even if its start and end times are out of the time
@@ -260,7 +248,12 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
         #  would be found too early, and simply several cycles would not
         #  produce occurrences in the search range
         start = occur_regularly.compute_min_time(minstart - utcoffset.compute(
-                minstart), rule['#'][0], interval, rule['#'][2], rule['#'][3])
+                            minstart), refstart, interval, overlaps, bgap)
+
+        # compute_min_time considers the end times exclusive, while except
+        #  periods also include their end time, so also test the previous
+        #  period, which may end exactly at minstart
+        start -= interval
 
         # Because of the start time note above, this loop will take a long time
         # to complete for wide search ranges and short intervals (bug #329)
@@ -294,15 +287,18 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
     if limits:
         minstart, maxend = limits
 
-        interval = rule['#'][1]
-        rend = rule['#'][4]
-        inclusive = rule['#'][5]
+        refstart, interval, overlaps, bgap, rend, inclusive = rule.params
 
         # start can't be based on base_time, in fact an except rule can affect
         # an occurrence even if its start and end times are out of the time
         # range
-        start = occur_regularly.compute_min_time(minstart, rule['#'][0],
-                                        interval, rule['#'][2], rule['#'][3])
+        start = occur_regularly.compute_min_time(minstart, refstart,
+                                                interval, overlaps, bgap)
+
+        # compute_min_time considers the end times exclusive, while except
+        # periods also include their end time, so also test the previous
+        # period, which may end exactly at minstart
+        start -= interval
 
         # Because of the start time note above, this loop will take a long time
         # to complete for wide search ranges and short intervals (bug #329)
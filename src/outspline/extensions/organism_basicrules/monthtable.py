@@ -0,0 +1,116 @@
+# Outspline - A highly modular and extensible outliner.
+# Copyright (C) 2011 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of Outspline.
+#
+# Outspline is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Outspline is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
+
+import time as _time
+import calendar as _calendar
+
+
+class MonthTable(object):
+    # The monthly and yearly rules look up the same few months over and over,
+    #  for every rule and every search, so the months are tabulated once and
+    #  shared by all of them
+    # Every month stores its first weekday, its number of days and the
+    #  timestamps of the local midnights of its days, including the first day
+    #  of the following month; the midnights are computed only when needed
+    # The table is bounded by keeping the months in two generations: when the
+    #  recent generation is full, it replaces the old one, and the months that
+    #  are used again are promoted back from the old generation; this
+    #  discards the least recently used months without needing a lock, which
+    #  wouldn't be safe with the parallel searches forking the process, since
+    #  the rule handlers run on several threads
+    GENERATION_MONTHS = 600
+
+    def __init__(self):
+        self.recent = {}
+        self.old = {}
+        self.zone = None
+
+    def monthrange(self, year, month):
+        # Return the weekday of the first day of the month and the number of
+        #  days in the month, like calendar.monthrange
+        entry = self._get_month(year, month)
+        return (entry[0], entry[1])
+
+    def local_time(self, year, month, day, hour, minute):
+        # Return the timestamp of the given local time, like time.mktime, or
+        #  None if the day does not exist in the month
+        entry = self._get_month(year, month)
+
+        if not 0 < day <= entry[1]:
+            return None
+
+        midnights = entry[2]
+        midnight = midnights[day - 1]
+
+        if midnight is None:
+            midnight = midnights[day - 1] = self._mktime(year, month, day, 0,
+                                                                            0)
+
+        next_midnight = midnights[day]
+
+        if next_midnight is None:
+            # Day 'ndays + 1' is normalized by mktime to the first day of the
+            #  following month
+            next_midnight = midnights[day] = self._mktime(year, month,
+                                                                day + 1, 0, 0)
+
+        # The days with a UTC offset change do not last 24 hours, and in that
+        #  case the time must be computed explicitly
+        if next_midnight - midnight == 86400:
+            return midnight + hour * 3600 + minute * 60
+        else:
+            return self._mktime(year, month, day, hour, minute)
+
+    @staticmethod
+    def _mktime(year, month, day, hour, minute):
+        # Like converting a naive datetime, let mktime find out whether DST is
+        #  in effect
+        return int(_time.mktime((year, month, day, hour, minute, 0, 0, 0,
+                                                                        -1)))
+
+    def _get_month(self, year, month):
+        zone = (_time.timezone, _time.altzone, _time.tzname)
+
+        if zone != self.zone:
+            self.recent = {}
+            self.old = {}
+            self.zone = zone
+
+        key = (year, month)
+
+        try:
+            return self.recent[key]
+        except KeyError:
+            try:
+                entry = self.old[key]
+            except KeyError:
+                first_weekday, ndays = _calendar.monthrange(year, month)
+                entry = (first_weekday, ndays, [None] * (ndays + 1))
+
+            if len(self.recent) >= self.GENERATION_MONTHS:
+                self.old = self.recent
+                self.recent = {}
+
+            self.recent[key] = entry
+
+            return entry
+
+
+_table = MonthTable()
+monthrange = _table.monthrange
+local_time = _table.local_time
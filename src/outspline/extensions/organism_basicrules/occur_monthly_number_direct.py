@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
-import time as _time
 import datetime as _datetime
 
+from outspline.extensions.organism_api import Occurrence
+
 from exceptions import BadRuleError
+import monthtable
 
 _RULE_NAMES = {'local': 'occur_monthly_number_direct_local',
                'UTC': 'occur_monthly_number_direct_UTC'}
@@ -109,15 +111,11 @@ def make_rule(months, day, hour, minute, rend, ralarm, standard, guiconfig):
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
+    maxoverlap, months, startd, startH, startM, rend, ralarm = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = mint - rule['#'][0]
-    months = rule['#'][1]
-    startd = rule['#'][2]
-    startH = rule['#'][3]
-    startM = rule['#'][4]
-    rend = rule['#'][5]
-    ralarm = rule['#'][6]
+    mintime = mint - maxoverlap
 
     date = _datetime.datetime.fromtimestamp(mintime)
 
@@ -130,9 +128,9 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
         year = date.year
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, startd, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, startd, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.date.fromtimestamp(maxt)
             testdate = _datetime.date(year, month, 1)
@@ -140,8 +138,6 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -156,11 +152,7 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': start,
-                           'end': end,
-                           'alarm': alarm})
+            occs.add_safe(Occurrence(filename, id_, start, end, alarm))
 
         try:
             month = months[month]
@@ -171,15 +163,11 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
+    maxoverlap, months, startd, startH, startM, rend, ralarm = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = mint - rule['#'][0]
-    months = rule['#'][1]
-    startd = rule['#'][2]
-    startH = rule['#'][3]
-    startM = rule['#'][4]
-    rend = rule['#'][5]
-    ralarm = rule['#'][6]
+    mintime = mint - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -194,9 +182,9 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
         year = date.year
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, startd, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, startd, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.date.fromtimestamp(maxt)
             testdate = _datetime.date(year, month, 1)
@@ -204,8 +192,6 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -227,11 +213,7 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': sstart,
-                           'end': send,
-                           'alarm': salarm})
+            occs.add_safe(Occurrence(filename, id_, sstart, send, salarm))
 
         try:
             month = months[month]
@@ -242,15 +224,11 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
+    maxoverlap, months, startd, startH, startM, rend, ralarm = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = base_time - rule['#'][0]
-    months = rule['#'][1]
-    startd = rule['#'][2]
-    startH = rule['#'][3]
-    startM = rule['#'][4]
-    rend = rule['#'][5]
-    ralarm = rule['#'][6]
+    mintime = base_time - maxoverlap
 
     date = _datetime.datetime.fromtimestamp(mintime)
 
@@ -263,9 +241,9 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
         year = date.year
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, startd, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, startd, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -282,8 +260,6 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -294,18 +270,17 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 alarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': start,
-                    'end': end,
-                    'alarm': alarm}
+            occd = Occurrence(filename, id_, start, end, alarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
-            if occs.add_safe(base_time, occd) or (next_occ and
-                                        start > next_occ and
-                                        (alarm is None or alarm > next_occ)):
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
+            if next_occ and start > next_occ and (alarm is None or
+                                                             alarm > next_occ):
                 break
 
         try:
@@ -317,15 +292,11 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
+    maxoverlap, months, startd, startH, startM, rend, ralarm = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = base_time - rule['#'][0]
-    months = rule['#'][1]
-    startd = rule['#'][2]
-    startH = rule['#'][3]
-    startM = rule['#'][4]
-    rend = rule['#'][5]
-    ralarm = rule['#'][6]
+    mintime = base_time - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -340,9 +311,9 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
         year = date.year
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, startd, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, startd, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -359,8 +330,6 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -377,19 +346,18 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 salarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': sstart,
-                    'end': send,
-                    'alarm': salarm}
+            occd = Occurrence(filename, id_, sstart, send, salarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
             # Do compare sstart and salarm with next_occ, *not* start and alarm
-            if occs.add_safe(base_time, occd) or (next_occ and
-                            sstart > next_occ and
-                            (salarm is None or salarm > next_occ)):
+            if next_occ and sstart > next_occ and (salarm is None or
+                                                            salarm > next_occ):
                 break
 
         try:
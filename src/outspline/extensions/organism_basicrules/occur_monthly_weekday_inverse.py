@@ -16,11 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
-import time as _time
 import datetime as _datetime
-import calendar
+
+from outspline.extensions.organism_api import Occurrence
 
 from exceptions import BadRuleError
+import monthtable
 
 _RULE_NAMES = {'local': 'occur_monthly_weekday_inverse_local',
                'UTC': 'occur_monthly_weekday_inverse_UTC'}
@@ -104,16 +105,12 @@ def make_rule(months, weekday, number, hour, minute, rend, ralarm, standard,
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    months = rule['#'][0]
-    weekday = rule['#'][1]
-    number = rule['#'][2]
+    (months, weekday, number, maxoverlap, startH, startM, rend,
+                                                        ralarm) = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = mint - rule['#'][3]
-    startH = rule['#'][4]
-    startM = rule['#'][5]
-    rend = rule['#'][6]
-    ralarm = rule['#'][7]
+    mintime = mint - maxoverlap
 
     date = _datetime.datetime.fromtimestamp(mintime)
 
@@ -126,17 +123,17 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
         year = date.year
 
     while True:
-        first_month_weekday, last_month_day_number = calendar.monthrange(year,
-                                                                        month)
+        first_month_weekday, last_month_day_number = monthtable.monthrange(
+                                                                year, month)
         last_month_weekday = (first_month_weekday + last_month_day_number % 7 +
                                                                         6) % 7
         selected_day_number = last_month_day_number - (last_month_weekday -
                                                 weekday + 7) % 7 - number * 7
 
-        try:
-            sdate = _datetime.datetime(year, month, selected_day_number,
+        start = monthtable.local_time(year, month, selected_day_number,
                                                                 startH, startM)
-        except ValueError:
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.date.fromtimestamp(maxt)
             testdate = _datetime.date(year, month, 1)
@@ -144,8 +141,6 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -160,11 +155,7 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': start,
-                           'end': end,
-                           'alarm': alarm})
+            occs.add_safe(Occurrence(filename, id_, start, end, alarm))
 
         try:
             month = months[month]
@@ -175,16 +166,12 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    months = rule['#'][0]
-    weekday = rule['#'][1]
-    number = rule['#'][2]
+    (months, weekday, number, maxoverlap, startH, startM, rend,
+                                                        ralarm) = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = mint - rule['#'][3]
-    startH = rule['#'][4]
-    startM = rule['#'][5]
-    rend = rule['#'][6]
-    ralarm = rule['#'][7]
+    mintime = mint - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -199,17 +186,17 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
         year = date.year
 
     while True:
-        first_month_weekday, last_month_day_number = calendar.monthrange(year,
-                                                                        month)
+        first_month_weekday, last_month_day_number = monthtable.monthrange(
+                                                                year, month)
         last_month_weekday = (first_month_weekday + last_month_day_number % 7 +
                                                                         6) % 7
         selected_day_number = last_month_day_number - (last_month_weekday -
                                                 weekday + 7) % 7 - number * 7
 
-        try:
-            sdate = _datetime.datetime(year, month, selected_day_number,
+        start = monthtable.local_time(year, month, selected_day_number,
                                                                 startH, startM)
-        except ValueError:
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.date.fromtimestamp(maxt)
             testdate = _datetime.date(year, month, 1)
@@ -217,8 +204,6 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -240,11 +225,7 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': sstart,
-                           'end': send,
-                           'alarm': salarm})
+            occs.add_safe(Occurrence(filename, id_, sstart, send, salarm))
 
         try:
             month = months[month]
@@ -255,16 +236,12 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    months = rule['#'][0]
-    weekday = rule['#'][1]
-    number = rule['#'][2]
+    (months, weekday, number, maxoverlap, startH, startM, rend,
+                                                        ralarm) = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = base_time - rule['#'][3]
-    startH = rule['#'][4]
-    startM = rule['#'][5]
-    rend = rule['#'][6]
-    ralarm = rule['#'][7]
+    mintime = base_time - maxoverlap
 
     date = _datetime.datetime.fromtimestamp(mintime)
 
@@ -277,17 +254,17 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
         year = date.year
 
     while True:
-        first_month_weekday, last_month_day_number = calendar.monthrange(year,
-                                                                        month)
+        first_month_weekday, last_month_day_number = monthtable.monthrange(
+                                                                year, month)
         last_month_weekday = (first_month_weekday + last_month_day_number % 7 +
                                                                         6) % 7
         selected_day_number = last_month_day_number - (last_month_weekday -
                                                 weekday + 7) % 7 - number * 7
 
-        try:
-            sdate = _datetime.datetime(year, month, selected_day_number,
+        start = monthtable.local_time(year, month, selected_day_number,
                                                                 startH, startM)
-        except ValueError:
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -304,8 +281,6 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -316,18 +291,17 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 alarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': start,
-                    'end': end,
-                    'alarm': alarm}
+            occd = Occurrence(filename, id_, start, end, alarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
-            if occs.add_safe(base_time, occd) or \
-                                        (next_occ and start > next_occ and
-                                        (alarm is None or alarm > next_occ)):
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
+            if next_occ and start > next_occ and (alarm is None or
+                                                             alarm > next_occ):
                 break
 
         try:
@@ -339,16 +313,12 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    months = rule['#'][0]
-    weekday = rule['#'][1]
-    number = rule['#'][2]
+    (months, weekday, number, maxoverlap, startH, startM, rend,
+                                                        ralarm) = rule.params
+
     # Go back by span in order to keep into account any occurrence that still
     # has to end
-    mintime = base_time - rule['#'][3]
-    startH = rule['#'][4]
-    startM = rule['#'][5]
-    rend = rule['#'][6]
-    ralarm = rule['#'][7]
+    mintime = base_time - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -363,17 +333,17 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
         year = date.year
 
     while True:
-        first_month_weekday, last_month_day_number = calendar.monthrange(year,
-                                                                        month)
+        first_month_weekday, last_month_day_number = monthtable.monthrange(
+                                                                year, month)
         last_month_weekday = (first_month_weekday + last_month_day_number % 7 +
                                                                         6) % 7
         selected_day_number = last_month_day_number - (last_month_weekday -
                                                 weekday + 7) % 7 - number * 7
 
-        try:
-            sdate = _datetime.datetime(year, month, selected_day_number,
+        start = monthtable.local_time(year, month, selected_day_number,
                                                                 startH, startM)
-        except ValueError:
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -390,8 +360,6 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -408,19 +376,18 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 salarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': sstart,
-                    'end': send,
-                    'alarm': salarm}
+            occd = Occurrence(filename, id_, sstart, send, salarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
             # Do compare sstart and salarm with next_occ, *not* start and alarm
-            if occs.add_safe(base_time, occd) or \
-                            (next_occ and sstart > next_occ and
-                            (salarm is None or salarm > next_occ)):
+            if next_occ and sstart > next_occ and (salarm is None or
+                                                            salarm > next_occ):
                 break
 
         try:
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+from outspline.extensions.organism_api import Occurrence
+
 from exceptions import BadRuleError
 
 _RULE_NAMES = {'local': 'occur_once_local',
@@ -45,9 +47,7 @@ def make_rule(start, end, alarm, standard, guiconfig):
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
     # The rule is checked in make_rule, no need to use occs.add
-    start = rule['#'][0]
-    end = rule['#'][1]
-    alarm = rule['#'][2]
+    start, end, alarm = rule.params
 
     offset = utcoffset.compute(start)
 
@@ -63,28 +63,34 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
     except TypeError:
         salarm = alarm
 
-    occs.add_safe({'filename': filename,
-                   'id_': id_,
-                   'start': sstart,
-                   'end': send,
-                   'alarm': salarm})
+    occs.add_safe(Occurrence(filename, id_, sstart, send, salarm))
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
     # The rule is checked in make_rule, no need to use occs.add
-    occs.add_safe({'filename': filename,
-                   'id_': id_,
-                   'start': rule['#'][0],
-                   'end': rule['#'][1],
-                   'alarm': rule['#'][2]})
+    start, end, alarm = rule.params
+    occs.add_safe(Occurrence(filename, id_, start, end, alarm))
+
+
+def get_time_span_local(utcoffset, rule):
+    start = rule['#'][0]
+    offset = utcoffset.compute(start)
+    times = [time + offset for time in rule['#'][:3] if time is not None]
+
+    return (min(times), max(times))
+
+
+def get_time_span_UTC(utcoffset, rule):
+    times = [time for time in rule['#'][:3] if time is not None]
+
+    return (min(times), max(times))
+
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
     # The rule is checked in make_rule, no need to use occs.add
-    start = rule['#'][0]
-    end = rule['#'][1]
-    alarm = rule['#'][2]
+    start, end, alarm = rule.params
 
     offset = utcoffset.compute(start)
 
@@ -100,17 +106,10 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
     except TypeError:
         salarm = alarm
 
-    occs.add_safe(base_time, {'filename': filename,
-                              'id_': id_,
-                              'start': sstart,
-                              'end': send,
-                              'alarm': salarm})
+    occs.add_safe(base_time, Occurrence(filename, id_, sstart, send, salarm))
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
     # The rule is checked in make_rule, no need to use occs.add
-    occs.add_safe(base_time, {'filename': filename,
-                              'id_': id_,
-                              'start': rule['#'][0],
-                              'end': rule['#'][1],
-                              'alarm': rule['#'][2]})
+    start, end, alarm = rule.params
+    occs.add_safe(base_time, Occurrence(filename, id_, start, end, alarm))
@@ -16,10 +16,20 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+import time as _time
+
+from outspline.extensions.organism_api import Occurrence
+
 from exceptions import BadRuleError
 
 _RULE_NAMES = {'local': 'occur_regularly_local',
                'UTC': 'occur_regularly_UTC'}
+# Larger than any possible UTC offset, in seconds
+_MAX_UTC_OFFSET = 86400
+# The occurrences are handed to the range in chunks of this size, so that a
+# stopped or limited search can abort a rule with a short interval without
+# creating all of its occurrences first
+_CHUNK = 256
 
 
 def make_rule(refstart, interval, rend, ralarm, standard, guiconfig):
@@ -414,6 +424,32 @@ DHPT
 """
 
 
+def compile_rule(rule):
+    refstart, interval, overlaps, bgap, rend, ralarm = rule['#'][:6]
+    return compile_parameters(refstart, interval, overlaps, bgap, rend, ralarm)
+
+
+def compile_parameters(refstart, interval, overlaps, bgap, rend, ralarm):
+    # The occurrences are generated until both their start and alarm times are
+    # later than the end of the range, i.e. until maxt + maxdelta
+    if ralarm is None or ralarm < 0:
+        maxdelta = 0
+    else:
+        maxdelta = ralarm
+
+    # Each occurrence time is the start time plus a constant delta
+    deltas = [0]
+
+    if rend is not None:
+        deltas.append(rend)
+
+    if ralarm is not None:
+        deltas.append(ralarm * -1)
+
+    return (refstart, interval, overlaps, bgap, rend, ralarm, maxdelta,
+                                                                tuple(deltas))
+
+
 def compute_min_time(reftime, refstart, interval, overlaps, bgap):
     ftime = reftime + (refstart - reftime) % interval
 
@@ -424,93 +460,164 @@ def compute_min_time(reftime, refstart, interval, overlaps, bgap):
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    interval = rule['#'][1]
+    search_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
+                                                        rule.params, occs)
+
+
+def search_range_local(mint, utcmint, maxt, utcoffset, filename, id_, params,
+                                                                        occs):
+    (refstart, interval, overlaps, bgap, rend, ralarm, maxdelta,
+                                                        deltas) = params
     # Use utcmint because in Western (negative) time zones (e.g.
     # Pacific/Honolulu), the first occurrence to be found would otherwise be
     # already too late; in Eastern (positive) time zones the problem would pass
     # unnoticed because the first occurrence would be found too early, and
     # simply several cycles would not produce occurrences in the search range
-    start = compute_min_time(utcmint, rule['#'][0], interval, rule['#'][2],
-                                                                rule['#'][3])
-    rend = rule['#'][4]
-    ralarm = rule['#'][5]
-
-    while True:
-        # Every timestamp can have a different UTC offset, depending whether
-        # it's in a DST period or not
-        offset = utcoffset.compute(start)
-
-        sstart = start + offset
-
-        try:
-            send = sstart + rend
-        except TypeError:
-            send = None
-
-        try:
-            salarm = sstart - ralarm
-        except TypeError:
-            salarm = None
-
-        # Do compare sstart and salarm with maxt, *not* start and alarm
-        if sstart > maxt and (salarm is None or salarm > maxt):
-            break
+    # Also go back by the time zone's DST shift, otherwise if mint is right
+    # after a UTC offset change, an occurrence that started before the change
+    # and is in the range only because of its end or alarm time would be missed
+    start = compute_min_time(utcmint - abs(_time.timezone - _time.altzone),
+                                    refstart, interval, overlaps, bgap)
+    maxstart = maxt + maxdelta
+
+    # Every timestamp can have a different UTC offset, depending whether it's
+    # in a DST period or not, so the last start time cannot be known exactly
+    # in advance: take the start times that can possibly be in the range, and
+    # look up their offsets in bulk, one chunk at a time; the first start time
+    # after the returned ones would surely be out of the range
+    laststart = maxstart + _MAX_UTC_OFFSET
+    step = interval * _CHUNK
+
+    while start <= laststart:
+        starts = range(start, min(start + step, laststart + 1), interval)
+        batch = []
+
+        for ustart, offset in zip(starts, utcoffset.compute_many(starts)):
+            sstart = ustart + offset
+
+            # Do compare sstart with maxstart, *not* ustart
+            if sstart > maxstart:
+                laststart = ustart
+                break
+
+            batch.append(Occurrence(filename, id_, sstart,
+                                None if rend is None else sstart + rend,
+                                None if ralarm is None else sstart - ralarm))
 
         # The rule is checked in make_rule, no need to use occs.add
-        occs.add_safe({'filename': filename,
-                       'id_': id_,
-                       'start': sstart,
-                       'end': send,
-                       'alarm': salarm})
-
-        start += interval
+        occs.add_many(filename, id_, batch)
+        start += step
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    interval = rule['#'][1]
-    start = compute_min_time(mint, rule['#'][0], interval, rule['#'][2],
-                                                                rule['#'][3])
-    rend = rule['#'][4]
-    ralarm = rule['#'][5]
+    search_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
+                                                        rule.params, occs)
 
-    while True:
-        try:
-            end = start + rend
-        except TypeError:
-            end = None
 
-        try:
-            alarm = start - ralarm
-        except TypeError:
-            alarm = None
+def search_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_, params,
+                                                                        occs):
+    (refstart, interval, overlaps, bgap, rend, ralarm, maxdelta,
+                                                        deltas) = params
+    start = compute_min_time(mint, refstart, interval, overlaps, bgap)
 
-        if start > maxt and (alarm is None or alarm > maxt):
-            break
+    laststart = maxt + maxdelta
+    step = interval * _CHUNK
 
+    # The start times are an arithmetic progression, so the occurrences in
+    # the range can be computed in bulk, one chunk at a time
+    while start <= laststart:
         # The rule is checked in make_rule, no need to use occs.add
-        occs.add_safe({'filename': filename,
-                       'id_': id_,
-                       'start': start,
-                       'end': end,
-                       'alarm': alarm})
-
-        start += interval
+        occs.add_many(filename, id_, [Occurrence(filename, id_, cstart,
+                            None if rend is None else cstart + rend,
+                            None if ralarm is None else cstart - ralarm)
+                            for cstart in xrange(start, min(start + step,
+                            laststart + 1), interval)])
+        start += step
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    interval = rule['#'][1]
+    search_next_local(base_time, utcbase, utcoffset, filename, id_,
+                                                        rule.params, occs)
+
+
+def search_next_local(base_time, utcbase, utcoffset, filename, id_, params,
+                                                                        occs):
+    (refstart, interval, overlaps, bgap, rend, ralarm, maxdelta,
+                                                        deltas) = params
     # Use utcbase because in Western (negative) time zones (e.g.
     # Pacific/Honolulu), the first occurrence to be found would otherwise be
     # already too late; in Eastern (positive) time zones the problem would pass
     # unnoticed because the first occurrence would be found too early, and
     # simply several cycles would not produce occurrences in the search range
-    start = compute_min_time(utcbase, rule['#'][0], interval, rule['#'][2],
-                                                                rule['#'][3])
-    rend = rule['#'][4]
-    ralarm = rule['#'][5]
+    start = compute_min_time(utcbase, refstart, interval, overlaps, bgap)
+
+    offset, limit = utcoffset.compute_limit(start)
+
+    # If the UTC offset is constant for all the start times that the search
+    # loop would test, the problem is the same as for UTC rules, only shifted
+    # by the offset
+    starts, laststart = _compute_next_starts(base_time - offset, start,
+                                                interval, maxdelta, deltas)
+
+    if limit is None or laststart < limit:
+        for ustart in starts:
+            sstart = ustart + offset
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, Occurrence(filename, id_, sstart,
+                                None if rend is None else sstart + rend,
+                                None if ralarm is None else sstart - ralarm))
+    else:
+        _search_next_item_occurrences_local(base_time, start, utcoffset,
+                                filename, id_, interval, rend, ralarm, occs)
+
 
+def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
+                                                            id_, rule, occs):
+    search_next_UTC(base_time, utcbase, utcoffset, filename, id_,
+                                                        rule.params, occs)
+
+
+def search_next_UTC(base_time, utcbase, utcoffset, filename, id_, params,
+                                                                        occs):
+    (refstart, interval, overlaps, bgap, rend, ralarm, maxdelta,
+                                                        deltas) = params
+    start = compute_min_time(base_time, refstart, interval, overlaps, bgap)
+
+    for start in _compute_next_starts(base_time, start, interval, maxdelta,
+                                                                deltas)[0]:
+        # The rule is checked in make_rule, no need to use occs.add
+        occs.add_safe(base_time, Occurrence(filename, id_, start,
+                                None if rend is None else start + rend,
+                                None if ralarm is None else start - ralarm))
+
+
+def _compute_next_starts(base_time, minstart, interval, maxdelta, deltas):
+    # Return the start times, in ascending order, of the occurrences whose
+    # first time (start, end or alarm) later than base_time is the earliest
+    # one, i.e. the occurrences that a search loop starting from minstart
+    # would eventually keep; also return the last start time that such a loop
+    # could have to test
+    # For each delta, the earliest time later than base_time is given by the
+    # first start time that is later than base_time - delta
+    next_time = min(max(minstart, base_time - delta + 1 +
+                            (minstart - base_time + delta - 1) % interval) +
+                            delta for delta in deltas)
+
+    starts = sorted(set(next_time - delta for delta in deltas
+                            if next_time - delta >= minstart and
+                            (next_time - delta - minstart) % interval == 0))
+
+    # The loop would stop at the first start time that, together with its
+    # alarm time, is later than next_time
+    return (starts, next_time + maxdelta + interval)
+
+
+def _search_next_item_occurrences_local(base_time, start, utcoffset, filename,
+                                        id_, interval, rend, ralarm, occs):
+    # This loop is only needed if a UTC offset change happens between the
+    # start times to be tested
     while True:
         # Every timestamp can have a different UTC offset, depending whether
         # it's in a DST period or not
@@ -528,54 +635,18 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
         except TypeError:
             salarm = None
 
-        occd = {'filename': filename,
-                'id_': id_,
-                'start': sstart,
-                'end': send,
-                'alarm': salarm}
-
-        next_occ = occs.get_next_occurrence_time()
+        occd = Occurrence(filename, id_, sstart, send, salarm)
 
         # The rule is checked in make_rule, no need to use occs.add
-        # Do compare sstart and salarm with next_occ, *not* start and alarm
-        if occs.add_safe(base_time, occd) or (next_occ and \
-                            sstart > next_occ and \
-                            (salarm is None or salarm > next_occ)):
-            break
-
-        start += interval
-
-
-def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
-                                                            id_, rule, occs):
-    interval = rule['#'][1]
-    start = compute_min_time(base_time, rule['#'][0], interval, rule['#'][2],
-                                                                rule['#'][3])
-    rend = rule['#'][4]
-    ralarm = rule['#'][5]
-
-    while True:
-        try:
-            end = start + rend
-        except TypeError:
-            end = None
-
-        try:
-            alarm = start - ralarm
-        except TypeError:
-            alarm = None
-
-        occd = {'filename': filename,
-                'id_': id_,
-                'start': start,
-                'end': end,
-                'alarm': alarm}
-
+        occs.add_safe(base_time, occd)
         next_occ = occs.get_next_occurrence_time()
 
-        # The rule is checked in make_rule, no need to use occs.add
-        if occs.add_safe(base_time, occd) or (next_occ and \
-                    start > next_occ and (alarm is None or alarm > next_occ)):
+        # Do not stop as soon as an occurrence is added, in fact a later
+        #  one can still have an earlier time, e.g. if only the end of
+        #  this one is after base_time
+        # Do compare sstart and salarm with next_occ, *not* start and alarm
+        if next_occ and sstart > next_occ and (salarm is None or
+                                                            salarm > next_occ):
             break
 
         start += interval
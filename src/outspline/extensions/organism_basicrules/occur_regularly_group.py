@@ -90,37 +90,38 @@ def make_rule(refstart, interval, rstarts, rend, ralarm, standard, guiconfig):
         raise BadRuleError()
 
 
+def compile_rule(rule):
+    # The group is searched as a set of occur_regularly rules, one for each
+    # reference start time, whose parameters are compiled here once
+    refstarts, interval, overlaps, bgap, rend, ralarm = rule['#'][:6]
+    return tuple(occur_regularly.compile_parameters(refstart, interval,
+                                    overlaps, bgap, rend, ralarm)
+                                    for refstart in refstarts)
+
+
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    for refstart in rule['#'][0]:
-        srule = rule.copy()
-        srule['#'][0] = refstart
-        occur_regularly.get_occurrences_range_local(mint, utcmint, maxt,
-                                        utcoffset, filename, id_, srule, occs)
+    for params in rule.params:
+        occur_regularly.search_range_local(mint, utcmint, maxt, utcoffset,
+                                                filename, id_, params, occs)
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    for refstart in rule['#'][0]:
-        srule = rule.copy()
-        srule['#'][0] = refstart
-        occur_regularly.get_occurrences_range_UTC(mint, utcmint, maxt,
-                                        utcoffset, filename, id_, srule, occs)
+    for params in rule.params:
+        occur_regularly.search_range_UTC(mint, utcmint, maxt, utcoffset,
+                                                filename, id_, params, occs)
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    for refstart in rule['#'][0]:
-        srule = rule.copy()
-        srule['#'][0] = refstart
-        occur_regularly.get_next_item_occurrences_local(base_time, utcbase,
-                                        utcoffset, filename, id_, srule, occs)
+    for params in rule.params:
+        occur_regularly.search_next_local(base_time, utcbase, utcoffset,
+                                                filename, id_, params, occs)
 
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    for refstart in rule['#'][0]:
-        srule = rule.copy()
-        srule['#'][0] = refstart
-        occur_regularly.get_next_item_occurrences_UTC(base_time, utcbase,
-                                        utcoffset, filename, id_, srule, occs)
+    for params in rule.params:
+        occur_regularly.search_next_UTC(base_time, utcbase, utcoffset,
+                                                filename, id_, params, occs)
@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
-import time as _time
 import datetime as _datetime
 
+from outspline.extensions.organism_api import Occurrence
+
 from exceptions import BadRuleError
+import monthtable
 
 _RULE_NAMES = {'local': 'occur_yearly_local',
                'UTC': 'occur_yearly_UTC'}
@@ -115,15 +117,9 @@ def make_rule(interval, refyear, month, day, hour, minute, rend, ralarm,
 
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    mintime = mint - rule['#'][0]
-    interval = rule['#'][1]
-    refyear = rule['#'][2]
-    month = rule['#'][3]
-    day = rule['#'][4]
-    startH = rule['#'][5]
-    startM = rule['#'][6]
-    rend = rule['#'][7]
-    ralarm = rule['#'][8]
+    (maxoverlap, interval, refyear, month, day, startH, startM, rend,
+                                                        ralarm) = rule.params
+    mintime = mint - maxoverlap
 
     ndate = _datetime.datetime.fromtimestamp(mintime)
     nyear = ndate.year
@@ -131,9 +127,9 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
     year = nyear + abs(refyear - nyear) % interval
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, day, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, day, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.datetime.fromtimestamp(maxt)
             testdate = _datetime.datetime(year, month, 1)
@@ -141,8 +137,6 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -157,26 +151,16 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': start,
-                           'end': end,
-                           'alarm': alarm})
+            occs.add_safe(Occurrence(filename, id_, start, end, alarm))
 
         year += interval
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
-    mintime = mint - rule['#'][0]
-    interval = rule['#'][1]
-    refyear = rule['#'][2]
-    month = rule['#'][3]
-    day = rule['#'][4]
-    startH = rule['#'][5]
-    startM = rule['#'][6]
-    rend = rule['#'][7]
-    ralarm = rule['#'][8]
+    (maxoverlap, interval, refyear, month, day, startH, startM, rend,
+                                                        ralarm) = rule.params
+    mintime = mint - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -186,9 +170,9 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
     year = nyear + abs(refyear - nyear) % interval
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, day, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, day, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             maxdate = _datetime.datetime.fromtimestamp(maxt)
             testdate = _datetime.datetime(year, month, 1)
@@ -196,8 +180,6 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -219,26 +201,16 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
                 break
 
             # The rule is checked in make_rule, no need to use occs.add
-            occs.add_safe({'filename': filename,
-                           'id_': id_,
-                           'start': sstart,
-                           'end': send,
-                           'alarm': salarm})
+            occs.add_safe(Occurrence(filename, id_, sstart, send, salarm))
 
         year += interval
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    mintime = base_time - rule['#'][0]
-    interval = rule['#'][1]
-    refyear = rule['#'][2]
-    month = rule['#'][3]
-    day = rule['#'][4]
-    startH = rule['#'][5]
-    startM = rule['#'][6]
-    rend = rule['#'][7]
-    ralarm = rule['#'][8]
+    (maxoverlap, interval, refyear, month, day, startH, startM, rend,
+                                                        ralarm) = rule.params
+    mintime = base_time - maxoverlap
 
     ndate = _datetime.datetime.fromtimestamp(mintime)
     nyear = ndate.year
@@ -246,9 +218,9 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
     year = nyear + abs(refyear - nyear) % interval
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, day, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, day, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -265,8 +237,6 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             try:
                 end = start + rend
             except TypeError:
@@ -277,18 +247,17 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 alarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': start,
-                    'end': end,
-                    'alarm': alarm}
+            occd = Occurrence(filename, id_, start, end, alarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
-            if occs.add_safe(base_time, occd) or \
-                                        (next_occ and start > next_occ and
-                                        (alarm is None or alarm > next_occ)):
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
+            if next_occ and start > next_occ and (alarm is None or
+                                                             alarm > next_occ):
                 break
 
         year += interval
@@ -296,15 +265,9 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
                                                             id_, rule, occs):
-    mintime = base_time - rule['#'][0]
-    interval = rule['#'][1]
-    refyear = rule['#'][2]
-    month = rule['#'][3]
-    day = rule['#'][4]
-    startH = rule['#'][5]
-    startM = rule['#'][6]
-    rend = rule['#'][7]
-    ralarm = rule['#'][8]
+    (maxoverlap, interval, refyear, month, day, startH, startM, rend,
+                                                        ralarm) = rule.params
+    mintime = base_time - maxoverlap
 
     # Using utcfromtimestamp gives correct behaviour in Eastern (positive) time
     # zones (e.g. Australia/Sydney)
@@ -314,9 +277,9 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
     year = nyear + abs(refyear - nyear) % interval
 
     while True:
-        try:
-            sdate = _datetime.datetime(year, month, day, startH, startM)
-        except ValueError:
+        start = monthtable.local_time(year, month, day, startH, startM)
+
+        if start is None:
             # Prevent infinite loops
             testdate = _datetime.date(year, month, 1)
             next_ = occs.get_next_occurrence_time()
@@ -333,8 +296,6 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             if maxdate < testdate:
                 break
         else:
-            start = int(_time.mktime(sdate.timetuple()))
-
             # Every timestamp can have a different UTC offset, depending
             # whether it's in a DST period or not
             offset = utcoffset.compute(start)
@@ -351,19 +312,18 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
             except TypeError:
                 salarm = None
 
-            occd = {'filename': filename,
-                    'id_': id_,
-                    'start': sstart,
-                    'end': send,
-                    'alarm': salarm}
+            occd = Occurrence(filename, id_, sstart, send, salarm)
 
+            # The rule is checked in make_rule, no need to use occs.add
+            occs.add_safe(base_time, occd)
             next_occ = occs.get_next_occurrence_time()
 
-            # The rule is checked in make_rule, no need to use occs.add
+            # Do not stop as soon as an occurrence is added, in fact a later
+            #  one can still have an earlier time, e.g. if only the end of
+            #  this one is after base_time
             # Do compare sstart and salarm with next_occ, *not* start and alarm
-            if occs.add_safe(base_time, occd) or \
-                            (next_occ and sstart > next_occ and
-                            (salarm is None or salarm > next_occ)):
+            if next_occ and sstart > next_occ and (salarm is None or
+                                                            salarm > next_occ):
                 break
 
         year += interval
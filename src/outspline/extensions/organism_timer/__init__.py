@@ -33,8 +33,7 @@ class Main(object):
     def __init__(self):
         self.rules = timer.Rules()
         self.databases = {}
-        self.nextoccsengine = timer.NextOccurrencesEngine(self.databases,
-                                                        self.rules.handlers)
+        self.nextoccsengine = timer.NextOccurrencesEngine(self.databases)
 
         core_api.bind_to_open_database_dirty(self._handle_open_database_dirty)
         core_api.bind_to_close_database(self._handle_close_database)
@@ -46,9 +45,17 @@ class Main(object):
 
         organism_api.bind_to_open_database(self._handle_open_database)
         organism_api.bind_to_update_item_rules_conditional(
-                                self._handle_search_next_occurrences_request)
+                                            self._handle_update_item_rules)
+        # The engine is restarted by the history event, or by the delete
+        # subtree event, after these
+        organism_api.bind_to_history_insert(self._handle_item_rules_changed)
+        organism_api.bind_to_history_update(self._handle_item_rules_changed)
+        organism_api.bind_to_history_delete(self._handle_item_rules_changed)
+        organism_api.bind_to_delete_item_rules(self._handle_item_rules_changed)
 
         if copypaste_api:
+            # The engine is restarted by the items pasted event
+            copypaste_api.bind_to_paste_item(self._handle_item_rules_changed)
             copypaste_api.bind_to_items_pasted(
                                 self._handle_search_next_occurrences_request)
 
@@ -75,6 +82,13 @@ class Main(object):
         else:
             self.nextoccsengine.restart()
 
+    def _handle_update_item_rules(self, kwargs):
+        self.nextoccsengine.set_item_changed(kwargs['filename'], kwargs['id_'])
+        self.nextoccsengine.restart()
+
+    def _handle_item_rules_changed(self, kwargs):
+        self.nextoccsengine.set_item_changed(kwargs['filename'], kwargs['id_'])
+
     def _handle_search_next_occurrences_request(self, kwargs):
         self.nextoccsengine.restart()
 
@@ -17,6 +17,7 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import threading
+import heapq
 import time as time_
 
 from outspline.static.pyaux import timeaux
@@ -31,6 +32,7 @@ from exceptions import (BadOccurrenceError, BadExceptRuleError,
 
 get_next_occurrences_event = Event()
 search_old_occurrences_event = Event()
+search_old_occurrences_progress_event = Event()
 search_old_occurrences_end_event = Event()
 search_next_occurrences_event = Event()
 activate_occurrences_range_event = Event()
@@ -98,13 +100,13 @@ class NextOccurrences(object):
     def add(self, base_time, occ):
         # Make sure this occurrence is compliant with the requirements defined
         # in organism_api.update_item_rules
-        if occ['start'] and (not occ['end'] or occ['end'] > occ['start']):
+        if occ.start and (not occ.end or occ.end > occ.start):
             return self.add_safe(base_time, occ)
         else:
             raise BadOccurrenceError()
 
     def add_safe(self, base_time, occ):
-        tl = [occ['alarm'], occ['start'], occ['end']]
+        tl = [occ.alarm, occ.start, occ.end]
         # When sorting, None values are put first
         tl.sort()
 
@@ -113,7 +115,7 @@ class NextOccurrences(object):
             if base_time < t:
                 if not self.next or t < self.next:
                     self.next = t
-                    self.occs = {occ['filename']: {occ['id_']: [occ]}}
+                    self.occs = {occ.filename: {occ.id_: [occ]}}
                     return True
                 elif t == self.next:
                     self._add(self.occs, occ)
@@ -127,8 +129,8 @@ class NextOccurrences(object):
         self._add(self.oldoccs, occ)
 
     def _add(self, occsd, occ):
-        filename = occ['filename']
-        id_ = occ['id_']
+        filename = occ.filename
+        id_ = occ.id_
 
         try:
             occsd[filename][id_]
@@ -152,20 +154,21 @@ class NextOccurrences(object):
         # Test if the item has some rules, for safety, also for coherence with
         # organism.items.OccurrencesRange.except_safe
         try:
-            occsc = self.occs[filename][id_][:]
+            occs = self.occs[filename][id_]
         except KeyError:
             pass
         else:
-            for occ in occsc:
-                # Occurrences with start == o['end'] shouldn't be excepted, as
-                # they're not considered part of the end minute
-                if start <= occ['start'] <= end or (inclusive and
-                                           occ['start'] <= start < occ['end']):
-                    self.occs[filename][id_].remove(occ)
-                    if not self.occs[filename][id_]:
-                        del self.occs[filename][id_]
-                        if not self.occs[filename]:
-                            del self.occs[filename]
+            # Filter the occurrences in a single pass instead of removing them
+            # one by one from a copy of the list
+            # Occurrences with start == o.end shouldn't be excepted, as
+            # they're not considered part of the end minute
+            occs[:] = [occ for occ in occs if not (start <= occ.start <= end or
+                            (inclusive and occ.start <= start < occ.end))]
+
+            if not occs:
+                del self.occs[filename][id_]
+                if not self.occs[filename]:
+                    del self.occs[filename]
         # Do not try to update self.next (even in case there are no occurrences
         # left): this lets NextOccurrencesEngine reset the last search time to
         # this value, thus ignoring the excepted occurrences at the following
@@ -178,8 +181,7 @@ class NextOccurrences(object):
             return False
         else:
             for occd in occsc:
-                if (start, end, alarm) == (occd['start'], occd['end'],
-                                                                occd['alarm']):
+                if (start, end, alarm) == (occd.start, occd.end, occd.alarm):
                     self.occs[filename][id_].remove(occd)
                     if not self.occs[filename][id_]:
                         del self.occs[filename][id_]
@@ -193,6 +195,11 @@ class NextOccurrences(object):
         # This function is however designed to be used just before adding a
         # very similar occurrence, so self.next will be updated by that anyway
 
+    def set_next_occurrences(self, time, occsd):
+        # Used by NextOccurrencesEngine, which searches each item separately
+        self.next = time
+        self.occs = occsd
+
     def get_dict(self):
         return self.occs
 
@@ -210,19 +217,109 @@ class NextOccurrences(object):
             return False
         else:
             # The final minstart and maxend should never end up being None
-            minstart = occs[0]['start']
+            minstart = occs[0].start
             # Initialize maxend to minstart, which is surely != None
             maxend = minstart
 
             for occ in occs:
                 # This assumes that start <= end
-                minstart = min((minstart, occ['start']))
-                # occ['end'] could be None
-                maxend = max((occ['start'], occ['end'], maxend))
+                minstart = min((minstart, occ.start))
+                # occ.end could be None
+                maxend = max((occ.start, occ.end, maxend))
 
             return (minstart, maxend)
 
 
+class ItemsNextOccurrences(object):
+    def __init__(self, filename, base_time):
+        # The next occurrence time of each item of a database is searched
+        # separately, with respect to the database's last search time, and
+        # kept in a heap, so that only the items whose rules have changed, or
+        # whose next occurrence time has been reached, have to be searched
+        # again; items without future occurrences are not stored
+        self.filename = filename
+        self.base_time = base_time
+        # id_ -> next occurrence time
+        self.times = {}
+        # id_ -> list of the occurrences at the next occurrence time; it can
+        # be empty if they have all been excepted
+        self.occs = {}
+        # (time, id_) tuples; the entries that do not match self.times are
+        # stale and are skipped lazily
+        self.heap = []
+
+    def set(self, id_, time, occs):
+        if time is None:
+            self.discard(id_)
+        else:
+            if self.times.get(id_) != time:
+                self.times[id_] = time
+                heapq.heappush(self.heap, (time, id_))
+
+            self.occs[id_] = occs
+
+    def discard(self, id_):
+        try:
+            del self.times[id_]
+        except KeyError:
+            pass
+        else:
+            del self.occs[id_]
+
+    def pop_reached(self, base_time):
+        # Remove and return the items whose next occurrence time is not after
+        # base_time, i.e. whose next occurrence has already been searched
+        self.base_time = base_time
+        ids = []
+
+        while self.heap and self.heap[0][0] <= base_time:
+            time, id_ = heapq.heappop(self.heap)
+
+            if self.times.get(id_) == time:
+                ids.append(id_)
+                self.discard(id_)
+
+        # Compact the heap if too many entries have become stale
+        if len(self.heap) > 2 * len(self.times) + 64:
+            self.heap = [(time, id_) for id_, time in self.times.iteritems()]
+            heapq.heapify(self.heap)
+
+        return ids
+
+    def get_next_occurrence_time(self):
+        while self.heap:
+            time, id_ = self.heap[0]
+
+            if self.times.get(id_) == time:
+                return time
+
+            heapq.heappop(self.heap)
+
+        return None
+
+    def get_next_occurrences(self, time):
+        # Return the occurrences of all the items whose next occurrence time
+        # is time, which must be the database's next occurrence time
+        popped = []
+        occsd = {}
+
+        while self.heap and self.heap[0][0] == time:
+            entry = heapq.heappop(self.heap)
+            popped.append(entry)
+            id_ = entry[1]
+
+            if self.times.get(id_) == time and self.occs[id_]:
+                # The lists will be modified by the event handlers (e.g.
+                # organism_alarms removes duplicates), so copy them; the
+                # occurrences themselves are never modified
+                occsd[id_] = self.occs[id_][:]
+
+        for entry in popped:
+            heapq.heappush(self.heap, entry)
+
+        return occsd
+
+
 class Rules(object):
     def __init__(self):
         self.handlers = {}
@@ -231,6 +328,8 @@ class Rules(object):
         # The rules should be installed separately for each database (bug #330)
         if rulename not in self.handlers:
             self.handlers[rulename] = handler
+            # The handlers are bound to the rules when organism compiles them
+            organism_api.install_next_rule_handler(rulename, handler)
         else:
             raise ConflictingRuleHandlerError()
 
@@ -242,10 +341,8 @@ class NextOccurrencesSearchStop(UserWarning):
 
 
 class NextOccurrencesSearch(object):
-    def __init__(self, filenames, rule_handlers, base_time=None,
-                                                            base_times=None):
+    def __init__(self, filenames, base_time=None, base_times=None):
         self.filenames = filenames
-        self.rule_handlers = rule_handlers
         self.base_time = base_time
         self.base_times = base_times
         self._search_item = self._search_item_continue
@@ -269,11 +366,10 @@ class NextOccurrencesSearch(object):
                 utcbase = self.base_time - self.utcoffset.compute(
                                                                 self.base_time)
 
-                for row in organism_api.get_all_valid_item_rules(filename):
-                    id_ = row['R_id']
-                    rules = organism_api.convert_string_to_rules(
-                                                                row['R_rules'])
-
+                # The items whose occurrences all ended before the base time
+                # cannot have next occurrences
+                for id_, rules in organism_api.iter_valid_item_rules_range(
+                                            filename, self.base_time, None):
                     for rule in rules:
                         self._search_item(filename, id_, rule, utcbase)
 
@@ -299,8 +395,8 @@ class NextOccurrencesSearch(object):
         pass
 
     def _search_item_continue(self, filename, id_, rule, utcbase):
-        self.rule_handlers[rule['rule']](self.base_time, utcbase,
-                            self.utcoffset, filename, id_, rule, self.occs)
+        rule.search_next(self.base_time, utcbase, self.utcoffset, filename,
+                                                        id_, rule, self.occs)
 
     def _search_item_stop(self, filename, id_, rule, utcbase):
         raise NextOccurrencesSearchStop()
@@ -310,8 +406,9 @@ class OldOccurrencesSearch(object):
     def __init__(self, database, filename):
         self.database = database
         self.filename = filename
-        self.DELAY = coreaux_api.get_extension_configuration('organism_timer'
-                                        ).get_float('old_alarms_delay') / 1000
+        conf = coreaux_api.get_extension_configuration('organism_timer')
+        self.DELAY = conf.get_float('old_alarms_delay') / 1000
+        self.WINDOW = conf.get_int('old_alarms_window_days') * 86400
 
     def start(self):
         # Do not use directly NextOccurrencesEngine to search for old
@@ -368,22 +465,15 @@ class OldOccurrencesSearch(object):
         # It's important that the databases are blocked on this thread, and not
         # on the main thread, otherwise the program would hang if some
         # occurrences are activated while the user is performing an action
-        core_api.block_databases(block=True)
         search_old_occurrences_event.signal(filename=self.filename,
                                                     last_search=self.exclmint)
         self.state = 0
 
         while self.state < 1:
-            self.search = organism_api.get_occurrences_range(
-                                        mint=self.exclmint, maxt=self.whileago,
-                                        filenames=(self.filename, ))
             self.state = 2
+            self._search_windows()
 
-            # Make sure to bind *after* self.search is instantiated and
-            # self.state is set to 2, but *before* it's started
-            core_api.bind_to_closing_database(self._handle_closing_database)
-
-            self.search.start()
+        core_api.block_databases(block=True)
 
         if self.state == 1:
             self._abort()
@@ -392,29 +482,119 @@ class OldOccurrencesSearch(object):
 
         core_api.release_databases()
 
-    def _process_results(self):
-        occs = self.search.get_results()
-        occsd = occs.get_dict()
+    def _search_windows(self):
+        # The absence may have lasted months, so the range is searched in
+        # bounded time windows, and the databases are released between the
+        # windows, so that they aren't blocked for the whole search
+        # The results of each window are kept and later activated as they are,
+        # without searching the range again, so that the activated alarms
+        # always match the counted ones; the total count and the most recent
+        # alarm of each item are needed up front to choose whether to activate
+        # all the alarms or only the latter
+        mint = self.exclmint
+        self.count = 0
+        self.lastoccsd = {}
+        self.windows = []
+
+        for wmint, wmaxt in self._iter_windows(mint):
+            # The search only reads the databases, so it can run concurrently
+            # with the other searches
+            core_api.block_databases_shared(block=True)
+            occsd = self._search_window(wmint, wmaxt)
+            core_api.release_databases_shared()
+
+            # The search may have been restarted or aborted meanwhile, and in
+            # that case its results are incomplete
+            if self.state != 2:
+                break
+
+            if occsd:
+                self.windows.append(occsd)
+
+                for id_ in occsd:
+                    self.count += len(occsd[id_])
+                    last = max(occsd[id_], key=lambda occ: occ.alarm)
+
+                    try:
+                        if last.alarm <= self.lastoccsd[id_][0].alarm:
+                            continue
+                    except KeyError:
+                        pass
+
+                    self.lastoccsd[id_] = [last]
+
+            search_old_occurrences_progress_event.signal(
+                                    filename=self.filename, mint=mint,
+                                    maxt=self.whileago, time=wmaxt)
+
+    def _iter_windows(self, mint):
+        # Consecutive windows share their limits, but _search_window keeps
+        # only the alarms strictly greater than the window's minimum time
+        wmint = mint
+
+        while wmint < self.whileago:
+            wmaxt = min(wmint + self.WINDOW, self.whileago)
+            yield (wmint, wmaxt)
+            wmint = wmaxt
+
+    def _search_window(self, mint, maxt):
+        self.search = organism_api.get_occurrences_range(mint=mint, maxt=maxt,
+                                                filenames=(self.filename, ))
+
+        # Make sure to bind *after* self.search is instantiated, but *before*
+        # it's started
+        core_api.bind_to_closing_database(self._handle_closing_database)
+
+        self.search.start()
+
+        occsd = self.search.get_results().get_dict()
         # Executing occs.get_active_dict here wouldn't make sense; let
         # NextOccurrencesEngine deal with snoozed and active alarms
+        # Note that the occurrences found include those with alarm times equal
+        # to mint, which must be excluded because the first mint is the time
+        # that was last already activated, and the others belong to the
+        # previous windows; occurrences without alarm are excluded as well
+        filtered = {}
+
+        for id_, occs in occsd.get(self.filename, {}).iteritems():
+            occs = [occ for occ in occs if mint < occ.alarm <= maxt]
+
+            if occs:
+                filtered[id_] = occs
+
+        return filtered
+
+    def _iter_windows_occurrences(self):
+        # This generator is consumed by the handler of
+        # activate_occurrences_range_event, which is called with the databases
+        # blocked: they are released between the windows, so that activating
+        # many alarms does not block them for the whole time
+        # Each window's results are dropped as soon as they are activated
+        while self.windows:
+            occsd = self.windows.pop(0)
+            yield occsd
+
+            if self.windows:
+                core_api.release_databases()
+                core_api.block_databases(block=True)
+
+                # The database may have been closed meanwhile
+                if self.state != 2:
+                    break
 
+    def _process_results(self):
         search_old_occurrences_end_event.signal(filename=self.filename)
 
-        try:
-            occsdf = occsd[self.filename]
-        except KeyError:
-            pass
-        else:
-            # Note that occsdf still includes occurrence times equal to
-            # self.exclmint: these must be excluded because self.exclmint
-            # is the time that was last already activated
+        if self.count > 0:
             # The organism_alarms extension will check if the database is still
             # open while activating the alarms
             # Also note that as long as the handler of this event remains on
             # this thread, it's under the protection of
             # self._handle_save_permission_check
             activate_occurrences_range_event.signal(filename=self.filename,
-                        mint=self.exclmint, maxt=self.whileago, occsd=occsdf)
+                        mint=self.exclmint, maxt=self.whileago,
+                        count=self.count, lastoccsd=self.lastoccsd,
+                        iter_occsd=self._iter_windows_occurrences)
 
         core_api.bind_to_save_permission_check(
                                     self._handle_save_permission_check, False)
@@ -449,36 +629,67 @@ class OldOccurrencesSearch(object):
 
 
 class NextOccurrencesEngine(object):
-    def __init__(self, databases, rule_handlers):
+    def __init__(self, databases):
         # self.databases must be a live reference
         self.databases = databases
-        self.rule_handlers = rule_handlers
         self.thread = threading.Thread(target=int)
         self.queued = False
         self.timer = threading.Timer(0, int)
+        # filename -> ItemsNextOccurrences
+        self.items = {}
+        # filename -> set of the ids of the items whose rules have changed
+        self.changed_items = {}
+        self.changed_lock = threading.Lock()
+        # Serializes the searches, since they update self.items; it must be
+        # acquired before blocking the databases, otherwise two searches could
+        # deadlock each other
+        self.search_lock = threading.Lock()
+        self.time_zone = self._get_time_zone()
+
+    @staticmethod
+    def _get_time_zone():
+        return (time_.timezone, time_.altzone, time_.daylight, time_.tzname)
+
+    def set_item_changed(self, filename, id_):
+        # This is called on the main thread, while a search may be ongoing
+        with self.changed_lock:
+            self.changed_items.setdefault(filename, set()).add(id_)
+
+    def _pop_changed_items(self):
+        with self.changed_lock:
+            changed = self.changed_items
+            self.changed_items = {}
+
+        return changed
 
     def restart(self):
         # Allow only one restart request in the queue
         if not self.queued:
             self.queued = True
-            # There's no need to call self.thread.join because the search
-            # blocks the databases, so if another one is started, it will block
-            # until the previous one is finished anyway
+            # There's no need to call self.thread.join because the searches
+            # are serialized by self.search_lock
             self.thread = threading.Thread(target=self._restart)
             self.thread.name = "organism_engine"
             self.thread.start()
 
     def _restart(self):
+        with self.search_lock:
+            self._restart_locked()
+
+    def _restart_locked(self):
         # Note that this function must be kept separate from
         # NextOccurrencesSearch because the latter can be used without this
         # (e.g. by wxtasklist); note also that both functions generate their
         # own events
 
-        # Blocking here also prevents a second search from running
-        # simultaneously
-        core_api.block_databases(block=True)
+        # The search only reads the databases, so block them in shared mode,
+        # letting the other searches (e.g. wxtasklist's or the old occurrences
+        # one) run at the same time; the results are then applied after
+        # blocking the databases exclusively
+        core_api.block_databases_shared(block=True)
         self.queued = False
         log.debug('Search next occurrences')
+        search_start = (time_.time(), time_.clock())
 
         # Make sure to use the same set of filenames during the search, because
         #  self.databases itself could change meanwhile due to race conditions
@@ -486,18 +697,30 @@ class NextOccurrencesEngine(object):
 
         base_times = {filename: self.databases[filename].get_last_search() for
                                                         filename in filenames}
-        # For the moment there seems to be no need to stop the search if a
-        # database is closed, in fact the databases are blocked, and the search
-        # seems to terminate cleanly, and anyway it should take a reasonable
-        # time to complete
-        search = NextOccurrencesSearch(filenames, self.rule_handlers,
-                                                        base_times=base_times)
-        search.start()
-        occs = search.get_results()
+
+        self._update_items(filenames, base_times)
+        occs = self._get_next_occurrences(filenames, base_times)
+
+        log.debug('Next occurrences found in {} (time) / {} (clock) s'.format(
+                                              time_.time() - search_start[0],
+                                              time_.clock() - search_start[1]))
+
         next_occurrence = occs.get_next_occurrence_time()
         occsd = occs.get_dict()
         oldoccsd = occs.get_old_dict()
 
+        core_api.release_databases_shared()
+        core_api.block_databases(block=True)
+
+        # A database may have been closed while waiting for the exclusive
+        # block
+        filenames = [filename for filename in filenames
+                                            if filename in self.databases]
+        occsd = {filename: occsd[filename] for filename in occsd
+                                                if filename in self.databases}
+        oldoccsd = {filename: oldoccsd[filename] for filename in oldoccsd
+                                                if filename in self.databases}
+
         self.cancel()
 
         now = int(time_.time())
@@ -542,6 +765,100 @@ class NextOccurrencesEngine(object):
         # Note that this event is not protected in the databases block
         search_next_occurrences_event.signal()
 
+    def _update_items(self, filenames, base_times):
+        changed = self._pop_changed_items()
+        utcoffset = timeaux.UTCOffset()
+        time_zone = self._get_time_zone()
+
+        # The local occurrence times depend on the time zone, so if it has
+        # changed, search all the items again
+        if time_zone != self.time_zone:
+            self.time_zone = time_zone
+            self.items.clear()
+
+        for filename in self.items.keys():
+            if filename not in filenames:
+                del self.items[filename]
+
+        for filename in filenames:
+            base_time = base_times[filename]
+
+            try:
+                items = self.items[filename]
+            except KeyError:
+                items = None
+            else:
+                # The last search time should only move forward, otherwise the
+                # stored occurrences are not valid anymore
+                if base_time < items.base_time:
+                    items = None
+
+            if items is None:
+                items = ItemsNextOccurrences(filename, base_time)
+                self.items[filename] = items
+                itemrules = organism_api.iter_valid_item_rules_range(filename,
+                                                            base_time, None)
+            else:
+                ids = changed.get(filename, set())
+                ids.update(items.pop_reached(base_time))
+
+                for id_ in ids:
+                    items.discard(id_)
+
+                itemrules = organism_api.iter_valid_item_rules(filename,
+                                                                        ids)
+
+            self._search_items(items, base_time, utcoffset, itemrules)
+
+    def _search_items(self, items, base_time, utcoffset, itemrules):
+        filename = items.filename
+        utcbase = base_time - utcoffset.compute(base_time)
+
+        for id_, rules in itemrules:
+            # Search each item separately, otherwise the rule handlers would
+            # stop at the earliest occurrence among all the items
+            occs = NextOccurrences()
+
+            for rule in rules:
+                rule.search_next(base_time, utcbase, utcoffset, filename,
+                                                            id_, rule, occs)
+
+            try:
+                itemoccs = occs.get_dict()[filename][id_]
+            except KeyError:
+                itemoccs = []
+
+            items.set(id_, occs.get_next_occurrence_time(), itemoccs)
+
+    def _get_next_occurrences(self, filenames, base_times):
+        occs = NextOccurrences()
+        times = [self.items[filename].get_next_occurrence_time()
+                                                for filename in filenames]
+        times = [time for time in times if time is not None]
+
+        if times:
+            # Like in NextOccurrencesSearch, the next occurrence time is set
+            # even if all its occurrences have been excepted
+            next_occurrence = min(times)
+            occsd = {}
+
+            for filename in filenames:
+                occsdf = self.items[filename].get_next_occurrences(
+                                                            next_occurrence)
+
+                if occsdf:
+                    occsd[filename] = occsdf
+
+            occs.set_next_occurrences(next_occurrence, occsd)
+
+        # Let the other extensions (e.g. organism_alarms) add their own
+        # occurrences
+        for filename in filenames:
+            get_next_occurrences_event.signal(base_time=base_times[filename],
+                                                filename=filename, occs=occs)
+
+        return occs
+
     def cancel(self):
         if self.timer.is_alive():
             log.debug('Cancel timer')
@@ -26,9 +26,8 @@ def install_rule_handler(rulename, handler):
 
 
 def get_next_occurrences(base_time=None, base_times=None, filenames=()):
-    return timer.NextOccurrencesSearch(filenames,
-                                    extension.rules.handlers,
-                                    base_time=base_time, base_times=base_times)
+    return timer.NextOccurrencesSearch(filenames, base_time=base_time,
+                                                        base_times=base_times)
 
 
 def search_next_occurrences():
@@ -60,6 +59,12 @@ def bind_to_search_old_alarms(handler, bind=True):
     return timer.search_old_occurrences_event.bind(handler, bind)
 
 
+def bind_to_search_old_alarms_progress(handler, bind=True):
+    # Warning, this function is executed on a separate thread!!!
+    # (Check for race conditions)
+    return timer.search_old_occurrences_progress_event.bind(handler, bind)
+
+
 def bind_to_search_old_alarms_end(handler, bind=True):
     # Warning, this function is executed on a separate thread!!!
     # (Check for race conditions)
@@ -23,4 +23,4 @@ description = ("Adds the backend for cutting, copying and pasting database "
 website = "https://kynikos.github.io/outspline/"
 affects_database = False
 provides_tables = ("Copy", )
-dependencies = (("core", 4), )
+dependencies = (("core", 5), )
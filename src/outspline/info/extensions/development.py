@@ -22,4 +22,4 @@ description = "Development tools backend."
 website = "https://kynikos.github.io/outspline/"
 affects_database = False
 provides_tables = ()
-dependencies = (("core", 4), )
+dependencies = (("core", 5), )
@@ -17,11 +17,12 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
-version = "2.2"
+version = "4.0"
 description = "Adds the backend for storing schedule information for items."
 website = "https://kynikos.github.io/outspline/"
 affects_database = True
-provides_tables = ("Rules", "CopyRules")
-dependencies = (("core", 4), )
+provides_tables = ("Rules", "CopyRules", "Occurrences",
+                                                "OccurrencesProperties")
+dependencies = (("core", 5), )
 optional_dependencies = (("extensions.copypaste", 2), )
-database_dependency_group_1 = (("core", 4), ("extensions.organism", 2))
+database_dependency_group_1 = (("core", 5), ("extensions.organism", 4))
@@ -20,11 +20,11 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "1.3"
 description = "Development tools."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.development", 1),
+dependencies = (("core", 5), ("extensions.development", 1),
                 ("interfaces.wxgui", 3))
-optional_dependencies = (("extensions.organism", 2),
-                        ("extensions.organism_alarms", 1),
-                        ("extensions.links", 1),
+optional_dependencies = (("extensions.organism", 4),
+                        ("extensions.organism_alarms", 2),
+                        ("extensions.links", 2),
                         ("plugins.wxcopypaste", 1),
                         ("plugins.wxscheduler", 2),
                         ("plugins.wxscheduler_basicrules", 1),
@@ -20,6 +20,6 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "1.4"
 description = "Adds a schedule that displays the items events/tasks."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.organism", 2),
+dependencies = (("core", 5), ("extensions.organism", 4),
                 ("extensions.organism_timer", 1),
-                ("extensions.organism_alarms", 1), ("interfaces.wxgui", 3))
+                ("extensions.organism_alarms", 2), ("interfaces.wxgui", 3))
@@ -127,7 +127,7 @@ def save_database_as(origin):
 
         if destination:
             try:
-                core_api.save_database_copy(origin, destination)
+                _save_database_copy(origin, destination)
             except OutsplineError as err:
                 # This will leave the new created file empty, see bug #322
                 warn_aborted_save(err)
@@ -143,12 +143,32 @@ def save_database_backup(origin):
 
     if destination:
         try:
-            core_api.save_database_copy(origin, destination)
+            _save_database_copy(origin, destination)
         except OutsplineError as err:
             # This will leave the new created file empty, see bug #322
             warn_aborted_save(err)
 
 
+def _save_database_copy(origin, destination):
+    # The copy is made in steps, show its progress while it lasts
+    dialog = wx.ProgressDialog("Saving copy", "Copying {}".format(
+                        os.path.basename(origin)), maximum=1000,
+                        parent=wx.GetApp().root,
+                        style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
+
+    def handle_progress(kwargs):
+        if kwargs['filename'] == origin and kwargs['total'] > 0:
+            dialog.Update(min(kwargs['done'] * 1000 // kwargs['total'], 999))
+
+    core_api.bind_to_save_database_copy_progress(handle_progress)
+
+    try:
+        core_api.save_database_copy(origin, destination)
+    finally:
+        core_api.bind_to_save_database_copy_progress(handle_progress, False)
+        dialog.Destroy()
+
+
 def close_database(filename, no_confirm=False, exit_=False):
     # Do not use nb_left.select_tab() to get the tree, use tree.dbs
     nbl = wx.GetApp().nb_left
@@ -282,6 +282,7 @@ class Database(wx.SplitterWindow):
                                                         self._popup_item_menu)
 
         core_api.bind_to_insert_item(self._handle_insert_item)
+        core_api.bind_to_insert_items(self._handle_insert_items)
         core_api.bind_to_update_item_text(self._handle_update_item_text)
         core_api.bind_to_deleting_item(self._handle_deleting_item)
         core_api.bind_to_deleted_item_2(self._handle_deleted_item)
@@ -324,6 +325,14 @@ class Database(wx.SplitterWindow):
             parent = self.get_tree_item_safe(kwargs['parent'])
             self._insert_item(parent, kwargs['id_'], kwargs['text'])
 
+    def _handle_insert_items(self, kwargs):
+        if kwargs['filename'] == self.filename:
+            # The items are in document order, so parents always come before
+            # their children
+            for item in kwargs['items']:
+                parent = self.get_tree_item_safe(item['parent'])
+                self._insert_item(parent, item['id_'], item['text'])
+
     def _handle_update_item_text(self, kwargs):
         # Don't update an item label only when editing the text area, as there
         # may be other plugins that edit an item's text (e.g links)
@@ -344,7 +353,9 @@ class Database(wx.SplitterWindow):
 
     def _handle_history_insert(self, kwargs):
         if kwargs['filename'] == self.filename:
-            self._init_item_data(kwargs["id_"], kwargs["text"])
+            for item in kwargs['items']:
+                self._init_item_data(item["id_"], item["text"])
+
             self._request_tree_reset()
 
     def _handle_history_update_simple(self, kwargs):
@@ -357,13 +368,16 @@ class Database(wx.SplitterWindow):
 
     def _handle_history_update_text(self, kwargs):
         if kwargs['filename'] == self.filename:
-            id_ = kwargs['id_']
-            self._set_item_label(id_, kwargs['text'])
-            self.request_item_refresh(id_)
+            for item in kwargs['items']:
+                id_ = item['id_']
+                self._set_item_label(id_, item['text'])
+                self.request_item_refresh(id_)
 
     def _handle_history_remove(self, kwargs):
         if kwargs['filename'] == self.filename:
-            self._remove_item_data(kwargs['id_'])
+            for item in kwargs['items']:
+                self._remove_item_data(item['id_'])
+
             self._request_tree_reset()
 
     def _request_tree_reset(self):
@@ -647,18 +661,24 @@ class Database(wx.SplitterWindow):
         group = core_api.get_next_history_group(self.filename)
         roots = core_api.find_independent_items(self.filename, ids)
 
-        for root in roots:
-            rootpid = core_api.get_item_parent(self.filename, root)
+        # Trim the history only once after deleting all the subtrees
+        core_api.begin_history_group(self.filename)
+
+        try:
+            for root in roots:
+                rootpid = core_api.get_item_parent(self.filename, root)
 
-            core_api.delete_subtree(self.filename, root, group=group,
+                core_api.delete_subtree(self.filename, root, group=group,
                                                     description=description)
 
-            if rootpid > 0:
-                rootpid2 = core_api.get_item_parent(self.filename, rootpid)
-                rootparent2 = self.get_tree_item_safe(rootpid2)
+                if rootpid > 0:
+                    rootpid2 = core_api.get_item_parent(self.filename, rootpid)
+                    rootparent2 = self.get_tree_item_safe(rootpid2)
 
-                self._refresh_item_arrow(rootparent2, rootpid,
+                    self._refresh_item_arrow(rootparent2, rootpid,
                                                 self.get_tree_item(rootpid))
+        finally:
+            core_api.commit_history_group(self.filename)
 
     def _refresh_item_arrow(self, parent, id_, item):
         if not core_api.has_item_children(self.filename, id_):
@@ -186,7 +186,8 @@ class SearchView(object):
             # terminated: this is safe as no more calls to the databases are
             # made after core_api.get_all_items_text in
             # self._finish_search_restart_database
-            if core_api.block_databases():
+            # Searching only reads the databases
+            if core_api.block_databases_shared():
                 if self.filters.option1.GetValue():
                     filename = wxgui_api.get_selected_database_filename()
                     self._finish_search_restart_database(filename, regexp)
@@ -198,7 +199,7 @@ class SearchView(object):
                 # terminated: this is safe as no more calls to the databases
                 # are made after core_api.get_all_items_text in
                 # self._finish_search_restart_database
-                core_api.release_databases()
+                core_api.release_databases_shared()
             else:
                 self.finish_search()
 
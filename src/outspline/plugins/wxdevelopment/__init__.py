@@ -196,45 +196,60 @@ class MenuDev(wx.Menu):
             if filename:
                 group = core_api.get_next_history_group(filename)
                 description = 'Populate tree'
-                i = 0
-
-                while i < 10:
-                    dbitems = core_api.get_items_ids(filename)
-
-                    try:
-                        itemid = random.choice(dbitems)
-                    except IndexError:
-                        # No items in the database yet
-                        itemid = 0
-                        mode = 'child'
-                    else:
-                        mode = random.choice(('child', 'sibling'))
-
-                        # See the comment in wxgui.tree.expand_item_ancestors
-                        #  for the reason why calling this method is necessary
-                        wxgui_api.expand_item_ancestors(filename, itemid)
-
-
-                    text = self._populate_tree_text()
-
-                    id_ = self._populate_tree_item(mode, filename, itemid,
-                                                    group, text, description)
-
-                    # It should also be checked if the database supports
-                    #  organism_basicrules (bug #330)
-                    if organism_api and wxscheduler_basicrules_api and \
-                            filename in \
-                            organism_api.get_supported_open_databases():
-                        self._populate_tree_rules(filename, id_, group,
-                                                            description)
-
-                    if links_api and wxlinks_api and len(dbitems) > 0 and \
-                                    filename in \
-                                    links_api.get_supported_open_databases():
-                        self._populate_tree_link(filename, id_, dbitems, group,
+                dbitems = core_api.get_items_ids(filename)
+
+                try:
+                    itemid = random.choice(dbitems)
+                except IndexError:
+                    # No items in the database yet
+                    itemid = 0
+                    mode = 'child'
+                else:
+                    mode = random.choice(('child', 'sibling'))
+
+                    # See the comment in wxgui.tree.expand_item_ancestors
+                    #  for the reason why calling this method is necessary
+                    wxgui_api.expand_item_ancestors(filename, itemid)
+
+                # Build a random subtree of 10 items and insert it at once
+                rows = []
+                branches = [rows]
+
+                for i in xrange(10):
+                    children = []
+                    random.choice(branches).append(
+                                        (self._populate_tree_text(), children))
+                    branches.append(children)
+
+                core_api.begin_history_group(filename)
+
+                try:
+                    if mode == 'child':
+                        ids = core_api.insert_items_bulk(filename, itemid,
+                                            None, rows, group=group,
+                                            description=description)
+                    elif mode == 'sibling':
+                        ids = core_api.insert_items_bulk(filename,
+                                    core_api.get_item_parent(filename, itemid),
+                                    itemid, rows, group=group,
+                                    description=description)
+
+                    for id_ in ids:
+                        # It should also be checked if the database supports
+                        #  organism_basicrules (bug #330)
+                        if organism_api and wxscheduler_basicrules_api and \
+                                filename in \
+                                organism_api.get_supported_open_databases():
+                            self._populate_tree_rules(filename, id_, group,
                                                                 description)
 
-                    i += 1
+                        if links_api and wxlinks_api and \
+                                    len(dbitems) > 0 and filename in \
+                                    links_api.get_supported_open_databases():
+                            self._populate_tree_link(filename, id_, dbitems,
+                                                        group, description)
+                finally:
+                    core_api.commit_history_group(filename)
 
                 wxgui_api.refresh_history(filename)
             core_api.release_databases()
@@ -250,15 +265,6 @@ class MenuDev(wx.Menu):
 
         return ''.join((text, random.choice(words))).capitalize()
 
-    def _populate_tree_item(self, mode, filename, itemid, group, text,
-                                                                description):
-        if mode == 'child':
-            return core_api.append_item(filename, itemid, group, text=text,
-                                                    description=description)
-        elif mode == 'sibling':
-            return core_api.insert_item_after(filename, itemid, group,
-                                            text=text, description=description)
-
     def _populate_tree_rules(self, filename, id_, group, description):
         rules = []
 
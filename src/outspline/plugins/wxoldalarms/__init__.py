@@ -51,6 +51,8 @@ class Dialogs(object):
         # thread, so while the dialog is creating, the call for closing it,
         # even if triggered, has to wait for the dialog to be created
         organism_timer_api.bind_to_search_old_alarms(self._enable_search)
+        organism_timer_api.bind_to_search_old_alarms_progress(
+                                                        self._update_search)
         organism_timer_api.bind_to_search_old_alarms_end(self._disable_search)
 
         organism_alarms_api.bind_to_activate_alarms_range(
@@ -78,6 +80,11 @@ class Dialogs(object):
         else:
             dialog.create()
 
+    def _update_search(self, kwargs):
+        # This method is called from another thread
+        wx.CallAfter(self.search_dialogs[kwargs['filename']].set_progress,
+                                kwargs['mint'], kwargs['maxt'], kwargs['time'])
+
     def _disable_search(self, kwargs):
         filename = kwargs['filename']
 
@@ -135,10 +142,13 @@ class Dialogs(object):
 
 
 class DialogSearch(object):
+    GAUGE_RANGE = 1000
+
     def __init__(self, filename, last_search):
         self.filename = filename
         self.last_search = last_search
         self.dialog = None
+        self.progress = None
         self.WRAP = 320
 
     def create(self):
@@ -168,7 +178,7 @@ class DialogSearch(object):
         self.label1.Wrap(self.WRAP)
         hsizer1.Add(self.label1)
 
-        self.gauge = wx.Gauge(self.dialog)
+        self.gauge = wx.Gauge(self.dialog, range=self.GAUGE_RANGE)
         vsizer.Add(self.gauge, flag=wx.EXPAND | wx.BOTTOM, border=4)
         self.timer = wx.CallLater(100, self._pulse)
 
@@ -208,9 +218,21 @@ class DialogSearch(object):
         self.dialog.Show()
 
     def _pulse(self):
-        self.gauge.Pulse()
+        # The search reports its progress after each searched time window,
+        # before the first one the gauge just pulses
+        if self.progress is None:
+            self.gauge.Pulse()
+        else:
+            self.gauge.SetValue(self.progress)
+
         self.timer.Restart()
 
+    def set_progress(self, mint, maxt, time):
+        # The dialog may not have been created yet, so only store the value
+        # and let self._pulse show it
+        if maxt > mint:
+            self.progress = (time - mint) * self.GAUGE_RANGE // (maxt - mint)
+
     def _restrict_search(self, event):
         value = self.number.GetValue()
         mint = int(time_.time()) - value * 86400
@@ -278,6 +278,9 @@ class Navigator(object):
     def get_default_configuration(self):
         return self.configuration.get_default()
 
+    def get_adjacent_configurations(self, config):
+        return self.configuration.compute_adjacent_configurations(config)
+
     def save_configuration(self):
         self.config['show_navigator'] = 'yes' if self.is_shown() else 'no'
         self.configuration.clear_on_file()
@@ -349,6 +352,19 @@ class FilterConfiguration(object):
         self._set_current(nconfig)
         return nconfig
 
+    def compute_adjacent_configurations(self, config):
+        # Unlike the methods above, do not change the current configuration
+        filterconf = self.modes_to_filters[config['mode']]
+        configs = []
+
+        for mode in (-1, 1):
+            try:
+                configs.append(filterconf.compute_adjacent(config, mode))
+            except SearchOutOfRangeError:
+                pass
+
+        return configs
+
     def clear_on_file(self):
         # The DefaultFilter section must be reset (not simply upgraded) in the
         # configuration file, otherwise the old options will be left
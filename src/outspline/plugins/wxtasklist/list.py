@@ -532,10 +532,14 @@ class RefreshEngine(object):
         self.occs = occs
         self.activealarms = {}
         self.TIMER_NAME = "wxtasklist_engine"
+        self.PREFETCH_NAME = "wxtasklist_prefetch"
         self.DELAY = config.get_int('refresh_delay')
         self.LIMIT = config.get_int('maximum_items')
         self.DEBUG_MODE = config.get_bool("debug_mode")
+        self.PREFETCH = config.get_bool("prefetch_adjacent_pages")
         self.pastN = 0
+        self.adjacent_filters = []
+        self.prefetch = None
 
         self.filterclasses = {
             'relative': filters.FilterRelative,
@@ -590,6 +594,8 @@ class RefreshEngine(object):
 
         self.cancel_request = False
 
+        self._cancel_prefetch()
+
     def enable(self):
         core_api.bind_to_update_item_text(self._delay_restart_on_text_update)
         # The old occurrences are searched on a separate thread, so they may be
@@ -624,6 +630,9 @@ class RefreshEngine(object):
 
     def set_filter(self, config):
         self.filter_ = self.filterclasses[config['mode']](config)
+        nconfigs = self.occview.navigator.get_adjacent_configurations(config)
+        self.adjacent_filters = [self.filterclasses[nconfig['mode']](nconfig)
+                                                    for nconfig in nconfigs]
 
     def get_past_count(self):
         return self.pastN
@@ -704,9 +713,11 @@ class RefreshEngine(object):
                     wx.CallAfter(self._refresh_end, delay)
 
     def _refresh_continue(self):
+        # Do not keep generating occurrences that would be discarded anyway
         self.search = organism_api.get_occurrences_range(mint=self.min_time,
                         maxt=self.max_time,
-                        filenames=organism_api.get_supported_open_databases())
+                        filenames=organism_api.get_supported_open_databases(),
+                        limit=self.LIMIT)
 
         try:
             self.search.start()
@@ -727,9 +738,13 @@ class RefreshEngine(object):
         if self.cancel_request:
             raise RefreshEngineStop()
 
+        if self.search.is_limit_exceeded():
+            raise RefreshEngineLimit()
+
         occsobj = self.search.get_results()
         occurrences = occsobj.get_list()
 
+        # The active alarms may also have added some occurrences
         if len(occurrences) > self.LIMIT:
             raise RefreshEngineLimit()
 
@@ -776,6 +791,67 @@ class RefreshEngine(object):
     def _refresh_end(self, delay):
         self.occview.insert_items()
         self._restart(delay)
+        self._start_prefetch()
+
+    def _start_prefetch(self):
+        # Search the previous and the next pages of the navigator in the
+        # background, so that their results are already in organism's range
+        # cache when they are shown
+        # Note that self._restart has already cancelled the previous prefetch
+        if self.PREFETCH and self.adjacent_filters:
+            # Each prefetch has its own state, so that a cancelled prefetch
+            # that is still finishing cannot be confused with the next one
+            self.prefetch = {'cancel': False, 'search': None}
+            thread = threading.Thread(target=self._prefetch_adjacent_pages,
+                        args=(self.prefetch, self.now, self.adjacent_filters),
+                        name=self.PREFETCH_NAME)
+            thread.start()
+
+    def _cancel_prefetch(self):
+        # This is called on the main thread, so do not join the prefetch
+        # thread here: stopping its search is enough to make it exit as soon
+        # as the current query has completed; if its database is being closed,
+        # the core waits for the connection to be given back before closing it
+        if self.prefetch:
+            self.prefetch['cancel'] = True
+
+            try:
+                self.prefetch['search'].stop()
+            except AttributeError:
+                # The prefetch may not have started a search yet
+                pass
+
+            self.prefetch = None
+
+    def _prefetch_adjacent_pages(self, prefetch, now, adjacent_filters):
+        filenames = organism_api.get_supported_open_databases()
+
+        for filter_ in adjacent_filters:
+            try:
+                mint, maxt = filter_.compute_limits(now)
+            except SearchOutOfRangeError:
+                continue
+
+            if mint < self.filterlimits[0] or maxt > self.filterlimits[1]:
+                continue
+
+            prefetch['search'] = organism_api.get_occurrences_range(
+                                mint=mint, maxt=maxt, filenames=filenames,
+                                limit=self.LIMIT)
+
+            # Check the request only after setting prefetch['search'],
+            # otherwise _cancel_prefetch could miss the search
+            if prefetch['cancel']:
+                break
+
+            try:
+                prefetch['search'].start()
+            except:
+                # The errors are reported when the page is actually shown,
+                # see self._refresh_continue; this includes the errors of a
+                # prefetch whose database has been closed in the meantime
+                if self.DEBUG_MODE:
+                    raise
 
     def _insert_occurrence(self, occurrence):
         item = ListRegularItem(occurrence, self, self.now, self.formatter)
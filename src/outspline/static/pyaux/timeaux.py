@@ -17,12 +17,24 @@
 # along with pyaux.  If not, see <http://www.gnu.org/licenses/>.
 
 import time as time_
+from bisect import bisect_right
 
 
 class UTCOffset(object):
     """
     Tools for computing UTC time offsets.
     """
+    # Length in seconds of the periods whose DST transitions are tabulated
+    #  together
+    TABLE_SPAN = 365 * 86400
+    # Sampling step used to look for the DST transitions; two transitions
+    #  closer than this would be missed
+    TABLE_STEP = 86400
+    # The transition tables, keyed by period number, are shared by all the
+    #  instances, and reset whenever the time zone changes
+    _tables = {}
+    _tables_zone = None
+
     def __init__(self):
         """
         Instantiating the class is recommended if computing offsets for several
@@ -31,7 +43,18 @@ class UTCOffset(object):
         if time_.daylight == 0:
             self.compute = self._compute_fixed
         else:
-            self.compute = self._compute_variable
+            zone = (time_.timezone, time_.altzone, time_.tzname)
+
+            if zone != UTCOffset._tables_zone:
+                UTCOffset._tables = {}
+                UTCOffset._tables_zone = zone
+
+            # The last used interval with a constant offset; consecutive
+            #  timestamps are usually in the same interval
+            self._low = 0
+            self._high = 0
+            self._offset = None
+            self.compute = self._compute_table
 
     def compute(self, timestamp):
         """
@@ -42,6 +65,36 @@ class UTCOffset(object):
         # constructor
         pass
 
+    def compute_many(self, timestamps):
+        """
+        Return the list of the local UTC offsets for the given timestamps, also
+        taking DST into account.
+        """
+        if self.compute == self._compute_fixed:
+            return [time_.timezone] * len(timestamps)
+        else:
+            offsets = []
+
+            for timestamp in timestamps:
+                if self._low <= timestamp < self._high:
+                    offsets.append(self._offset)
+                else:
+                    offsets.append(self._compute_table(timestamp))
+
+            return offsets
+
+    def compute_limit(self, timestamp):
+        """
+        Return the local UTC offset for the given timestamp, also taking DST
+        into account, and the first later timestamp whose offset may be
+        different, or None if the offset never changes.
+        """
+        if self.compute == self._compute_fixed:
+            return (time_.timezone, None)
+        else:
+            offset = self._compute_table(timestamp)
+            return (offset, self._high)
+
     @classmethod
     def compute2(cls, timestamp):
         """
@@ -61,6 +114,71 @@ class UTCOffset(object):
         else:
             return time_.altzone
 
+    def _compute_table(self, timestamp):
+        if self._low <= timestamp < self._high:
+            return self._offset
+
+        period = int(timestamp // self.TABLE_SPAN)
+
+        try:
+            starts, offsets = self._tables[period]
+        except KeyError:
+            starts, offsets = self._tables[period] = self._make_table(period)
+
+        index = bisect_right(starts, timestamp) - 1
+        self._low = starts[index]
+
+        try:
+            self._high = starts[index + 1]
+        except IndexError:
+            self._high = (period + 1) * self.TABLE_SPAN
+
+        self._offset = offsets[index]
+
+        return self._offset
+
+    @classmethod
+    def _make_table(cls, period):
+        # Return the sorted start times of the constant-offset intervals in
+        #  the period, starting with the start of the period itself, and the
+        #  respective offsets
+        start = period * cls.TABLE_SPAN
+        end = start + cls.TABLE_SPAN
+        offset = cls._compute_variable(start)
+        starts = [start]
+        offsets = [offset]
+        time = start
+
+        while time < end:
+            next_time = min(time + cls.TABLE_STEP, end)
+            next_offset = cls._compute_variable(next_time)
+
+            if next_offset != offset:
+                # Bisect the transition instant, i.e. the first second with
+                #  the new offset
+                low = time
+                high = next_time
+
+                while high - low > 1:
+                    middle = (low + high) // 2
+
+                    if cls._compute_variable(middle) == offset:
+                        low = middle
+                    else:
+                        high = middle
+
+                # A transition exactly at the end of the period belongs to
+                #  the next one
+                if high < end:
+                    starts.append(high)
+                    offsets.append(next_offset)
+
+                offset = next_offset
+
+            time = next_time
+
+        return (starts, offsets)
+
     def compute_current(self):
         """
         Return the current local UTC offset, also taking DST into account.